@@ -47,11 +47,13 @@ SOURCE_FILES = [
     'kin_cartesian.c', 'kin_corexy.c', 'kin_corexz.c', 'kin_delta.c',
     'kin_deltesian.c', 'kin_polar.c', 'kin_rotary_delta.c', 'kin_winch.c',
     'kin_extruder.c', 'kin_shaper.c', 'serial_485_queue.c', 'msgblock_485.c', 'filament_change.c',
+    'moveq.c',
 ]
 DEST_LIB = "c_helper.so"
 OTHER_FILES = [
     'list.h', 'serialqueue.h', 'stepcompress.h', 'itersolve.h', 'pyhelper.h',
     'trapq.h', 'pollreactor.h', 'msgblock.h', 'serial_485_queue.h', 'msgblock_485.h',
+    'moveq.h',
 ]
 
 defs_stepcompress = """
@@ -115,7 +117,7 @@ defs_trapq = """
         double next_move_time;
     }append_return_t;
 
-    append_return_t trapq_append_from_moveq(struct trapq *tq_kinematic, struct trapq *tq_extruder,double next_move_time,unsigned int move_data_h,int move_num);
+    append_return_t trapq_append_from_moveq(struct trapq *tq_kinematic, struct trapq *tq_extruder,double next_move_time,uintptr_t move_data_h,int move_num);
 
     void trapq_append(struct trapq *tq, double print_time
         , double accel_t, double cruise_t, double decel_t
@@ -131,6 +133,39 @@ defs_trapq = """
         , double start_time, double end_time);
 """
 
+defs_moveq = """
+    struct moveq_move {
+        double start_pos[4];
+        double end_pos[4];
+        double start_v, cruise_v, end_v;
+        double accel_t, cruise_t, decel_t;
+        double accel;
+        double junction_deviation;
+        int is_kinematic_move;
+        double axes_d[4];
+        double move_d;
+        double axes_r[4];
+        double min_move_t;
+        double max_start_v2;
+        double max_cruise_v2;
+        double delta_v2;
+        double max_smoothed_v2;
+        double smooth_delta_v2;
+        struct moveq_move *next;
+    };
+
+    struct moveq *moveq_alloc(void);
+    void moveq_free(struct moveq *mq);
+    struct moveq_move *moveq_prepare(struct moveq *mq, double *start_pos
+        , double *end_pos, double speed, double max_velocity, double accel
+        , double accel_to_decel, double junction_deviation);
+    void moveq_limit_speed(struct moveq_move *m, double speed, double accel);
+    int moveq_commit(struct moveq *mq, double extruder_corner_v);
+    int moveq_flush(struct moveq *mq, int lazy);
+    struct moveq_move *moveq_get_moves(struct moveq *mq, int count);
+    void moveq_del(struct moveq *mq, int count);
+"""
+
 defs_kin_cartesian = """
     struct stepper_kinematics *cartesian_stepper_alloc(char axis);
     struct stepper_kinematics *cartesian_reverse_stepper_alloc(char axis);
@@ -211,7 +246,15 @@ defs_serialqueue = """
         , int receive_window);
     void serialqueue_set_clock_est(struct serialqueue *sq, double est_freq
         , double conv_time, uint64_t conv_clock, uint64_t last_clock);
+    struct serialqueue_stats {
+        uint32_t bytes_write, bytes_read, bytes_retransmit, bytes_invalid;
+        uint32_t send_seq, receive_seq, retransmit_seq;
+        double srtt, rttvar, rto;
+        int32_t ready_bytes, stalled_bytes;
+    };
     void serialqueue_get_stats(struct serialqueue *sq, char *buf, int len);
+    void serialqueue_get_stats_values(struct serialqueue *sq
+        , struct serialqueue_stats *stats);
     int serialqueue_extract_old(struct serialqueue *sq, int sentq
         , struct pull_queue_message *q, int max);
 """
@@ -261,7 +304,7 @@ defs_filament_change = """
 
 defs_all = [
     defs_pyhelper, defs_serialqueue, defs_std, defs_stepcompress,
-    defs_itersolve, defs_trapq, defs_trdispatch,
+    defs_itersolve, defs_trapq, defs_moveq, defs_trdispatch,
     defs_kin_cartesian, defs_kin_corexy, defs_kin_corexz, defs_kin_delta,
     defs_kin_deltesian, defs_kin_polar, defs_kin_rotary_delta, defs_kin_winch,
     defs_kin_extruder, defs_kin_shaper, defs_serial_485_queue, defs_filament_change,
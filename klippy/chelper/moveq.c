@@ -0,0 +1,286 @@
+// Reference look-ahead move queue (junction velocity and trapezoid planning)
+//
+// Copyright (C) 2025 K2 Unleashed Contributors
+//
+// This file may be distributed under the terms of the GNU GPLv3 license.
+
+#include <math.h> // sqrt
+#include <stdlib.h> // malloc
+#include <string.h> // memset
+#include "compiler.h" // __visible
+#include "moveq.h" // struct moveq
+
+#define MIN_MOVE_D .000000001
+#define EXTRUDE_ONLY_ACCEL 99999999.9
+
+// Allocate a new 'moveq' object
+struct moveq * __visible
+moveq_alloc(void)
+{
+    struct moveq *mq = malloc(sizeof(*mq));
+    memset(mq, 0, sizeof(*mq));
+    return mq;
+}
+
+// Free memory associated with a 'moveq' object
+void __visible
+moveq_free(struct moveq *mq)
+{
+    if (!mq)
+        return;
+    free(mq->moves);
+    free(mq->delayed);
+    free(mq);
+}
+
+// Fill the pending move from a requested start/end position
+struct moveq_move * __visible
+moveq_prepare(struct moveq *mq, double *start_pos, double *end_pos
+              , double speed, double max_velocity, double accel
+              , double accel_to_decel, double junction_deviation)
+{
+    struct moveq_move *m = &mq->pending;
+    memset(m, 0, sizeof(*m));
+    double velocity = speed < max_velocity ? speed : max_velocity;
+    m->accel = accel;
+    m->junction_deviation = junction_deviation;
+    m->is_kinematic_move = 1;
+    int i;
+    for (i=0; i<4; i++) {
+        m->start_pos[i] = start_pos[i];
+        m->end_pos[i] = end_pos[i];
+        m->axes_d[i] = end_pos[i] - start_pos[i];
+    }
+    double move_d = sqrt(m->axes_d[0]*m->axes_d[0] + m->axes_d[1]*m->axes_d[1]
+                         + m->axes_d[2]*m->axes_d[2]);
+    double inv_move_d = 0.;
+    if (move_d < MIN_MOVE_D) {
+        // Extrude only move
+        for (i=0; i<3; i++) {
+            m->end_pos[i] = start_pos[i];
+            m->axes_d[i] = 0.;
+        }
+        move_d = fabs(m->axes_d[3]);
+        if (move_d)
+            inv_move_d = 1. / move_d;
+        m->accel = EXTRUDE_ONLY_ACCEL;
+        velocity = speed;
+        m->is_kinematic_move = 0;
+    } else {
+        inv_move_d = 1. / move_d;
+    }
+    m->move_d = move_d;
+    for (i=0; i<4; i++)
+        m->axes_r[i] = m->axes_d[i] * inv_move_d;
+    m->min_move_t = velocity ? move_d / velocity : 0.;
+    m->max_cruise_v2 = velocity * velocity;
+    m->delta_v2 = 2. * move_d * m->accel;
+    m->smooth_delta_v2 = 2. * move_d * accel_to_decel;
+    return m;
+}
+
+// Reduce the speed and acceleration of a move (from check_move())
+void __visible
+moveq_limit_speed(struct moveq_move *m, double speed, double accel)
+{
+    double speed2 = speed * speed;
+    if (speed2 < m->max_cruise_v2) {
+        m->max_cruise_v2 = speed2;
+        m->min_move_t = m->move_d / speed;
+    }
+    if (accel < m->accel)
+        m->accel = accel;
+    m->delta_v2 = 2. * m->move_d * m->accel;
+    if (m->delta_v2 < m->smooth_delta_v2)
+        m->smooth_delta_v2 = m->delta_v2;
+}
+
+static inline double
+min2(double a, double b)
+{
+    return a < b ? a : b;
+}
+
+// Find the maximum junction velocity between two moves
+static void
+calc_junction(struct moveq_move *prev, struct moveq_move *m
+              , double extruder_corner_v)
+{
+    if (!m->is_kinematic_move || !prev->is_kinematic_move)
+        return;
+    // Allow extruder to calculate its maximum junction
+    double extruder_v2 = m->max_cruise_v2;
+    double diff_r = m->axes_r[3] - prev->axes_r[3];
+    if (diff_r && extruder_corner_v >= 0.) {
+        double v = extruder_corner_v / fabs(diff_r);
+        extruder_v2 = v * v;
+    }
+    // Find max velocity using "approximated centripetal velocity"
+    double junction_cos_theta = -(m->axes_r[0] * prev->axes_r[0]
+                                  + m->axes_r[1] * prev->axes_r[1]
+                                  + m->axes_r[2] * prev->axes_r[2]);
+    if (junction_cos_theta > 0.999999)
+        return;
+    if (junction_cos_theta < -0.999999)
+        junction_cos_theta = -0.999999;
+    double sin_theta_d2 = sqrt(0.5 * (1. - junction_cos_theta));
+    double R_jd = sin_theta_d2 / (1. - sin_theta_d2);
+    // Approximated circle must contact moves no further away than mid-move
+    double tan_theta_d2 = sin_theta_d2 / sqrt(0.5 * (1. + junction_cos_theta));
+    double move_centripetal_v2 = .5 * m->move_d * tan_theta_d2 * m->accel;
+    double pmove_centripetal_v2 = (.5 * prev->move_d * tan_theta_d2
+                                   * prev->accel);
+    double v2 = R_jd * m->junction_deviation * m->accel;
+    v2 = min2(v2, R_jd * prev->junction_deviation * prev->accel);
+    v2 = min2(v2, move_centripetal_v2);
+    v2 = min2(v2, pmove_centripetal_v2);
+    v2 = min2(v2, extruder_v2);
+    v2 = min2(v2, m->max_cruise_v2);
+    v2 = min2(v2, prev->max_cruise_v2);
+    v2 = min2(v2, prev->max_start_v2 + prev->delta_v2);
+    m->max_start_v2 = v2;
+    m->max_smoothed_v2 = min2(v2, prev->max_smoothed_v2
+                              + prev->smooth_delta_v2);
+}
+
+// Append the pending move to the queue; returns the queue length
+int __visible
+moveq_commit(struct moveq *mq, double extruder_corner_v)
+{
+    if (mq->count >= mq->alloc) {
+        int alloc = mq->alloc ? mq->alloc * 2 : 64;
+        struct moveq_move *moves = realloc(mq->moves, alloc * sizeof(*moves));
+        struct moveq_delayed *delayed = realloc(
+            mq->delayed, alloc * sizeof(*delayed));
+        if (!moves || !delayed) {
+            // realloc() failures leave the old blocks valid
+            if (moves)
+                mq->moves = moves;
+            if (delayed)
+                mq->delayed = delayed;
+            return -1;
+        }
+        mq->moves = moves;
+        mq->delayed = delayed;
+        mq->alloc = alloc;
+    }
+    struct moveq_move *m = &mq->moves[mq->count];
+    *m = mq->pending;
+    if (mq->count)
+        calc_junction(&mq->moves[mq->count - 1], m, extruder_corner_v);
+    return ++mq->count;
+}
+
+// Set the trapezoid of a move from its start, cruise and end velocity
+static void
+set_junction(struct moveq_move *m, double start_v2, double cruise_v2
+             , double end_v2)
+{
+    double half_inv_accel = .5 / m->accel;
+    double accel_d = (cruise_v2 - start_v2) * half_inv_accel;
+    double decel_d = (cruise_v2 - end_v2) * half_inv_accel;
+    double cruise_d = m->move_d - accel_d - decel_d;
+    double start_v = m->start_v = sqrt(start_v2);
+    double cruise_v = m->cruise_v = sqrt(cruise_v2);
+    double end_v = m->end_v = sqrt(end_v2);
+    m->accel_t = accel_d / ((start_v + cruise_v) * 0.5);
+    m->cruise_t = cruise_d / cruise_v;
+    m->decel_t = decel_d / ((end_v + cruise_v) * 0.5);
+}
+
+// Plan velocities for the queue; returns the number of moves that
+// may be flushed (the leading moves whose trapezoids are now final)
+int __visible
+moveq_flush(struct moveq *mq, int lazy)
+{
+    struct moveq_move *moves = mq->moves;
+    struct moveq_delayed *delayed = mq->delayed;
+    int update_flush_count = lazy, flush_count = mq->count, ndelayed = 0;
+    // Traverse queue from last to first move and determine maximum
+    // junction speed assuming the robot comes to a complete stop
+    // after the last move.
+    double next_end_v2 = 0., next_smoothed_v2 = 0., peak_cruise_v2 = 0.;
+    int i;
+    for (i=flush_count-1; i>=0; i--) {
+        struct moveq_move *m = &moves[i];
+        double reachable_start_v2 = next_end_v2 + m->delta_v2;
+        double start_v2 = min2(m->max_start_v2, reachable_start_v2);
+        double reachable_smoothed_v2 = next_smoothed_v2 + m->smooth_delta_v2;
+        double smoothed_v2 = min2(m->max_smoothed_v2, reachable_smoothed_v2);
+        if (smoothed_v2 < reachable_smoothed_v2) {
+            // It's possible for this move to accelerate
+            if (smoothed_v2 + m->smooth_delta_v2 > next_smoothed_v2
+                || ndelayed) {
+                // This move can decelerate or this is a full accel
+                // move after a full decel move
+                if (update_flush_count && peak_cruise_v2) {
+                    flush_count = i;
+                    update_flush_count = 0;
+                }
+                peak_cruise_v2 = min2(m->max_cruise_v2, (
+                    smoothed_v2 + reachable_smoothed_v2) * .5);
+                if (ndelayed) {
+                    // Propagate peak_cruise_v2 to any delayed moves
+                    if (!update_flush_count && i < flush_count) {
+                        double mc_v2 = peak_cruise_v2;
+                        int j;
+                        for (j=ndelayed-1; j>=0; j--) {
+                            struct moveq_delayed *d = &delayed[j];
+                            mc_v2 = min2(mc_v2, d->start_v2);
+                            set_junction(&moves[d->idx], min2(d->start_v2
+                                , mc_v2), mc_v2, min2(d->end_v2, mc_v2));
+                        }
+                    }
+                    ndelayed = 0;
+                }
+            }
+            if (!update_flush_count && i < flush_count) {
+                double cruise_v2 = min2(min2(
+                    (start_v2 + reachable_start_v2) * .5, m->max_cruise_v2)
+                                        , peak_cruise_v2);
+                set_junction(m, min2(start_v2, cruise_v2), cruise_v2
+                             , min2(next_end_v2, cruise_v2));
+            }
+        } else {
+            // Delay calculating this move until peak_cruise_v2 is known
+            delayed[ndelayed].idx = i;
+            delayed[ndelayed].start_v2 = start_v2;
+            delayed[ndelayed].end_v2 = next_end_v2;
+            ndelayed++;
+        }
+        next_end_v2 = start_v2;
+        next_smoothed_v2 = smoothed_v2;
+    }
+    if (update_flush_count)
+        return 0;
+    return flush_count;
+}
+
+// Link the first 'count' moves for trapq_append_from_moveq()
+struct moveq_move * __visible
+moveq_get_moves(struct moveq *mq, int count)
+{
+    if (count > mq->count)
+        count = mq->count;
+    if (count <= 0)
+        return NULL;
+    int i;
+    for (i=0; i<count-1; i++)
+        mq->moves[i].next = &mq->moves[i+1];
+    mq->moves[count-1].next = NULL;
+    return mq->moves;
+}
+
+// Remove the first 'count' moves from the queue
+void __visible
+moveq_del(struct moveq *mq, int count)
+{
+    if (count >= mq->count) {
+        mq->count = 0;
+        return;
+    }
+    if (count <= 0)
+        return;
+    mq->count -= count;
+    memmove(mq->moves, &mq->moves[count], mq->count * sizeof(*mq->moves));
+}
@@ -0,0 +1,49 @@
+#ifndef MOVEQ_H
+#define MOVEQ_H
+
+// Layout must match move_data_t_in_trapq in trapq.c (where "bool" is
+// a typedef of int)
+struct moveq_move {
+    double start_pos[4];
+    double end_pos[4];
+    double start_v, cruise_v, end_v;
+    double accel_t, cruise_t, decel_t;
+    double accel;
+    double junction_deviation;
+    int is_kinematic_move;
+    double axes_d[4];
+    double move_d;
+    double axes_r[4];
+    double min_move_t;
+    double max_start_v2;
+    double max_cruise_v2;
+    double delta_v2;
+    double max_smoothed_v2;
+    double smooth_delta_v2;
+    struct moveq_move *next;
+};
+
+struct moveq_delayed {
+    int idx;
+    double start_v2, end_v2;
+};
+
+struct moveq {
+    struct moveq_move *moves;
+    int count, alloc;
+    struct moveq_delayed *delayed;
+    struct moveq_move pending;
+};
+
+struct moveq *moveq_alloc(void);
+void moveq_free(struct moveq *mq);
+struct moveq_move *moveq_prepare(struct moveq *mq, double *start_pos
+    , double *end_pos, double speed, double max_velocity, double accel
+    , double accel_to_decel, double junction_deviation);
+void moveq_limit_speed(struct moveq_move *m, double speed, double accel);
+int moveq_commit(struct moveq *mq, double extruder_corner_v);
+int moveq_flush(struct moveq *mq, int lazy);
+struct moveq_move *moveq_get_moves(struct moveq *mq, int count);
+void moveq_del(struct moveq *mq, int count);
+
+#endif // moveq.h
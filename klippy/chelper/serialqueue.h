@@ -25,6 +25,13 @@ struct pull_queue_message {
     uint64_t notify_id;
 };
 
+struct serialqueue_stats {
+    uint32_t bytes_write, bytes_read, bytes_retransmit, bytes_invalid;
+    uint32_t send_seq, receive_seq, retransmit_seq;
+    double srtt, rttvar, rto;
+    int32_t ready_bytes, stalled_bytes;
+};
+
 struct serialqueue;
 struct serialqueue *serialqueue_alloc(int serial_fd, char serial_fd_type
                                       , int client_id);
@@ -50,6 +57,8 @@ void serialqueue_set_clock_est(struct serialqueue *sq, double est_freq
 void serialqueue_get_clock_est(struct serialqueue *sq
                                , struct clock_estimate *ce);
 void serialqueue_get_stats(struct serialqueue *sq, char *buf, int len);
+void serialqueue_get_stats_values(struct serialqueue *sq
+                                  , struct serialqueue_stats *stats);
 int serialqueue_extract_old(struct serialqueue *sq, int sentq
                             , struct pull_queue_message *q, int max);
 
@@ -53,7 +53,7 @@ typedef struct _move_data_t_in_trapq_ {
 } move_data_t_in_trapq;
 
 append_return_t __visible
-trapq_append_from_moveq(struct trapq *tq_kinematic, struct trapq *tq_extruder,double next_move_time,unsigned int move_data_h,int move_num)
+trapq_append_from_moveq(struct trapq *tq_kinematic, struct trapq *tq_extruder,double next_move_time,uintptr_t move_data_h,int move_num)
 {
     // printf("get move head addr 0x%x\n",(unsigned int)move_data_h);
     move_data_t_in_trapq *move_data = NULL;
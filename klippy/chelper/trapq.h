@@ -1,6 +1,7 @@
 #ifndef TRAPQ_H
 #define TRAPQ_H
 
+#include <stdint.h> // uintptr_t
 #include "list.h" // list_node
 
 struct coord {
@@ -34,7 +35,7 @@ typedef struct{
     double extru_last_position;
     double next_move_time;
 }append_return_t;
-append_return_t trapq_append_from_moveq(struct trapq *tq_kinematic, struct trapq *tq_extruder,double next_move_time,unsigned int move_data_h,int move_num);
+append_return_t trapq_append_from_moveq(struct trapq *tq_kinematic, struct trapq *tq_extruder,double next_move_time,uintptr_t move_data_h,int move_num);
 struct move *move_alloc(void);
 void trapq_append(struct trapq *tq, double print_time
                   , double accel_t, double cruise_t, double decel_t
@@ -181,6 +181,10 @@ class ClockSync:
     def stats(self, eventtime):
         sample_time, clock, freq = self.clock_est
         return "freq=%d" % (freq,)
+    def add_stats_fields(self, group):
+        group.add_gauge('freq', "%d")
+    def update_stats(self, values):
+        values['freq'] = int(self.clock_est[2])
     def calibrate_clock(self, print_time, eventtime):
         return (0., self.mcu_freq)
 
@@ -218,6 +222,12 @@ class SecondarySync(ClockSync):
     def stats(self, eventtime):
         adjusted_offset, adjusted_freq = self.clock_adj
         return "%s adj=%d" % (ClockSync.stats(self, eventtime), adjusted_freq)
+    def add_stats_fields(self, group):
+        ClockSync.add_stats_fields(self, group)
+        group.add_gauge('adj', "%d")
+    def update_stats(self, values):
+        ClockSync.update_stats(self, values)
+        values['adj'] = int(self.clock_adj[1])
     def calibrate_clock(self, print_time, eventtime):
         # Calculate: est_print_time = main_sync.estimatated_print_time()
         ser_time, ser_clock, ser_freq = self.main_sync.clock_est
@@ -4,8 +4,8 @@
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
 import logging, time, collections, threading, multiprocessing, os
+import array, bisect, itertools, struct
 from . import bus, motion_report
-import struct
 from multiprocessing import shared_memory
 
 # ADXL345 registers
@@ -29,6 +29,11 @@ FREEFALL_ACCEL = 9.80665 * 1000.
 SCALE_XY = 0.003774 * FREEFALL_ACCEL # 1 / 265 (at 3.3V) mg/LSB
 SCALE_Z  = 0.003906 * FREEFALL_ACCEL # 1 / 256 (at 3.3V) mg/LSB
 
+# Layout of the "psm_samples" shared memory segment read by calc_psd
+SHM_HEADER_SIZE = 4
+SHM_SAMPLE_SIZE = 8 * 4
+SHM_YIELD_SAMPLES = 100000
+
 Accel_Measurement = collections.namedtuple(
     'Accel_Measurement', ('time', 'accel_x', 'accel_y', 'accel_z'))
 
@@ -86,69 +91,61 @@ class AccelQueryHelper:
         del samples[count:]
         return self.samples
 
-    def copy_double_to_buffer(self, buffer, offset, val):
-        bytes = struct.pack("d", val)
-
-        # little store
-        try:
-            buffer[offset:offset+8] = bytearray(bytes)
-            del bytes
-        except:
-            gcode = self.printer.lookup_object('gcode')
-            gcode.respond_info("val: %f, bytes: %s, offset: %d" % (val, bytes.hex(), offset))
-
-    def copy_int_to_buffer(self, buffer, offset, val):
-        # little store
-        try:
-            buffer[offset] = val & 0xFF
-            buffer[offset + 1] = (val >> 8) & 0xFF
-            buffer[offset + 2] = (val >> 16) & 0xFF
-            buffer[offset + 3] = (val >> 24) & 0xFF
-        except:
-            gcode = self.printer.lookup_object('gcode')
-            gcode.respond_info("val: %f, offset: %d" % (val, offset))
-
+    def _get_sample_range(self, data):
+        # Samples in a message are ordered by time, so the requested
+        # window can be located with a binary search
+        start_time, end_time = self.request_start_time, self.request_end_time
+        lo, hi = 0, len(data)
+        if hi and data[0][0] < start_time:
+            lo = bisect.bisect_left(data, (start_time,))
+        if hi and data[-1][0] > end_time:
+            hi = bisect.bisect_right(data, (end_time, float('inf')), lo)
+        return lo, hi
     def get_samples_to_shared_mem(self):
+        # Export samples for /usr/bin/calc_psd.  Layout of "psm_samples":
+        # uint32 byte count (including this header) followed by packed
+        # (time, accel_x, accel_y, accel_z) doubles.
         gcode = self.printer.lookup_object('gcode')
         raw_samples = self._get_raw_samples()
         if not raw_samples:
             return self.samples
         total = sum([len(m['params']['data']) for m in raw_samples])
-        count = 0
-
-        # shm size = (double bytes) * (count of member: samp_time, x, y and z) * total
-        shm_size = 8 * 4 * total
-        shm = shared_memory.SharedMemory(name="psm_samples", create=True, size=shm_size)
-
+        shm_size = SHM_HEADER_SIZE + SHM_SAMPLE_SIZE * total
+        try:
+            shm = shared_memory.SharedMemory(name="psm_samples", create=True,
+                                             size=shm_size)
+        except FileExistsError:
+            # Stale segment from an interrupted calculation
+            stale = shared_memory.SharedMemory(name="psm_samples")
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name="psm_samples", create=True,
+                                             size=shm_size)
         buffer = shm.buf
-        self.copy_int_to_buffer(buffer, 0, count)
-        count += 4
-
+        pos = SHM_HEADER_SIZE
         reactor = self.printer.get_reactor()
+        pending = 0
         for msg in raw_samples:
-            for samp_time, x, y, z in msg['params']['data']:
-                if samp_time < self.request_start_time:
-                    continue
-                if samp_time > self.request_end_time:
-                    break
-
-                # 30000 * sizeof(samp_time, x, y, z) + sizeof(count)
-                # switch process
-                if count % 960000 == 4:
-                    reactor.pause(reactor.monotonic() + .1)
-
-                self.copy_double_to_buffer(buffer, count, samp_time)
-                count += 8
-                self.copy_double_to_buffer(buffer, count, x)
-                count += 8
-                self.copy_double_to_buffer(buffer, count, y)
-                count += 8
-                self.copy_double_to_buffer(buffer, count, z)
-                count += 8
-
-        self.copy_int_to_buffer(buffer, 0, count)
+            data = msg['params']['data']
+            lo, hi = self._get_sample_range(data)
+            if lo >= hi:
+                continue
+            # Flatten the whole block and copy it into the segment at once
+            block = array.array('d', itertools.chain.from_iterable(
+                data[lo:hi] if lo or hi < len(data) else data))
+            nbytes = len(block) * block.itemsize
+            buffer[pos:pos+nbytes] = memoryview(block).cast('B')
+            pos += nbytes
+            pending += hi - lo
+            if pending >= SHM_YIELD_SAMPLES:
+                # Let other reactor work run during long exports
+                pending = 0
+                reactor.pause(reactor.NOW)
+        struct.pack_into("<I", buffer, 0, pos)
+        del buffer
         shm.close()
-        gcode.respond_info("shm_size: %d, double bytes count: %d" % (shm_size, count))
+        gcode.respond_info("shm_size: %d, double bytes count: %d"
+                           % (shm_size, pos))
 
     def write_to_file(self, filename):
         def write_impl():
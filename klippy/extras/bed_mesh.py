@@ -4,7 +4,7 @@
 # Copyright (C) 2018-2019 Eric Callahan <arksine.code@gmail.com>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import logging, math, json, collections
+import sys, logging, math, json, collections, zlib, base64, array
 from . import probe
 import mymodule.mymovie as mymovie
 import numpy as np
@@ -108,6 +108,7 @@ class BedMesh:
         self.log_fade_complete = False
         self.base_fade_target = config.getfloat('fade_target', None)
         self.fade_target = 0.
+        self.status_matrices = config.getboolean('status_matrices', False)
         self.gcode = self.printer.lookup_object('gcode')
         # self.splitter = MoveSplitter(config, self.gcode)
         self.splitter = mymovie.PyMoveSplitter(config.getfloat(
@@ -139,6 +140,8 @@ class BedMesh:
         webhooks = self.printer.lookup_object('webhooks')
         webhooks.register_endpoint("get_mesh", self._get_mesh)
         webhooks.register_endpoint("update_mesh", self.update_mesh)
+        webhooks.register_endpoint("bed_mesh/dump_mesh",
+                                   self._handle_dump_mesh)
         # Register transform
         gcode_move = self.printer.load_object(config, 'gcode_move')
         gcode_move.set_move_transform(self)
@@ -286,25 +289,75 @@ class BedMesh:
     def get_status(self, eventtime=None):
         return self.status
     def update_status(self):
-        self.status = {
+        # The status only carries a summary of the mesh; the matrices are
+        # served by the bed_mesh/dump_mesh endpoint and clients refetch
+        # them when mesh_version changes
+        profiles = self.pmgr.get_profiles()
+        self.status = status = {
             "profile_name": "",
             "mesh_min": (0., 0.),
             "mesh_max": (0., 0.),
-            "probed_matrix": [[]],
-            "mesh_matrix": [[]],
-            "profiles": self.pmgr.get_profiles()
+            "mesh_range": (0., 0.),
+            "profile_names": sorted(profiles.keys()),
         }
+        probed_matrix = mesh_matrix = [[]]
+        mesh_params = {}
         if self.z_mesh is not None:
-            params = self.z_mesh.get_mesh_params()
-            mesh_min = (params['min_x'], params['min_y'])
-            mesh_max = (params['max_x'], params['max_y'])
+            mesh_params = self.z_mesh.get_mesh_params()
             probed_matrix = self.z_mesh.get_probed_matrix()
             mesh_matrix = self.z_mesh.get_mesh_matrix()
-            self.status['profile_name'] = self.pmgr.get_current_profile()
-            self.status['mesh_min'] = mesh_min
-            self.status['mesh_max'] = mesh_max
-            self.status['probed_matrix'] = probed_matrix
-            self.status['mesh_matrix'] = mesh_matrix
+            z_min, z_max = self.z_mesh.get_z_range()
+            status['profile_name'] = self.pmgr.get_current_profile()
+            status['mesh_min'] = (mesh_params['min_x'], mesh_params['min_y'])
+            status['mesh_max'] = (mesh_params['max_x'], mesh_params['max_y'])
+            status['mesh_range'] = (round(z_min, 6), round(z_max, 6))
+        version = [status['profile_name'], mesh_params, probed_matrix,
+                   [(name, profiles[name]['points'])
+                    for name in status['profile_names']]]
+        status['mesh_version'] = "%08x" % (
+            zlib.crc32(json.dumps(version).encode()),)
+        if self.status_matrices:
+            status['probed_matrix'] = probed_matrix
+            status['mesh_matrix'] = mesh_matrix
+            status['profiles'] = profiles
+    def _pack_matrix(self, matrix, fmt):
+        if fmt == 'list':
+            return matrix
+        data = array.array('d', [z for line in matrix for z in line])
+        if sys.byteorder != 'little':
+            data.byteswap()
+        data = data.tobytes()
+        if fmt == 'zlib':
+            data = zlib.compress(data)
+        return {'rows': len(matrix), 'cols': len(matrix[0]),
+                'encoding': fmt, 'data': base64.b64encode(data).decode()}
+    def _handle_dump_mesh(self, web_request):
+        fmt = web_request.get_str('format', 'list')
+        if fmt not in ('list', 'packed', 'zlib'):
+            raise web_request.error(
+                "bed_mesh: Unknown format '%s'" % (fmt,))
+        prof_name = web_request.get_str('profile', None)
+        result = {'mesh_version': self.status['mesh_version']}
+        if prof_name is None:
+            # The active mesh
+            if self.z_mesh is None:
+                raise web_request.error("bed_mesh: Bed has not been probed")
+            result['profile_name'] = self.pmgr.get_current_profile()
+            result['mesh_params'] = dict(self.z_mesh.get_mesh_params())
+            result['probed_matrix'] = self._pack_matrix(
+                self.z_mesh.get_probed_matrix(), fmt)
+            result['mesh_matrix'] = self._pack_matrix(
+                self.z_mesh.get_mesh_matrix(), fmt)
+        else:
+            profile = self.pmgr.get_profiles().get(prof_name)
+            if profile is None:
+                raise web_request.error(
+                    "bed_mesh: Unknown profile [%s]" % (prof_name,))
+            result['profile_name'] = prof_name
+            result['mesh_params'] = dict(profile['mesh_params'])
+            result['probed_matrix'] = self._pack_matrix(
+                [list(line) for line in profile['points']], fmt)
+        web_request.send(result)
     def get_mesh(self):
         return self.z_mesh
     cmd_BED_MESH_OUTPUT_help = "Retrieve interpolated grid of probed z-points"
@@ -5,6 +5,7 @@
 # This file may be distributed under the terms of the GNU GPLv3 license.
 import logging
 import struct
+import zlib
 from . import bus
 
 BL24C16F_CHIP_ADDR_0 = 0x50
@@ -16,6 +17,19 @@ BL24C16F_CHIP_ADDR_5 = 0x55
 BL24C16F_CHIP_ADDR_6 = 0x56
 BL24C16F_CHIP_ADDR_7 = 0x57
 
+# Power-loss checkpoint records: seq, file_position, base_position_e, crc32.
+# Each record fills one 16 byte eeprom page.  Record 0 overlaps the
+# header bytes (0: legacy slot, 1: enable flag) and is never used.
+CHECKPOINT_BODY = struct.Struct("<IIf")
+CHECKPOINT_CRC = struct.Struct("<I")
+CHECKPOINT_SIZE = 16
+CHECKPOINT_FIRST = 1
+CHECKPOINT_COUNT = 2048 // CHECKPOINT_SIZE - CHECKPOINT_FIRST
+# Reads must not cross a 256 byte block (i2c address) boundary
+CHECKPOINT_READ_SIZE = 32
+EEPROM_WRITE_DELAY = 0.010
+EEPROM_ENDURANCE = 1000000
+
 class EEPROMCommandHelper:
     def __init__(self, config, chip):
         self.printer = config.get_printer()
@@ -77,10 +91,7 @@ class EEPROMCommandHelper:
         gcmd.respond_info("EEPROM_POS int_pos:%s, pos:%s" % (int.from_bytes(pos, 'little'), pos))
         
     def cmd_EEPROM_PRINTER_INFO(self, gcmd):
-        pos = int.from_bytes(self.chip.read_reg(0, 1), 'little')
-        file_position = self.chip.read_reg(pos*8, 4)
-        base_position_e = self.chip.read_reg(pos*8+4, 4)
-        ret =  {"file_position": int.from_bytes(file_position, 'little'), "base_position_e": struct.unpack('f', base_position_e)[0]}
+        ret = self.chip.checkpoint_read()
         gcmd.respond_info("EEPROM_PRINTER_INFO ret:%s" % str(ret))
 
     def cmd_EEPROM_DEBUG_READ(self, gcmd):
@@ -218,12 +229,29 @@ class BL24C16F:
             config, default_addr=BL24C16F_CHIP_ADDR_7, default_speed=400000)
         self.mcu = self.i2c0.get_mcu()
         self.printer.add_object("bl24c16f " + self.name, self)
+        # Asynchronous checkpoint writer state
+        self.checkpoint_seq = None
+        self.checkpoint_index = CHECKPOINT_FIRST
+        self.checkpoint_enabled = None
+        self.pending_record = None
+        self.pending_enable = False
+        self.checkpoint_timer = self.reactor.register_timer(
+            self._checkpoint_flush)
+        self.checkpoint_writes = self.checkpoint_coalesced = 0
+        self.checkpoint_start_time = None
+        self.slot_writes = [0] * CHECKPOINT_COUNT
         self.printer.register_event_handler("klippy:connect",
                                             self.handle_connect)
+        self.printer.register_event_handler("klippy:ready",
+                                            self.handle_ready)
 
     def handle_connect(self):
         self._init_bl24c16f()
 
+    def handle_ready(self):
+        # Locate the newest checkpoint record before the first print write
+        self.reactor.update_timer(self.checkpoint_timer, self.reactor.NOW)
+
     def _init_bl24c16f(self):
         logging.info("bl24c16f init...")
 
@@ -276,6 +304,10 @@ class BL24C16F:
             self.i2c7.i2c_write(data)
 
     def setEepromDisable(self):
+        # Drop any queued checkpoint so it cannot re-enable the flag
+        self.pending_record = None
+        self.pending_enable = False
+        self.checkpoint_enabled = False
         self.write_reg(1, 255)
 
     def checkEepromFirstEnable(self):
@@ -294,6 +326,94 @@ class BL24C16F:
         base_position_e = self.read_reg(pos*8+4, 4)
         return {"file_position": int.from_bytes(file_position, 'little'), "base_position_e": struct.unpack('f', base_position_e)[0]}
 
+    # Binary power-loss checkpoints
+    def _scan_checkpoints(self):
+        # Find the newest record with a valid crc
+        data = bytearray()
+        for addr in range(0, 2048, CHECKPOINT_READ_SIZE):
+            data += self.read_reg(addr, CHECKPOINT_READ_SIZE)
+        best = None
+        for i in range(CHECKPOINT_COUNT):
+            start = (CHECKPOINT_FIRST + i) * CHECKPOINT_SIZE
+            body = bytes(data[start:start + CHECKPOINT_BODY.size])
+            crc = CHECKPOINT_CRC.unpack_from(data, start + CHECKPOINT_BODY.size)
+            if crc[0] != zlib.crc32(body):
+                continue
+            seq, file_position, base_position_e = CHECKPOINT_BODY.unpack(body)
+            if best is None or seq > best[0]:
+                best = (seq, i, file_position, base_position_e)
+        if best is None:
+            self.checkpoint_seq = 0
+            self.checkpoint_index = CHECKPOINT_FIRST
+        else:
+            self.checkpoint_seq = best[0]
+            self.checkpoint_index = CHECKPOINT_FIRST + (
+                (best[1] + 1) % CHECKPOINT_COUNT)
+        self.checkpoint_enabled = not self.checkEepromFirstEnable()
+        return best
+    def checkpoint_read(self):
+        best = self._scan_checkpoints()
+        if best is None:
+            # Eeprom last written by the legacy per-field layout
+            return self.eepromReadBody(self.eepromReadHeader())
+        return {"file_position": best[2], "base_position_e": best[3]}
+    def checkpoint_write(self, file_position, base_position_e, enable=True):
+        # Queue a record; only the newest pending record is written
+        if self.pending_record is not None:
+            self.checkpoint_coalesced += 1
+        self.pending_record = (int(file_position), float(base_position_e))
+        self.pending_enable = self.pending_enable or enable
+        self.reactor.update_timer(self.checkpoint_timer, self.reactor.NOW)
+    def _checkpoint_flush(self, eventtime):
+        if self.checkpoint_seq is None:
+            try:
+                self._scan_checkpoints()
+            except Exception:
+                logging.exception("bl24c16f checkpoint scan failed")
+                self.checkpoint_seq = 0
+            return eventtime + EEPROM_WRITE_DELAY
+        if self.pending_record is not None:
+            file_position, base_position_e = self.pending_record
+            self.pending_record = None
+            self.checkpoint_seq += 1
+            raw = CHECKPOINT_BODY.pack(self.checkpoint_seq, file_position,
+                                       base_position_e)
+            raw += CHECKPOINT_CRC.pack(zlib.crc32(raw))
+            slot = self.checkpoint_index - CHECKPOINT_FIRST
+            self.write_reg(self.checkpoint_index * CHECKPOINT_SIZE, list(raw))
+            self.checkpoint_index = CHECKPOINT_FIRST + (
+                (slot + 1) % CHECKPOINT_COUNT)
+            self.slot_writes[slot] += 1
+            self.checkpoint_writes += 1
+            if self.checkpoint_start_time is None:
+                self.checkpoint_start_time = eventtime
+            # The page write must finish before the next i2c write
+            return eventtime + EEPROM_WRITE_DELAY
+        if self.pending_enable:
+            self.pending_enable = False
+            if not self.checkpoint_enabled:
+                self.write_reg(1, 1)
+                self.checkpoint_enabled = True
+                return eventtime + EEPROM_WRITE_DELAY
+        return self.reactor.NEVER
+    def get_status(self, eventtime):
+        write_rate = 0.
+        if self.checkpoint_start_time is not None:
+            elapsed = eventtime - self.checkpoint_start_time
+            if elapsed > 0.:
+                write_rate = self.checkpoint_writes * 60. / elapsed
+        seq = self.checkpoint_seq or 0
+        # Records are written round-robin, so lifetime wear is uniform
+        cycles = float(seq) / CHECKPOINT_COUNT
+        return {'checkpoint_writes': self.checkpoint_writes,
+                'checkpoint_coalesced': self.checkpoint_coalesced,
+                'checkpoint_seq': seq,
+                'writes_per_minute': round(write_rate, 3),
+                'slot_writes_min': min(self.slot_writes),
+                'slot_writes_max': max(self.slot_writes),
+                'estimated_cycles': round(cycles, 1),
+                'endurance_used': round(cycles / EEPROM_ENDURANCE, 6)}
+
 def load_config(config):
     return BL24C16F(config)
 
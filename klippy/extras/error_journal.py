@@ -0,0 +1,109 @@
+# Append-only rotating JSONL journal written from a background thread
+#
+# Copyright (C) 2025 K2 Unleashed Contributors
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import os, json, logging, threading, queue
+
+class ErrorJournal:
+    """Batched event journal modelled on queuelogger.QueueListener
+
+    Events are queued by the reactor thread and written by a background
+    thread that keeps the file open, writes every event that is already
+    queued in one batch, and rotates the file by size."""
+    def __init__(self, filename, max_bytes=1024*1024, backup_count=3):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.journal_file = None
+        self.batches = self.events = 0
+        self.bg_queue = queue.Queue()
+        self.bg_thread = threading.Thread(target=self._bg_thread)
+        self.bg_thread.daemon = True
+        self.bg_thread.start()
+    def _open(self):
+        if self.journal_file is None:
+            dirname = os.path.dirname(self.filename)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            self.journal_file = open(self.filename, 'a')
+        return self.journal_file
+    def _rotate(self):
+        self.journal_file.close()
+        self.journal_file = None
+        for i in range(self.backup_count - 1, 0, -1):
+            src = "%s.%d" % (self.filename, i)
+            if os.path.exists(src):
+                os.rename(src, "%s.%d" % (self.filename, i + 1))
+        if self.backup_count:
+            os.rename(self.filename, self.filename + ".1")
+        else:
+            os.remove(self.filename)
+    def _write_batch(self, batch):
+        try:
+            f = self._open()
+            f.write("".join([json.dumps(e) + "\n" for e in batch]))
+            f.flush()
+            self.batches += 1
+            self.events += len(batch)
+            if f.tell() >= self.max_bytes:
+                self._rotate()
+        except Exception:
+            logging.exception("error_journal: unable to write %s",
+                              self.filename)
+            if self.journal_file is not None:
+                self.journal_file.close()
+                self.journal_file = None
+    def _bg_thread(self):
+        while 1:
+            event = self.bg_queue.get(True)
+            if event is None:
+                break
+            # Drain everything already queued into a single write
+            batch = [event]
+            is_stopping = False
+            while 1:
+                try:
+                    event = self.bg_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if event is None:
+                    is_stopping = True
+                    break
+                batch.append(event)
+            self._write_batch(batch)
+            if is_stopping:
+                break
+        if self.journal_file is not None:
+            self.journal_file.close()
+            self.journal_file = None
+    def log(self, event):
+        self.bg_queue.put_nowait(event)
+    def stop(self):
+        if self.bg_thread.is_alive():
+            self.bg_queue.put_nowait(None)
+            self.bg_thread.join(1.)
+    def load_recent(self, count):
+        # Returns up to count most recent events, oldest first
+        lines = []
+        names = ["%s.%d" % (self.filename, i)
+                 for i in range(self.backup_count, 0, -1)]
+        names.append(self.filename)
+        for name in names:
+            try:
+                with open(name, 'r') as f:
+                    lines.extend(f.read().splitlines())
+            except (IOError, OSError):
+                continue
+            lines = lines[-count:]
+        events = []
+        for line in lines:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                # Partial line from an interrupted write
+                continue
+        return events
+    def get_status(self, eventtime=None):
+        return {'events': self.events, 'batches': self.batches,
+                'pending': self.bg_queue.qsize()}
@@ -8,12 +8,30 @@ from os import remove
 from time import time
 import mcu
 import math
+import collections
 
 
 class RCTFilter:
     def __init__(self):
+        self.window = []
         pass
 
+    def ftr_next(self, val):
+        # Feed one sample; returns the output for the sample two positions
+        # back (or None while fewer than 3 samples were seen)
+        window = self.window
+        window.append(val)
+        if len(window) < 3:
+            return None
+        if len(window) > 3:
+            del window[0]
+        tmp = [math.fabs(window[0]), math.fabs(window[1]), math.fabs(window[2])]
+        return window[tmp.index(min(tmp))]
+
+    def get_pending(self):
+        # The last two samples, passed through unfiltered by ftr_val()
+        return self.window[-2:]
+
     def ftr_val(self, vals):
         out_vals = []
         if len(vals) < 3:
@@ -41,6 +59,16 @@ class RCHFilter:
             out_vals.append((vals[i] - vals[i - 1] + out_vals[-1]) * coff)
         return out_vals
 
+    def ftr_step(self, state, val):
+        # One sample of ftr_val(); state is None before the first sample
+        if state is None:
+            return (val, 0), 0
+        rc = 1. / 2. / math.pi / self.cut_frq_hz
+        coff = rc / (rc + 1. / self.acq_frq_hz)
+        last_val, last_out = state
+        out = (val - last_val + last_out) * coff
+        return (val, out), out
+
 
 class RCLFilter:
     def __init__(self, k1_new):
@@ -53,6 +81,46 @@ class RCLFilter:
             out_vals.append(out_vals[-1] * (1 - self.k1_new) + vals[i] * self.k1_new)
         return out_vals
 
+    def ftr_step(self, state, val):
+        # One sample of ftr_val(); state is None before the first sample
+        if state is None:
+            return val, val
+        out = state * (1 - self.k1_new) + val * self.k1_new
+        return out, out
+
+
+class FilterStream:
+    """Incremental version of the RCTFilter + filters chain used by
+    Filter.cal_filter_by_vals() and Filter.cal_offset_by_vals() for one
+    channel.  After feeding n samples, get_vals() matches the per channel
+    result of those functions over the same n samples, without
+    recomputing the whole window for each new sample."""
+    def __init__(self, filters, cut_len):
+        self.tft = RCTFilter()
+        self.filters = filters
+        self.states = [None] * len(filters)
+        self.outs = collections.deque([], cut_len)
+        self.cut_len = cut_len
+
+    def _run(self, states, val):
+        for i, ftr in enumerate(self.filters):
+            states[i], val = ftr.ftr_step(states[i], val)
+        return val
+
+    def add(self, val):
+        val = self.tft.ftr_next(val)
+        if val is not None:
+            self.outs.append(abs(self._run(self.states, val)))
+
+    def get_vals(self):
+        # The last two samples are not final until more samples arrive
+        states = list(self.states)
+        tail = [abs(self._run(states, val)) for val in self.tft.get_pending()]
+        vals = list(self.outs) + tail
+        if len(vals) > self.cut_len:
+            del vals[0:(len(vals) - self.cut_len)]
+        return vals
+
 
 class Filter:
     def __init__(self, config):
@@ -71,6 +139,15 @@ class Filter:
     def get_hft(self, cut_hz, acq_hz):
         return RCHFilter(cut_frq_hz=cut_hz, acq_frq_hz=acq_hz)
 
+    def get_offset_stream(self, lft_k1, cut_len):
+        # Incremental cal_offset_by_vals() for one channel
+        return FilterStream([RCLFilter(lft_k1)], cut_len)
+
+    def get_filter_stream(self, hft_hz, lft_k1, cut_len):
+        # Incremental cal_filter_by_vals() for one channel
+        return FilterStream([RCHFilter(hft_hz, 80), RCLFilter(lft_k1)],
+                            cut_len)
+
     def cal_offset_by_vals(self, s_count, new_valss, lft_k1, cut_len):
         out_vals = []
         tmp_vals = [[], [], [], []]
@@ -11,12 +11,127 @@ import jinja2
 # Template handling
 ######################################################################
 
+# Read-only views of get_status() results.  Templates get these instead
+# of deep copies of the status; nested dicts and lists are wrapped when
+# they are accessed.
+class FrozenDict:
+    __slots__ = ('_data',)
+    def __init__(self, data):
+        self._data = data
+    def __getitem__(self, key):
+        return freeze(self._data[key])
+    def get(self, key, default=None):
+        if key in self._data:
+            return freeze(self._data[key])
+        return default
+    def __contains__(self, key):
+        return key in self._data
+    def __iter__(self):
+        return iter(self._data)
+    def __len__(self):
+        return len(self._data)
+    def keys(self):
+        return self._data.keys()
+    def values(self):
+        return [freeze(v) for v in self._data.values()]
+    def items(self):
+        return [(k, freeze(v)) for k, v in self._data.items()]
+    def copy(self):
+        # Return a modifiable copy
+        return copy.deepcopy(self._data)
+    def __eq__(self, other):
+        if isinstance(other, FrozenDict):
+            other = other._data
+        return self._data == other
+    def __ne__(self, other):
+        return not self.__eq__(other)
+    __hash__ = None
+    def __bool__(self):
+        return bool(self._data)
+    def __repr__(self):
+        return repr(self._data)
+    def __setitem__(self, key, value):
+        raise TypeError("Printer status is read-only")
+    def __delitem__(self, key):
+        raise TypeError("Printer status is read-only")
+
+class FrozenList:
+    __slots__ = ('_data',)
+    def __init__(self, data):
+        self._data = data
+    def __getitem__(self, index):
+        return freeze(self._data[index])
+    def __iter__(self):
+        for v in self._data:
+            yield freeze(v)
+    def __len__(self):
+        return len(self._data)
+    def __contains__(self, value):
+        return value in self._data
+    def __add__(self, other):
+        if isinstance(other, FrozenList):
+            other = other._data
+        return self._data + other
+    def index(self, value):
+        return self._data.index(value)
+    def count(self, value):
+        return self._data.count(value)
+    def copy(self):
+        # Return a modifiable copy
+        return copy.deepcopy(self._data)
+    def __eq__(self, other):
+        if isinstance(other, FrozenList):
+            other = other._data
+        return self._data == other
+    def __ne__(self, other):
+        return not self.__eq__(other)
+    __hash__ = None
+    def __bool__(self):
+        return bool(self._data)
+    def __repr__(self):
+        return repr(self._data)
+    def __setitem__(self, index, value):
+        raise TypeError("Printer status is read-only")
+    def __delitem__(self, index):
+        raise TypeError("Printer status is read-only")
+
+def freeze(value):
+    if isinstance(value, dict):
+        return FrozenDict(value)
+    if isinstance(value, list):
+        return FrozenList(value)
+    return value
+
+def _json_default(value):
+    # Allow "tojson" on status views
+    if isinstance(value, (FrozenDict, FrozenList)):
+        return value._data
+    raise TypeError("Object of type %s is not JSON serializable"
+                    % (type(value).__name__,))
+
+# Status views shared by all template contexts with the same eventtime
+class StatusCache:
+    def __init__(self):
+        self.eventtime = None
+        self.status = {}
+    def get_status(self, name, obj, eventtime):
+        if eventtime != self.eventtime:
+            self.eventtime = eventtime
+            self.status = {}
+        res = self.status.get(name)
+        if res is None:
+            res = self.status[name] = FrozenDict(obj.get_status(eventtime))
+        return res
+
 # Wrapper for access to printer object get_status() methods
 class GetStatusWrapper:
-    def __init__(self, printer, eventtime=None):
+    def __init__(self, printer, eventtime=None, status_cache=None):
         self.printer = printer
         self.eventtime = eventtime
         self.cache = {}
+        self.status_cache = status_cache
+        if status_cache is None:
+            self.status_cache = StatusCache()
     def __getitem__(self, val):
         sval = str(val).strip()
         if sval in self.cache:
@@ -26,7 +141,8 @@ class GetStatusWrapper:
             raise KeyError(val)
         if self.eventtime is None:
             self.eventtime = self.printer.get_reactor().monotonic()
-        self.cache[sval] = res = copy.deepcopy(po.get_status(self.eventtime))
+        self.cache[sval] = res = self.status_cache.get_status(
+            sval, po, self.eventtime)
         return res
     def __contains__(self, val):
         try:
@@ -48,7 +164,7 @@ class TemplateWrapper:
         gcode_macro = self.printer.lookup_object('gcode_macro')
         self.create_template_context = gcode_macro.create_template_context
         try:
-            self.template = env.from_string(script)
+            self.template = gcode_macro.compile_template(env, script)
         except Exception as e:
             # msg = "Error loading template '%s': %s" % (
             #      name, traceback.format_exception_only(type(e), e)[-1])
@@ -79,6 +195,26 @@ class PrinterGCodeMacro:
     def __init__(self, config):
         self.printer = config.get_printer()
         self.env = jinja2.Environment('{%', '%}', '{', '}')
+        if hasattr(self.env, 'policies'):
+            self.env.policies['json.dumps_kwargs'] = {
+                'sort_keys': True, 'default': _json_default}
+        self.template_cache = {}
+        self.status_cache = StatusCache()
+        self.base_context = {
+            'action_emergency_stop': self._action_emergency_stop,
+            'action_respond_info': self._action_respond_info,
+            'action_raise_error': self._action_raise_error,
+            'action_call_remote_method': self._action_call_remote_method,
+        }
+    def compile_template(self, env, script):
+        # Templates with the same script (eg, display data items) share
+        # one compiled template
+        if env is not self.env:
+            return env.from_string(script)
+        template = self.template_cache.get(script)
+        if template is None:
+            template = self.template_cache[script] = env.from_string(script)
+        return template
     def load_template(self, config, option, default=None):
         name = "%s:%s" % (config.get_name(), option)
         if default is None:
@@ -102,13 +238,10 @@ class PrinterGCodeMacro:
             logging.exception("Remote Call Error")
         return ""
     def create_template_context(self, eventtime=None):
-        return {
-            'printer': GetStatusWrapper(self.printer, eventtime),
-            'action_emergency_stop': self._action_emergency_stop,
-            'action_respond_info': self._action_respond_info,
-            'action_raise_error': self._action_raise_error,
-            'action_call_remote_method': self._action_call_remote_method,
-        }
+        context = dict(self.base_context)
+        context['printer'] = GetStatusWrapper(self.printer, eventtime,
+                                              self.status_cache)
+        return context
 
 def load_config(config):
     return PrinterGCodeMacro(config)
@@ -25,7 +25,19 @@ class GCodeMove:
                                        self._handle_activate_extruder)
         printer.register_event_handler("homing:home_rails_end",
                                        self._handle_home_rails_end)
+        printer.register_event_handler("kinematics:limits_changed",
+                                       self._update_z_limits)
+        printer.register_event_handler("toolhead:set_position",
+                                       self._update_z_limits)
+        printer.register_event_handler("stepper_enable:motor_off",
+                                       self._handle_motor_off)
         self.is_printer_ready = False
+        # Objects used by the G1 fast path (looked up when ready)
+        self.toolhead = self.print_stats = self.pause_resume = None
+        self.v_sd = None
+        # Z homed state and upper Z move limit (updated from events)
+        self.z_homed = False
+        self.max_z_move = 0.
         # Register g-code commands
         gcode = printer.lookup_object('gcode')
         handlers = [
@@ -43,6 +55,7 @@ class GCodeMove:
                                desc=self.cmd_GET_POSITION_help)
         gcode.register_command('SET_POSITION', self.cmd_SET_POSITION, True, desc=self.cmd_SET_POSITION_help)
         gcode.gcode_move = self
+        self.gcode = gcode
         self.Coord = gcode.Coord
         # G-Code coordinate manipulation
         self.absolute_coord = self.absolute_extrude = True
@@ -103,11 +116,27 @@ class GCodeMove:
         self.printer.lookup_object('toolhead').kin.restore_limits()
     def _handle_ready(self):
         self.is_printer_ready = True
+        toolhead = self.toolhead = self.printer.lookup_object('toolhead')
+        self.print_stats = self.printer.lookup_object('print_stats', None)
+        self.pause_resume = self.printer.lookup_object('pause_resume', None)
+        self.v_sd = self.printer.lookup_object('virtual_sdcard', None)
         if self.move_transform is None:
-            toolhead = self.printer.lookup_object('toolhead')
             self.move_with_transform = toolhead.move
             self.position_with_transform = toolhead.get_position
+        self._update_z_limits()
         self.reset_last_position()
+    def _update_z_limits(self):
+        toolhead = self.toolhead
+        if toolhead is None:
+            return
+        limits = getattr(toolhead.get_kinematics(), 'limits', None)
+        if limits is None:
+            return
+        min_z, max_z = limits[2]
+        self.z_homed = min_z <= max_z
+        self.max_z_move = max_z + 5
+    def _handle_motor_off(self, print_time):
+        self.z_homed = False
     def _handle_shutdown(self):
         if not self.is_printer_ready:
             return
@@ -190,22 +219,21 @@ class GCodeMove:
                         # value relative to base coordinate position
                         self.last_position[1] = float(part[1:]) + self.base_position[1]
                 elif part[0]=="Z" or part[0]=="z":
-                    toolhead = self.printer.lookup_object('toolhead')
-                    print_stats = self.printer.lookup_object('print_stats')
-                    max_z = toolhead.kin.limits[2][1]+5
-                    curtime = self.printer.get_reactor().monotonic()
-                    if 'z' in toolhead.get_status(curtime)['homed_axes'] and float(part[1:]) > max_z or (not self.absolute_coord and self.last_position[2]+float(part[1:])>max_z):
+                    z = float(part[1:])
+                    max_z = self.max_z_move
+                    if self.z_homed and z > max_z or (not self.absolute_coord and self.last_position[2]+z>max_z):
                         m = """{"code":"587","msg":"Move out of range %s", "values":[]}""" % str(part)
-                        self.printer.lookup_object('gcode')._respond_error(m)
-                        if print_stats.state == "printing" and self.printer.lookup_object('pause_resume').pause_start == False and self.printer.lookup_object('virtual_sdcard').is_move_out_of_range_in_printing==False:
-                            self.printer.lookup_object('virtual_sdcard').is_move_out_of_range_in_printing=True
+                        self.gcode._respond_error(m)
+                        v_sd = self.v_sd
+                        if self.print_stats.state == "printing" and self.pause_resume.pause_start == False and v_sd.is_move_out_of_range_in_printing==False:
+                            v_sd.is_move_out_of_range_in_printing=True
                         return
                     if not self.absolute_coord:
                             # value relative to position of last move
-                        self.last_position[2] += float(part[1:])
+                        self.last_position[2] += z
                     else:
                         # value relative to base coordinate position
-                        self.last_position[2] = float(part[1:]) + self.base_position[2]
+                        self.last_position[2] = z + self.base_position[2]
                 elif part[0]=="F" or part[0]=="f":
                     gcode_speed = float(part[1:])
                     if gcode_speed <= 0.:
@@ -229,11 +257,8 @@ class GCodeMove:
                         # value relative to base coordinate position
                         self.last_position[pos] = v + self.base_position[pos]
             if 'Z' in params:
-                print_stats = self.printer.lookup_object('print_stats')
-                if print_stats.state != "printing":
-                    toolhead = self.printer.lookup_object('toolhead')
-                    curtime = self.printer.get_reactor().monotonic()
-                    if 'z' in toolhead.get_status(curtime)['homed_axes'] and self.last_position[2] < -2:
+                if self.print_stats.state != "printing":
+                    if self.z_homed and self.last_position[2] < -2:
                         logging.info("Minimum Limit -2 last_position[2]:%s"%self.last_position[2])
                         self.last_position[2] = -2
             if 'E' in params:
@@ -455,12 +480,19 @@ class GCodeMove:
                 state["max_accel"] = file_info.get("max_accel", max_accel)
                 state["requested_accel_to_decel"] = file_info.get("requested_accel_to_decel", requested_accel_to_decel)
                 state["square_corner_velocity"] = file_info.get("square_corner_velocity", square_corner_velocity)
+            # Fan commands, coordinate modes and feedrate from the resume
+            # index are exact at the resume point
+            state["fan_state"].update(XYZET.get("fan_state", {}))
+            for key in ("absolute_coord", "absolute_extrude"):
+                if key in XYZET:
+                    state[key] = XYZET[key]
+            gcode_speed = XYZET.get("F", 0.)
             # XYZET: {"X": 0, "Y": 0, "Z": 0, "E": 0, "T": ""}
             state["last_position"] = [XYZET["X"], XYZET["Y"], XYZET["Z"], XYZET["E"]+base_position_e]
             logging.info("power_loss cmd_CX_RESTORE_GCODE_STATE state:%s" % str(state))
 
-            # Restore state
-            self.absolute_coord = state['absolute_coord']
+            # Restore state (the coordinate mode is restored after the
+            # absolute moves back to the resume position below)
             # self.absolute_extrude = state['absolute_extrude']
             self.base_position = list(state['base_position'])
             self.homing_position = list(state['homing_position'])
@@ -569,23 +601,25 @@ class GCodeMove:
             if state["M204"]:
                 logging.info("power_loss cmd_CX_RESTORE_GCODE_STATE SET M204:%s#" % state["M204"])
                 gcode.run_script_from_command(state["M204"])
+            self.absolute_coord = state['absolute_coord']
             self.absolute_extrude = state['absolute_extrude']
+            if gcode_speed > 0.:
+                self.speed = gcode_speed * self.speed_factor
             try:
-                if os.path.exists(gcode.exclude_object_info):
+                exclude_object_cmds = gcode.get_exclude_object_info()
+                EXCLUDE_OBJECT_DEFINE = exclude_object_cmds.get("EXCLUDE_OBJECT_DEFINE", [])
+                EXCLUDE_OBJECT = exclude_object_cmds.get("EXCLUDE_OBJECT", [])
+                if EXCLUDE_OBJECT_DEFINE or EXCLUDE_OBJECT:
                     reactor = self.printer.get_reactor()
-                    with open(gcode.exclude_object_info, "r") as f:
-                        exclude_object_cmds = json.loads(f.read())
-                        EXCLUDE_OBJECT_DEFINE = exclude_object_cmds.get("EXCLUDE_OBJECT_DEFINE", [])
-                        EXCLUDE_OBJECT = exclude_object_cmds.get("EXCLUDE_OBJECT", [])
-                        for line in EXCLUDE_OBJECT_DEFINE:
-                            reactor.pause(reactor.monotonic() + 0.001)
-                            gcode.run_script_from_command(line)
-                            logging.info("power_loss cmd_CX_RESTORE_GCODE_STATE %s" % str(line))
-                        for line in EXCLUDE_OBJECT:
-                            reactor.pause(reactor.monotonic() + 0.001)
-                            gcode.run_script_from_command(line)
-                            logging.info("power_loss cmd_CX_RESTORE_GCODE_STATE %s" % str(line))
-                        gcode.run_script_from_command("M400")
+                    for line in EXCLUDE_OBJECT_DEFINE:
+                        reactor.pause(reactor.monotonic() + 0.001)
+                        gcode.run_script_from_command(line)
+                        logging.info("power_loss cmd_CX_RESTORE_GCODE_STATE %s" % str(line))
+                    for line in EXCLUDE_OBJECT:
+                        reactor.pause(reactor.monotonic() + 0.001)
+                        gcode.run_script_from_command(line)
+                        logging.info("power_loss cmd_CX_RESTORE_GCODE_STATE %s" % str(line))
+                    gcode.run_script_from_command("M400")
             except Exception as err:
                 logging.exception("RESTORE EXCLUDE_OBJECT err:%s" % err)
             try:
@@ -0,0 +1,83 @@
+# G-code line classification and stream statistics for virtual_sdcard
+#
+# Copyright (C) 2025 K2 Unleashed Contributors
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import time
+
+# Line classes returned by LineClassifier.classify()
+(LINE_OTHER, LINE_LAYER, LINE_M106, LINE_M600, LINE_END_PRINT,
+ LINE_TOOL) = range(6)
+HOOK_NAMES = {LINE_LAYER: "layer", LINE_M106: "fan", LINE_M600: "pause",
+              LINE_END_PRINT: "end_print", LINE_TOOL: "tool"}
+
+def _comment_class(line, layer_keys):
+    if line.startswith(layer_keys):
+        return LINE_LAYER
+    return LINE_OTHER
+
+def _m_class(line, layer_keys):
+    if line.startswith(b"M106"):
+        return LINE_M106
+    if line.startswith(b"M600"):
+        return LINE_M600
+    return LINE_OTHER
+
+def _e_class(line, layer_keys):
+    if line.startswith(b"END_PRINT"):
+        return LINE_END_PRINT
+    return LINE_OTHER
+
+def _t_class(line, layer_keys):
+    if line[1:].strip().isdigit():
+        return LINE_TOOL
+    return LINE_OTHER
+
+# Prefix dispatch table indexed by the first byte of a line (only the
+# prefixes of hooked lines; moves and other commands are LINE_OTHER
+# without a handler call)
+_PREFIX_TABLE = {ord(';'): _comment_class, ord('M'): _m_class,
+                 ord('E'): _e_class, ord('T'): _t_class}
+
+class LineClassifier:
+    def __init__(self, layer_keys):
+        self.layer_keys = tuple(k.encode() for k in layer_keys)
+    def classify(self, line):
+        if not line:
+            return LINE_OTHER
+        handler = _PREFIX_TABLE.get(line[0])
+        if handler is None:
+            return LINE_OTHER
+        return handler(line, self.layer_keys)
+
+class StreamStats:
+    def __init__(self):
+        self.reset(0.)
+    def reset(self, eventtime):
+        self.lines = self.hook_lines = self.bytes = 0
+        self.hook_time = {}
+        self.start_time = eventtime
+        self.last_sample_time = eventtime
+        self.last_sample_lines = 0
+        self.lines_per_sec = 0.
+    def note_line(self, size):
+        self.lines += 1
+        self.bytes += size
+    def note_hook(self, name, start):
+        self.hook_lines += 1
+        self.hook_time[name] = (self.hook_time.get(name, 0.)
+                                + time.perf_counter() - start)
+    def get_status(self, eventtime):
+        if eventtime - self.last_sample_time >= 1.:
+            self.lines_per_sec = ((self.lines - self.last_sample_lines)
+                                  / (eventtime - self.last_sample_time))
+            self.last_sample_time = eventtime
+            self.last_sample_lines = self.lines
+        elapsed = eventtime - self.start_time
+        avg = self.lines / elapsed if elapsed > 0. else 0.
+        return {'lines': self.lines, 'bytes': self.bytes,
+                'hook_lines': self.hook_lines,
+                'lines_per_sec': round(self.lines_per_sec, 1),
+                'avg_lines_per_sec': round(avg, 1),
+                'hook_time': {n: round(t, 6)
+                              for n, t in self.hook_time.items()}}
@@ -7,6 +7,49 @@ from os import remove
 import time
 import mcu
 import math
+from array import array
+
+
+class SampleRing:
+    """Fixed size ring of the last 'size' samples of each channel
+
+    append() is called from the mcu response thread and snapshot() from
+    the reactor.  The ring has one spare slot, so the sample being written
+    is never one of the samples a reader can copy, and a reader retries
+    if the writer got far enough to reuse the slots it was copying.  No
+    locking (or waiting) is needed on either side."""
+    def __init__(self, size, channels):
+        self.size = size
+        self.slots = size + 1
+        self.vals = [array('d', bytes(8 * self.slots))
+                     for i in range(channels)]
+        self.params = [None] * self.slots
+        self.count = 0
+
+    def append(self, params, vals):
+        pos = self.count % self.slots
+        self.params[pos] = params
+        for i, val in enumerate(vals):
+            self.vals[i][pos] = val
+        self.count += 1
+
+    def _copy(self, buf, start, end):
+        spos, epos = start % self.slots, end % self.slots
+        if spos <= epos:
+            return buf[spos:epos]
+        return buf[spos:] + buf[:epos]
+
+    def snapshot(self, since=0):
+        # Returns (count, params, vals) for the samples numbered from
+        # 'since' (or the oldest still stored) up to 'count'
+        while True:
+            count = self.count
+            start = min(max(since, count - self.size, 0), count)
+            params = self._copy(self.params, start, count)
+            vals = [self._copy(v, start, count).tolist() for v in self.vals]
+            if self.count <= start + self.size:
+                return count, params, vals
+
 
 class HX711S:
     def __init__(self, config):
@@ -17,11 +60,9 @@ class HX711S:
         self.del_dirty = False
         self.index_dirty = 0
         self.start_tick = 0
-        self.need_wait = False
         self.s_clk_pin = []
         self.s_sdo_pin = []
-        self.all_params = []
-        self.all_vals = [[], [], [], []]
+        self.samples = SampleRing(0, self.s_count)
         for i in range(self.s_count):
             self.s_clk_pin.append(config.get('sensor%d_clk_pin' % i, None if i == 0 else self.s_clk_pin[i - 1]))
             self.s_sdo_pin.append(config.get('sensor%d_sdo_pin' % i, None if i == 0 else self.s_sdo_pin[i - 1]))
@@ -81,22 +122,16 @@ class HX711S:
         pass
 
     def _handle_result_hx711s(self, params):
-        while self.need_wait:
-            self.delay_s(0.001)
-        self.start_tick = self.start_tick if len(self.all_params) != 0 else params['nt']
+        samples = self.samples
+        self.start_tick = self.start_tick if samples.count != 0 else params['nt']
         if self.del_dirty and (params['vd'] != 0 or params['it'] > 20) and self.index_dirty == 0:
             self.index_dirty = 1
             return
         self.index_dirty -= 1 if self.index_dirty == 1 else 0
-        self.all_params.append(params)
-        for i in range(self.s_count):
-            self.all_vals[i].append(params['v%d' % i] - self.base_avgs[i])
+        samples.append(params, [params['v%d' % i] - self.base_avgs[i]
+                                for i in range(self.s_count)])
         if self.show_msg:
             self.gcode.respond_info('Hx711 Val=' + str(params))
-        if len(self.all_params) > self.pi_count:
-            del self.all_params[0]
-            for i in range(self.s_count):
-                del self.all_vals[i][0]
         pass
 
     def query_start(self, pi_count, cycle_count, del_dirty=False, show_msg=False, is_ck_con=False):
@@ -104,8 +139,7 @@ class HX711S:
             pass
         if cycle_count != 0:
             self.pi_count = pi_count
-            self.all_params = []
-            self.all_vals = [[], [], [], []]
+            self.samples = SampleRing(pi_count, self.s_count)
             self.show_msg = show_msg
             self.del_dirty = del_dirty
             self.index_dirty = 0
@@ -114,18 +148,18 @@ class HX711S:
         pass
 
     def get_params(self):
-        self.need_wait = True
-        tmps = [x for x in self.all_params]
-        self.need_wait = False
-        return tmps, self.start_tick
+        count, params, vals = self.samples.snapshot()
+        return params, self.start_tick
 
     def get_vals(self):
-        self.need_wait = True
-        tmps = [[], [], [], []]
-        for i in range(self.s_count):
-            tmps[i] = [x for x in self.all_vals[i]]
-        self.need_wait = False
-        return tmps
+        count, params, vals = self.samples.snapshot()
+        return vals + [[] for i in range(4 - self.s_count)]
+
+    def get_vals_since(self, count):
+        # Returns the number of samples received since query_start() and
+        # the values of each channel for the samples after 'count'
+        count, params, vals = self.samples.snapshot(count)
+        return count, vals
 
     def delay_s(self, delay_s):
         toolhead = self.printer.lookup_object("toolhead")
@@ -0,0 +1,98 @@
+# Persistent in-process cache of gcode file metadata
+#
+# Copyright (C) 2025 K2 Unleashed Contributors
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import os, json, logging, subprocess, collections
+
+PYTHON_ENV = "/usr/share/klippy-env/bin/python3"
+METADATA_SCRIPT = "/usr/share/klipper/klippy/extras/metadata.py"
+MAX_ENTRIES = 64
+
+class MetadataCache:
+    def __init__(self, cache_path, max_entries=MAX_ENTRIES):
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.hits = self.misses = 0
+        self.parser = None
+        self._load()
+    def _load(self):
+        if not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, "r") as f:
+                data = json.load(f)
+            for path, entry in data.get("entries", []):
+                if os.path.isfile(path):
+                    self.entries[path] = entry
+        except Exception:
+            logging.exception("metadata_cache: unable to load %s",
+                              self.cache_path)
+            self.entries.clear()
+    def _save(self):
+        temp_name = self.cache_path + ".tmp"
+        try:
+            with open(temp_name, "w") as f:
+                json.dump({"entries": list(self.entries.items())}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(temp_name, self.cache_path)
+        except Exception:
+            logging.exception("metadata_cache: unable to save %s",
+                              self.cache_path)
+    def _extract(self, file_path):
+        if self.parser is None:
+            try:
+                from . import metadata
+                self.parser = metadata
+            except ImportError:
+                logging.exception("metadata_cache: in-process parser"
+                                  " unavailable, using subprocess")
+                self.parser = False
+        if self.parser:
+            return {'file': os.path.basename(file_path),
+                    'metadata': self.parser.extract_metadata(file_path,
+                                                             False)}
+        cmd = [PYTHON_ENV, METADATA_SCRIPT,
+               "-f", os.path.basename(file_path),
+               "-p", os.path.dirname(file_path)]
+        return json.loads(subprocess.check_output(cmd).decode("utf-8"))
+    def get(self, file_path):
+        # Returns metadata for file_path, parsing only if the file changed
+        file_path = os.path.abspath(file_path)
+        try:
+            st = os.stat(file_path)
+        except OSError as err:
+            logging.error("metadata_cache: %s", err)
+            self.invalidate(file_path)
+            return {}
+        entry = self.entries.get(file_path)
+        if (entry is not None and entry['size'] == st.st_size
+                and entry['mtime'] == st.st_mtime):
+            self.hits += 1
+            self.entries.move_to_end(file_path)
+            return entry['result']
+        self.misses += 1
+        try:
+            result = self._extract(file_path)
+        except Exception as err:
+            logging.error("metadata_cache: extract %s failed: %s",
+                          file_path, err)
+            return {}
+        self.entries[file_path] = {'size': st.st_size, 'mtime': st.st_mtime,
+                                   'result': result}
+        self.entries.move_to_end(file_path)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self._save()
+        return result
+    def invalidate(self, file_path=None):
+        if file_path is None:
+            self.entries.clear()
+        elif self.entries.pop(os.path.abspath(file_path), None) is None:
+            return
+        self._save()
+    def get_status(self, eventtime=None):
+        return {'entries': len(self.entries), 'hits': self.hits,
+                'misses': self.misses}
@@ -0,0 +1,78 @@
+# Fixed-size ring buffer of numeric metric samples
+#
+# Copyright (C) 2025 K2 Unleashed Contributors
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import array, bisect
+
+NAN = float('nan')
+
+class MetricHistory:
+    """Column store of samples sharing one time column
+
+    Every column is a preallocated array('d') of `size` entries, so memory
+    use is fixed at creation: (len(names) + 1) * size * 8 bytes.  Missing
+    values are stored as NaN and skipped when downsampling."""
+    def __init__(self, names, size):
+        self.names = list(names)
+        self.size = size
+        self.times = array.array('d', [0.]) * size
+        self.columns = {n: array.array('d', [NAN]) * size for n in self.names}
+        self.count = self.next_idx = 0
+    def get_memory_size(self):
+        return (len(self.columns) + 1) * self.size * self.times.itemsize
+    def append(self, eventtime, values):
+        idx = self.next_idx
+        self.times[idx] = eventtime
+        for name, column in self.columns.items():
+            column[idx] = values.get(name, NAN)
+        self.next_idx = (idx + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+    def _ordered(self, column, lo, hi):
+        # Slice [lo:hi) of the column in chronological order
+        if self.count < self.size:
+            return column[lo:hi]
+        base = self.next_idx
+        lo += base
+        hi += base
+        if hi <= self.size:
+            return column[lo:hi]
+        if lo >= self.size:
+            return column[lo - self.size:hi - self.size]
+        return column[lo:] + column[:hi - self.size]
+    def query(self, start, end, points, names=None):
+        # Returns min/max/mean of each metric over at most `points` buckets
+        times = self._ordered(self.times, 0, self.count)
+        lo = bisect.bisect_left(times, start)
+        hi = bisect.bisect_right(times, end)
+        if names is None:
+            names = self.names
+        names = [n for n in names if n in self.columns]
+        result = {'time': [], 'metrics': {n: {'min': [], 'max': [],
+                                              'mean': []} for n in names}}
+        count = hi - lo
+        if count <= 0:
+            return result
+        step = max(1, -(-count // max(1, points)))
+        times = times[lo:hi]
+        result['time'] = [times[i] for i in range(0, count, step)]
+        for name in names:
+            values = self._ordered(self.columns[name], lo, hi)
+            out = result['metrics'][name]
+            mins, maxs, means = out['min'], out['max'], out['mean']
+            for i in range(0, count, step):
+                bucket = [v for v in values[i:i + step] if v == v]
+                if not bucket:
+                    mins.append(None)
+                    maxs.append(None)
+                    means.append(None)
+                    continue
+                mins.append(min(bucket))
+                maxs.append(max(bucket))
+                means.append(sum(bucket) / len(bucket))
+        return result
+    def get_status(self, eventtime=None):
+        oldest = self._ordered(self.times, 0, 1)[0] if self.count else None
+        return {'samples': self.count, 'size': self.size,
+                'metrics': len(self.names),
+                'memory': self.get_memory_size(), 'oldest': oldest}
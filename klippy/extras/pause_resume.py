@@ -86,7 +86,7 @@ class PauseResume:
                 os.remove(self.v_sd.print_file_name_path)
                 bl24c16f = self.printer.lookup_object('bl24c16f') if "bl24c16f" in self.printer.objects else None
                 if bl24c16f:
-                    self.gcode.run_script("EEPROM_WRITE_BYTE ADDR=1 VAL=255")
+                    bl24c16f.setEepromDisable()
                 logging.exception(err)
         power_loss_switch = False
         if os.path.exists(self.v_sd.user_print_refer_path):
@@ -108,8 +108,8 @@ class PauseResume:
             response["file_state"] = False
             response["eeprom_state"] = False
             logging.info("current printer state:%s" % print_stats.state)
-        if os.path.exists(self.gcode.exclude_object_info) and (response["file_state"]==False or response["eeprom_state"]==False):
-            os.remove(self.gcode.exclude_object_info)
+        if response["file_state"]==False or response["eeprom_state"]==False:
+            self.gcode.clear_exclude_object_info()
         web_request.send(response)
         return response
     
@@ -120,8 +120,7 @@ class PauseResume:
         from subprocess import call
         if os.path.exists(self.v_sd.print_file_name_path):
             os.remove(self.v_sd.print_file_name_path)
-        if os.path.exists(self.gcode.exclude_object_info):
-            os.remove(self.gcode.exclude_object_info)
+        self.gcode.clear_exclude_object_info()
         call("sync", shell=True)
         bl24c16f = self.printer.lookup_object('bl24c16f') if "bl24c16f" in self.printer.objects else None
         power_loss_switch = False
@@ -131,7 +130,7 @@ class PauseResume:
                 power_loss_switch = data.get("power_loss", {}).get("switch", False)
         bl24c16f = self.printer.lookup_object('bl24c16f') if "bl24c16f" in self.printer.objects else None
         if power_loss_switch and bl24c16f:
-            self.gcode.run_script("EEPROM_WRITE_BYTE ADDR=1 VAL=255")
+            bl24c16f.setEepromDisable()
             self.gcode.respond_info("cancel_continue_print:success")
         print_stats = self.printer.lookup_object('print_stats', None)
         if print_stats:
@@ -168,6 +167,7 @@ class PauseResume:
             gcmd.respond_info("""{"code":"key211", "msg": "Print already paused", "values": []}""")
             return
         self.send_pause_command()
+        self.gcode.flush_recovery_state()
         self.gcode.run_script_from_command("SAVE_GCODE_STATE NAME=PAUSE_STATE")
         self.is_paused = True
         reportInformation("key601")
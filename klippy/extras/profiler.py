@@ -0,0 +1,183 @@
+# On-demand host profiler (stack sampling or cProfile)
+#
+# Copyright (C) 2025 K2 Unleashed Contributors
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, time, logging, threading, cProfile
+from .base_info import base_dir
+
+FORMATS = {'collapsed': 'folded', 'pstats': 'pstats'}
+
+class Profiler:
+    def __init__(self, config):
+        self.printer = config.get_printer()
+        self.reactor = self.printer.get_reactor()
+        self.sample_rate = config.getfloat('sample_rate', 100., minval=1.,
+                                           maxval=1000.)
+        self.output_format = config.getchoice(
+            'output_format', {f: f for f in FORMATS}, 'collapsed')
+        self.output_dir = config.get(
+            'output_dir', os.path.join(base_dir, "printer_data/logs"))
+        self.max_duration = config.getfloat('max_duration', 600., minval=0.)
+        # Profiling state
+        self.format = None
+        self.start_time = 0.
+        self.last_file = None
+        self.last_error = None
+        self.samples = 0
+        self.stacks = {}
+        self.code_names = {}
+        self.profile = None
+        self.sample_thread = None
+        self.stop_event = threading.Event()
+        self.stop_timer = None
+        self.main_ident = threading.get_ident()
+        # Register commands
+        self.printer.register_event_handler("klippy:disconnect",
+                                            self._handle_disconnect)
+        gcode = self.printer.lookup_object('gcode')
+        gcode.register_command("PROFILE_START", self.cmd_PROFILE_START,
+                               desc=self.cmd_PROFILE_START_help)
+        gcode.register_command("PROFILE_STOP", self.cmd_PROFILE_STOP,
+                               desc=self.cmd_PROFILE_STOP_help)
+        webhooks = self.printer.lookup_object('webhooks')
+        webhooks.register_endpoint("profiler/start",
+                                   self._handle_start_request)
+        webhooks.register_endpoint("profiler/stop", self._handle_stop_request)
+    def _handle_disconnect(self):
+        if self.format is not None:
+            self.stop()
+    # Stack sampling (runs in a background thread)
+    def _code_name(self, code):
+        name = self.code_names.get(code)
+        if name is None:
+            name = self.code_names[code] = "%s:%s" % (
+                os.path.basename(code.co_filename), code.co_name)
+        return name
+    def _sample_thread(self, interval):
+        # The reactor runs every greenlet on the main thread, so its
+        # current frame is the stack of whichever greenlet is running
+        stacks = self.stacks
+        main_ident = self.main_ident
+        while not self.stop_event.wait(interval):
+            frame = sys._current_frames().get(main_ident)
+            names = []
+            while frame is not None:
+                names.append(self._code_name(frame.f_code))
+                frame = frame.f_back
+            del frame
+            if not names:
+                continue
+            names.reverse()
+            key = ";".join(names)
+            stacks[key] = stacks.get(key, 0) + 1
+            self.samples += 1
+    # Start/stop
+    def start(self, output_format=None, sample_rate=None):
+        if self.format is not None:
+            raise self.printer.command_error("Profiler already running")
+        output_format = output_format or self.output_format
+        if output_format not in FORMATS:
+            raise self.printer.command_error(
+                "Unknown profile format '%s'" % (output_format,))
+        self.samples = 0
+        self.stacks = {}
+        self.last_error = None
+        self.start_time = self.reactor.monotonic()
+        if output_format == 'pstats':
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            self.stop_event.clear()
+            self.sample_thread = threading.Thread(
+                target=self._sample_thread,
+                args=(1. / (sample_rate or self.sample_rate),))
+            self.sample_thread.daemon = True
+            self.sample_thread.start()
+        self.format = output_format
+        if self.max_duration:
+            self.stop_timer = self.reactor.register_timer(
+                self._stop_event, self.start_time + self.max_duration)
+        logging.info("profiler: started (%s)", output_format)
+    def _stop_event(self, eventtime):
+        self.stop_timer = None
+        try:
+            self.stop()
+        except self.printer.command_error as e:
+            logging.error("profiler: %s", str(e))
+        return self.reactor.NEVER
+    def stop(self, filename=None):
+        if self.format is None:
+            raise self.printer.command_error("Profiler not running")
+        output_format = self.format
+        self.format = None
+        if self.stop_timer is not None:
+            self.reactor.unregister_timer(self.stop_timer)
+            self.stop_timer = None
+        profile = self.profile
+        self.profile = None
+        if profile is not None:
+            profile.disable()
+        if self.sample_thread is not None:
+            self.stop_event.set()
+            self.sample_thread.join()
+            self.sample_thread = None
+        duration = self.reactor.monotonic() - self.start_time
+        if filename is None:
+            filename = os.path.join(self.output_dir, "profile-%s.%s" % (
+                time.strftime("%Y%m%d-%H%M%S"), FORMATS[output_format]))
+        try:
+            dirname = os.path.dirname(filename)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            if profile is not None:
+                profile.dump_stats(filename)
+            else:
+                with open(filename, 'w') as f:
+                    f.write("".join(["%s %d\n" % (stack, count) for stack, count
+                                     in sorted(self.stacks.items())]))
+        except (IOError, OSError) as e:
+            self.last_error = str(e)
+            logging.exception("profiler: unable to write %s", filename)
+            raise self.printer.command_error(
+                "Unable to write profile %s: %s" % (filename, str(e)))
+        finally:
+            self.stacks = {}
+            self.code_names = {}
+        self.last_file = filename
+        logging.info("profiler: wrote %s (%.1fs, %d samples)",
+                     filename, duration, self.samples)
+        return {'filename': filename, 'format': output_format,
+                'duration': duration, 'samples': self.samples}
+    # G-Code commands
+    cmd_PROFILE_START_help = "Start profiling the host software"
+    def cmd_PROFILE_START(self, gcmd):
+        output_format = gcmd.get('FORMAT', None)
+        sample_rate = gcmd.get_float('RATE', None, minval=1., maxval=1000.)
+        self.start(output_format and output_format.lower(), sample_rate)
+        gcmd.respond_info("Profiler started (%s)" % (self.format,))
+    cmd_PROFILE_STOP_help = "Stop profiling and write the results to a file"
+    def cmd_PROFILE_STOP(self, gcmd):
+        res = self.stop(gcmd.get('FILENAME', None))
+        msg = "Profile written to %s (%.1fs" % (res['filename'],
+                                                res['duration'])
+        if res['format'] == 'collapsed':
+            msg += ", %d samples" % (res['samples'],)
+        gcmd.respond_info(msg + ")")
+    # Webhooks
+    def _handle_start_request(self, web_request):
+        output_format = web_request.get_str('format', None)
+        sample_rate = web_request.get('rate', None, types=(int, float))
+        if sample_rate is not None and not 1. <= sample_rate <= 1000.:
+            raise web_request.error("rate must be between 1 and 1000")
+        self.start(output_format, sample_rate)
+        web_request.send(self.get_status(self.reactor.monotonic()))
+    def _handle_stop_request(self, web_request):
+        web_request.send(self.stop(web_request.get_str('filename', None)))
+    def get_status(self, eventtime):
+        return {'active': self.format is not None, 'format': self.format,
+                'samples': self.samples, 'last_file': self.last_file,
+                'last_error': self.last_error}
+
+def load_config(config):
+    return Profiler(config)
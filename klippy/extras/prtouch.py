@@ -625,16 +625,27 @@ class PRTouchEndstopWrapper:
         self.obj.hx711s.delay_s(0.015)
         self.pnt_msg('*********************************************************')
         self.pnt_msg('PROBE_BY_STEP x=%.2f y=%.2f z=%.2f speed_mm=%.2f step_us=%d step_cnt=%d' % (rdy_pos[0], rdy_pos[1], rdy_pos[2], speed_mm, step_us, step_cnt))
+        # Filter each new sample once instead of the whole window per loop
+        s_count = self.obj.hx711s.s_count
+        fit_fts = [self.obj.filter.get_filter_stream(self.obj.filter.hft_hz, self.obj.filter.lft_k1, self.cfg.pi_count) for i in range(s_count)]
+        oft_fts = [self.obj.filter.get_offset_stream(self.obj.filter.lft_k1_oft, self.cfg.pi_count) for i in range(s_count)]
+        last_count = 0
         while self.ck_sys_sta():
             self.obj.hx711s.send_heart_beat()
             self.obj.dirzctl.send_heart_beat()
-            all_valss = self.obj.hx711s.get_vals()
-            if all_valss is None or len(all_valss[0]) == 0:
+            count, new_valss = self.obj.hx711s.get_vals_since(last_count)
+            if count == 0 or (count == last_count and len(self.obj.dirzctl.get_params()[0]) != 2):
+                # No new samples (only the dirzctl run over check can change)
                 self.obj.hx711s.delay_s(0.005)
                 continue
-            unfit_vals, tmp_unfit_vals = self.obj.filter.cal_offset_by_vals(self.obj.hx711s.s_count, all_valss, self.obj.filter.lft_k1_oft, self.cfg.pi_count)
-            fit_vals, tmp_fit_vals = self.obj.filter.cal_filter_by_vals(self.obj.hx711s.s_count, all_valss, self.obj.filter.hft_hz, self.obj.filter.lft_k1, self.cfg.pi_count)
-            
+            last_count = count
+            for i in range(s_count):
+                for val in new_valss[i]:
+                    fit_fts[i].add(val)
+                    oft_fts[i].add(val)
+            tmp_fit_vals = [ft.get_vals() for ft in fit_fts]
+            tmp_unfit_vals = [ft.get_vals() for ft in oft_fts]
+
             for i in range(self.obj.hx711s.s_count):
                 if not self._check_trigger(i, tmp_fit_vals[i], tmp_unfit_vals[i], min_hold, max_hold):
                     continue
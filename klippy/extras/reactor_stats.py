@@ -0,0 +1,43 @@
+# Reactor timer lateness and callback run time reporting
+#
+# Copyright (C) 2025 K2 Unleashed Contributors
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+
+class ReactorStatsReport:
+    def __init__(self, config):
+        self.printer = config.get_printer()
+        self.reactor = self.printer.get_reactor()
+        slow_time = config.getfloat('slow_time', .050, above=0.)
+        watchdog = config.getboolean('watchdog', True)
+        self.report_count = config.getint('report_count', 10, minval=1)
+        self.rstats = self.reactor.enable_stats(slow_time, watchdog)
+        self.last_status = {'max_late': 0., 'max_run_time': 0.,
+                            'slow_callbacks': 0, 'greenlets': 0}
+        self.printer.register_event_handler("klippy:disconnect",
+                                            self._handle_disconnect)
+        webhooks = self.printer.lookup_object('webhooks')
+        webhooks.register_endpoint("reactor/stats", self._handle_stats)
+    def _handle_disconnect(self):
+        self.reactor.disable_stats()
+    def _handle_stats(self, web_request):
+        count = web_request.get_int('count', self.report_count)
+        web_request.send(self.rstats.get_stats(count))
+        if web_request.get('reset', False, types=(bool,)):
+            self.rstats.reset()
+    def stats(self, eventtime):
+        max_late, max_time, worst, slow = self.rstats.get_interval_stats()
+        greenlets = self.rstats.get_greenlet_count()
+        self.last_status = {'max_late': max_late, 'max_run_time': max_time,
+                            'slow_callbacks': slow, 'greenlets': greenlets}
+        msg = ("reactor_max_late=%.3f reactor_max_run=%.3f reactor_slow=%d"
+               " greenlets=%d gc_max=%.3f" % (
+                   max_late, max_time, slow, greenlets, self.rstats.gc_max))
+        if worst is not None and max_time >= self.rstats.slow_time:
+            msg += " reactor_worst=%s" % (worst,)
+        return (False, msg)
+    def get_status(self, eventtime):
+        return self.last_status
+
+def load_config(config):
+    return ReactorStatsReport(config)
@@ -0,0 +1,111 @@
+# Write-behind JSON state files used by power loss recovery
+#
+# Copyright (C) 2025 K2 Unleashed Contributors
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import os, json, ast, logging
+
+FLUSH_DELAY = 1.
+
+class RecoveryStateFile:
+    """In-memory copy of a small JSON state file
+
+    Changes are written behind by a reactor timer, so a burst of updates
+    results in a single write.  The file is replaced atomically (write to
+    a temporary file, then rename) so a power loss leaves either the old
+    or the new contents on disk."""
+    def __init__(self, reactor, filename, flush_delay=FLUSH_DELAY):
+        self.reactor = reactor
+        self.filename = filename
+        self.flush_delay = flush_delay
+        self.data = None
+        self.is_dirty = False
+        self.flush_timer = reactor.register_timer(self._flush_event)
+    def _default(self):
+        return {}
+    def _load(self):
+        data = None
+        try:
+            with open(self.filename, "r") as f:
+                text = f.read()
+            if text:
+                try:
+                    data = json.loads(text)
+                except ValueError:
+                    # Older firmware wrote some files as Python literals
+                    data = ast.literal_eval(text)
+        except (IOError, OSError):
+            pass
+        except Exception:
+            logging.exception("recovery_state: unable to load %s",
+                              self.filename)
+        if not isinstance(data, dict):
+            data = self._default()
+        self._set_data(data)
+    def _set_data(self, data):
+        self.data = data
+    def get(self):
+        if self.data is None:
+            self._load()
+        return self.data
+    def note_update(self):
+        # Schedule a write of the current contents
+        if not self.is_dirty:
+            self.is_dirty = True
+            self.reactor.update_timer(
+                self.flush_timer, self.reactor.monotonic() + self.flush_delay)
+    def _flush_event(self, eventtime):
+        self.flush()
+        return self.reactor.NEVER
+    def flush(self):
+        if not self.is_dirty:
+            return
+        self.is_dirty = False
+        self.reactor.update_timer(self.flush_timer, self.reactor.NEVER)
+        temp_name = self.filename + ".tmp"
+        try:
+            with open(temp_name, "w") as f:
+                f.write(json.dumps(self.data))
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(temp_name, self.filename)
+        except Exception:
+            logging.exception("recovery_state: unable to save %s",
+                              self.filename)
+    def clear(self):
+        # Forget the state and remove the file
+        self.is_dirty = False
+        self.reactor.update_timer(self.flush_timer, self.reactor.NEVER)
+        self._set_data(self._default())
+        try:
+            if os.path.exists(self.filename):
+                os.remove(self.filename)
+        except OSError:
+            logging.exception("recovery_state: unable to remove %s",
+                              self.filename)
+
+# Last requested heater targets ("extruder", "bed", "chamber_heater")
+class TemperatureState(RecoveryStateFile):
+    def set_temperature(self, heater, value):
+        data = self.get()
+        if data.get(heater) != value:
+            data[heater] = value
+            self.note_update()
+
+# EXCLUDE_OBJECT_DEFINE and EXCLUDE_OBJECT NAME lines seen in a print
+class ExcludeObjectState(RecoveryStateFile):
+    KEYS = ("EXCLUDE_OBJECT_DEFINE", "EXCLUDE_OBJECT")
+    def _default(self):
+        return {key: [] for key in self.KEYS}
+    def _set_data(self, data):
+        for key in self.KEYS:
+            data.setdefault(key, [])
+        self.data = data
+        self.seen = {key: set(data[key]) for key in self.KEYS}
+    def add(self, key, line):
+        self.get()
+        seen = self.seen[key]
+        if line not in seen:
+            seen.add(line)
+            self.data[key].append(line)
+            self.note_update()
@@ -297,14 +297,19 @@ class ResonanceTester:
         calibration_data = self._run_test(gcmd, calibrate_axes, helper)
 
         configfile = self.printer.lookup_object('configfile')
+        # Fit the shapers for all axes at once, one process per axis
         for axis in calibrate_axes:
+            calibration_data[axis].normalize_to_frequencies()
+        axes_shapers = helper.background_process_exec_many(
+                helper.fit_shapers, [(calibration_data[axis], max_smoothing)
+                                     for axis in calibrate_axes])
+        for axis, axis_shapers in zip(calibrate_axes, axes_shapers):
             axis_name = axis.get_name()
             gcmd.respond_info(
                     "Calculating the best input shaper parameters for %s axis"
                     % (axis_name,))
-            calibration_data[axis].normalize_to_frequencies()
-            best_shaper, all_shapers = helper.find_best_shaper(
-                    calibration_data[axis], max_smoothing, gcmd.respond_info)
+            best_shaper, all_shapers = helper.select_best_shaper(
+                    axis_shapers, gcmd.respond_info)
             gcmd.respond_info(
                     "Recommended shaper_type_%s = %s, shaper_freq_%s = %.1f Hz"
                     % (axis_name, best_shaper.name,
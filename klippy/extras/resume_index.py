@@ -0,0 +1,204 @@
+# Power-loss resume checkpoint index for virtual_sdcard prints
+#
+# Copyright (C) 2025 K2 Unleashed Contributors
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import os, re, json, logging, bisect
+
+READ_SIZE = 64 * 1024
+TOOL_RE = re.compile(r"^\s*T(\d+)\s*$")
+MOVE_CMDS = (b"G0 ", b"G1 ", b"G2 ", b"G3 ")
+
+class ResumeState:
+    def __init__(self):
+        self.position = [0., 0., 0., 0.]
+        self.speed = 0.
+        self.tool = ""
+        self.fan_state = {}
+        self.layer = 0
+        self.absolute_coord = self.absolute_extrude = True
+    def to_dict(self):
+        return {'position': self.position, 'speed': self.speed,
+                'tool': self.tool, 'fan_state': self.fan_state,
+                'layer': self.layer, 'absolute_coord': self.absolute_coord,
+                'absolute_extrude': self.absolute_extrude}
+    @classmethod
+    def from_dict(cls, data):
+        state = cls()
+        state.position = [float(v) for v in data['position']]
+        state.speed = float(data.get('speed', 0.))
+        state.tool = data.get('tool', "")
+        state.fan_state = dict(data.get('fan_state', {}))
+        state.layer = int(data.get('layer', 0))
+        state.absolute_coord = data.get('absolute_coord', True)
+        state.absolute_extrude = data.get('absolute_extrude', True)
+        return state
+    def get_xyzet(self):
+        # Same layout as VirtualSD.getXYZET() plus the extra index fields
+        x, y, z, e = self.position
+        return {"X": x, "Y": y, "Z": z, "E": e, "T": self.tool,
+                "F": self.speed, "fan_state": dict(self.fan_state),
+                "layer": self.layer, "absolute_coord": self.absolute_coord,
+                "absolute_extrude": self.absolute_extrude}
+    def _apply_move(self, words):
+        for word in words:
+            if not word:
+                continue
+            axis = "XYZE".find(word[0])
+            if axis < 0:
+                if word[0] == "F":
+                    self.speed = float(word[1:])
+                continue
+            value = float(word[1:])
+            if axis == 3:
+                if self.absolute_extrude:
+                    self.position[3] = value
+                else:
+                    self.position[3] += value
+            elif self.absolute_coord:
+                self.position[axis] = value
+            else:
+                self.position[axis] += value
+    def _apply_set_position(self, words):
+        for word in words:
+            axis = "XYZE".find(word[:1])
+            if axis >= 0:
+                self.position[axis] = float(word[1:])
+    def apply_line(self, line, layer_keys):
+        if not line or line[0] == ord(';'):
+            if line.startswith(layer_keys):
+                self.layer += 1
+            return
+        cpos = line.find(b';')
+        if cpos >= 0:
+            line = line[:cpos]
+        line = line.strip()
+        try:
+            self._apply_command(line)
+        except ValueError:
+            logging.info("resume_index: skipping malformed line %r", line)
+    def _apply_command(self, line):
+        if line.startswith(MOVE_CMDS):
+            self._apply_move(line.decode().upper().split()[1:])
+        elif line.startswith(b"G92"):
+            self._apply_set_position(line.decode().upper().split()[1:])
+        elif line == b"G90":
+            self.absolute_coord = True
+        elif line == b"G91":
+            self.absolute_coord = False
+        elif line == b"M82":
+            self.absolute_extrude = True
+        elif line == b"M83":
+            self.absolute_extrude = False
+        elif line.startswith(b"M106"):
+            fan = line.decode()
+            for key in ("M106 S", "M106 P0", "M106 P1", "M106 P2"):
+                if fan.startswith(key):
+                    self.fan_state[key] = fan
+                    break
+        elif line.startswith(b"T"):
+            m = TOOL_RE.match(line.decode())
+            if m is not None:
+                self.tool = "T%s" % (m.group(1),)
+
+def scan_forward(f, start, end, state, layer_keys, pause=None):
+    # Replay lines in [start, end) of the binary file f onto state
+    f.seek(start)
+    partial = b""
+    pos = start
+    while pos < end:
+        data = f.read(min(READ_SIZE, end - pos))
+        if not data:
+            break
+        pos += len(data)
+        lines = (partial + data).split(b'\n')
+        partial = lines.pop()
+        for line in lines:
+            state.apply_line(line.rstrip(b'\r'), layer_keys)
+        if pause is not None:
+            pause()
+    return state
+
+class ResumeIndex:
+    """Append-only checkpoint file kept beside the print file
+
+    Each record holds the G-Code state at a file position that was also
+    written to the power-loss EEPROM.  On resume the nearest record at or
+    before the EEPROM position is found by bisection and only the gap
+    between the two is re-scanned."""
+    def __init__(self, layer_keys):
+        self.layer_keys = tuple(k.encode() for k in layer_keys)
+        self.file_path = None
+        self.index_file = None
+    def get_index_path(self, file_path):
+        dirname, basename = os.path.split(file_path)
+        return os.path.join(dirname, "." + basename + ".resume")
+    def _close(self):
+        if self.index_file is not None:
+            self.index_file.close()
+            self.index_file = None
+    def clear(self, file_path=None):
+        self._close()
+        file_path = file_path or self.file_path
+        self.file_path = None
+        if file_path is None:
+            return
+        try:
+            os.remove(self.get_index_path(file_path))
+        except OSError:
+            pass
+    def record(self, file_path, file_position, state):
+        try:
+            if self.file_path != file_path or self.index_file is None:
+                self._close()
+                self.file_path = file_path
+                self.index_file = open(self.get_index_path(file_path), "a")
+                if not self.index_file.tell():
+                    header = {'file': file_path,
+                              'size': os.path.getsize(file_path)}
+                    self.index_file.write(json.dumps(header) + "\n")
+            self.index_file.write(json.dumps([file_position,
+                                              state.to_dict()]) + "\n")
+            self.index_file.flush()
+            os.fsync(self.index_file.fileno())
+        except Exception:
+            logging.exception("resume_index: unable to record checkpoint")
+            self._close()
+    def load(self, file_path):
+        # Returns sorted checkpoint positions and states for file_path
+        positions, states = [], []
+        index_path = self.get_index_path(file_path)
+        if not os.path.exists(index_path):
+            return positions, states
+        with open(index_path, "r") as f:
+            lines = f.read().split("\n")
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            return positions, states
+        if (header.get('file') != file_path
+                or header.get('size') != os.path.getsize(file_path)):
+            logging.info("resume_index: stale index %s", index_path)
+            return positions, states
+        for line in lines[1:]:
+            try:
+                pos, data = json.loads(line)
+            except ValueError:
+                # Torn final record from the power loss
+                continue
+            idx = bisect.bisect_right(positions, pos)
+            positions.insert(idx, pos)
+            states.insert(idx, data)
+        return positions, states
+    def lookup(self, file_path, file_position, pause=None):
+        # Returns the ResumeState at file_position, or None if unindexed
+        positions, states = self.load(file_path)
+        idx = bisect.bisect_right(positions, file_position) - 1
+        if idx < 0:
+            return None
+        state = ResumeState.from_dict(states[idx])
+        if positions[idx] < file_position:
+            with open(file_path, "rb") as f:
+                scan_forward(f, positions[idx], file_position, state,
+                             self.layer_keys, pause)
+        return state
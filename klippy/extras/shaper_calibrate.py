@@ -105,11 +105,14 @@ class ShaperCalibrate:
                     "docs/Measuring_Resonances.md for more details).")
 
     def background_process_exec(self, method, args):
+        return self.background_process_exec_many(method, [args])[0]
+
+    def background_process_exec_many(self, method, args_list):
+        # Run method(*args) for each entry of args_list, one process each
         if self.printer is None:
-            return method(*args)
+            return [method(*args) for args in args_list]
         import queuelogger
-        parent_conn, child_conn = multiprocessing.Pipe()
-        def wrapper():
+        def wrapper(child_conn, args):
             try:
                 gcode = self.printer.lookup_object("gcode")
                 gcode.respond_info("current nice: %d" % os.nice(0), log=False)
@@ -127,26 +130,46 @@ class ShaperCalibrate:
                 return
             child_conn.send((False, res))
             child_conn.close()
-        # Start a process to perform the calculation
-        calc_proc = multiprocessing.Process(target=wrapper)
-        calc_proc.daemon = True
-        calc_proc.start()
-        # Wait for the process to finish
+        # Start the processes to perform the calculations
+        procs = []
+        for args in args_list:
+            parent_conn, child_conn = multiprocessing.Pipe()
+            calc_proc = multiprocessing.Process(target=wrapper,
+                                                args=(child_conn, args))
+            calc_proc.daemon = True
+            calc_proc.start()
+            procs.append((calc_proc, parent_conn))
+        # Wait for the processes to finish
         reactor = self.printer.get_reactor()
         gcode = self.printer.lookup_object("gcode")
         eventtime = last_report_time = reactor.monotonic()
-        while calc_proc.is_alive():
+        results = [None] * len(procs)
+        pending = list(range(len(procs)))
+        while pending:
+            # Drain results as they arrive so large results can not fill
+            # a pipe and stall a child that is trying to exit
+            for i in list(pending):
+                calc_proc, parent_conn = procs[i]
+                if parent_conn.poll():
+                    results[i] = parent_conn.recv()
+                    pending.remove(i)
+                elif not calc_proc.is_alive() and not parent_conn.poll():
+                    results[i] = (True, "process exited without a result")
+                    pending.remove(i)
+            if not pending:
+                break
             if eventtime > last_report_time + 5.:
                 last_report_time = eventtime
                 gcode.respond_info("Wait for calculations..", log=False)
             eventtime = reactor.pause(eventtime + .1)
         # Return results
-        is_err, res = parent_conn.recv()
-        if is_err:
-            raise self.error("""{"code": "key312", "msg": "Error in remote calculation: %s", "values":["%s"]}""" % (res,res))
-        calc_proc.join()
-        parent_conn.close()
-        return res
+        for calc_proc, parent_conn in procs:
+            calc_proc.join()
+            parent_conn.close()
+        for is_err, res in results:
+            if is_err:
+                raise self.error("""{"code": "key312", "msg": "Error in remote calculation: %s", "values":["%s"]}""" % (res,res))
+        return [res for is_err, res in results]
 
     def _split_into_windows(self, x, window_size, overlap):
         # Memory-efficient algorithm to split an input 'x' into a series
@@ -296,49 +319,76 @@ class ShaperCalibrate:
 
     def _estimate_shaper(self, shaper, test_damping_ratio, test_freqs):
         np = self.numpy
+        A, T = np.array([shaper[0]]), np.array([shaper[1]])
+        return self._estimate_shapers(A, T, test_damping_ratio, test_freqs)[0]
 
-        A, T = np.array(shaper[0]), np.array(shaper[1])
-        inv_D = 1. / A.sum()
+    def _estimate_shapers(self, A, T, test_damping_ratio, test_freqs):
+        # Response at test_freqs of every shaper in A, T (one per row),
+        # evaluated for all shapers in a single broadcast
+        np = self.numpy
+        inv_D = 1. / A.sum(axis=1)
 
         omega = 2. * math.pi * test_freqs
         damping = test_damping_ratio * omega
         omega_d = omega * math.sqrt(1. - test_damping_ratio**2)
-        W = A * np.exp(np.outer(-damping, (T[-1] - T)))
-        S = W * np.sin(np.outer(omega_d, T))
-        C = W * np.cos(np.outer(omega_d, T))
-        return np.sqrt(S.sum(axis=1)**2 + C.sum(axis=1)**2) * inv_D
+        W = A[:, None, :] * np.exp(
+                -damping[None, :, None] * (T[:, -1:] - T)[:, None, :])
+        S = W * np.sin(omega_d[None, :, None] * T[:, None, :])
+        C = W * np.cos(omega_d[None, :, None] * T[:, None, :])
+        return (np.sqrt(S.sum(axis=2)**2 + C.sum(axis=2)**2)
+                * inv_D[:, None])
 
     def _estimate_remaining_vibrations(self, shaper, test_damping_ratio,
                                        freq_bins, psd):
-        vals = self._estimate_shaper(shaper, test_damping_ratio, freq_bins)
+        np = self.numpy
+        A, T = np.array([shaper[0]]), np.array([shaper[1]])
+        vibrations, vals = self._estimate_shapers_vibrations(
+                A, T, test_damping_ratio, freq_bins, psd)
+        return (vibrations[0], vals[0])
+
+    def _estimate_shapers_vibrations(self, A, T, test_damping_ratio,
+                                     freq_bins, psd):
+        np = self.numpy
+        vals = self._estimate_shapers(A, T, test_damping_ratio, freq_bins)
         # The input shaper can only reduce the amplitude of vibrations by
         # SHAPER_VIBRATION_REDUCTION times, so all vibrations below that
         # threshold can be igonred
         vibr_threshold = psd.max() / shaper_defs.SHAPER_VIBRATION_REDUCTION
-        remaining_vibrations = self.numpy.maximum(
-                vals * psd - vibr_threshold, 0).sum()
-        all_vibrations = self.numpy.maximum(psd - vibr_threshold, 0).sum()
+        remaining_vibrations = np.maximum(
+                vals * psd - vibr_threshold, 0).sum(axis=1)
+        all_vibrations = np.maximum(psd - vibr_threshold, 0).sum()
         return (remaining_vibrations / all_vibrations, vals)
 
     def _get_shaper_smoothing(self, shaper, accel=5000, scv=5.):
-        half_accel = accel * .5
+        np = self.numpy
+        A, T = np.array([shaper[0]]), np.array([shaper[1]])
+        return float(self._get_shapers_smoothing(A, T, accel, scv)[0])
+
+    def _get_shapers_smoothing(self, A, T, accel=5000, scv=5.):
+        # Smoothing of every shaper in A, T; accel may be a per-shaper array
+        np = self.numpy
+        half_accel = (np.asarray(accel, dtype=float) * .5).reshape(-1, 1)
 
-        A, T = shaper
-        inv_D = 1. / sum(A)
-        n = len(T)
+        inv_D = 1. / A.sum(axis=1)
         # Calculate input shaper shift
-        ts = sum([A[i] * T[i] for i in range(n)]) * inv_D
+        ts = ((A * T).sum(axis=1) * inv_D)[:, None]
 
         # Calculate offset for 90 and 180 degrees turn
-        offset_90 = offset_180 = 0.
-        for i in range(n):
-            if T[i] >= ts:
-                # Calculate offset for one of the axes
-                offset_90 += A[i] * (scv + half_accel * (T[i]-ts)) * (T[i]-ts)
-            offset_180 += A[i] * half_accel * (T[i]-ts)**2
+        dt = T - ts
+        offset_90 = np.where(dt >= 0., A * (scv + half_accel * dt) * dt,
+                             0.).sum(axis=1)
+        offset_180 = (A * half_accel * dt**2).sum(axis=1)
         offset_90 *= inv_D * math.sqrt(2.)
         offset_180 *= inv_D
-        return max(offset_90, offset_180)
+        return np.maximum(offset_90, offset_180)
+
+    def _get_shaper_arrays(self, shaper_cfg, test_freqs):
+        np = self.numpy
+        shapers = [shaper_cfg.init_func(
+                        test_freq, shaper_defs.DEFAULT_DAMPING_RATIO)
+                   for test_freq in test_freqs]
+        return (np.array([A for A, T in shapers]),
+                np.array([T for A, T in shapers]))
 
     def fit_shaper(self, shaper_cfg, calibration_data, max_smoothing):
         np = self.numpy
@@ -349,25 +399,36 @@ class ShaperCalibrate:
         psd = calibration_data.psd_sum[freq_bins <= MAX_FREQ]
         freq_bins = freq_bins[freq_bins <= MAX_FREQ]
 
+        # Evaluate all test frequencies at once (highest frequency first)
+        test_freqs = test_freqs[::-1]
+        A, T = self._get_shaper_arrays(shaper_cfg, test_freqs)
+        shapers_smoothing = self._get_shapers_smoothing(A, T)
+        if max_smoothing:
+            # Frequencies past the first one that smooths too much are
+            # never considered, so skip evaluating them
+            too_smooth = np.nonzero(shapers_smoothing[1:] > max_smoothing)[0]
+            if len(too_smooth):
+                count = too_smooth[0] + 2
+                test_freqs, A, T = test_freqs[:count], A[:count], T[:count]
+                shapers_smoothing = shapers_smoothing[:count]
+        shapers_vibrations = np.zeros(shape=test_freqs.shape)
+        shapers_vals = np.zeros(shape=(len(test_freqs),) + freq_bins.shape)
+        # Exact damping ratio of the printer is unknown, pessimizing
+        # remaining vibrations over possible damping values
+        for dr in TEST_DAMPING_RATIOS:
+            vibrations, vals = self._estimate_shapers_vibrations(
+                    A, T, dr, freq_bins, psd)
+            shapers_vals = np.maximum(shapers_vals, vals)
+            shapers_vibrations = np.maximum(shapers_vibrations, vibrations)
+        shapers_max_accel = self.find_shapers_max_accel(A, T)
+
         best_res = None
         results = []
-        for test_freq in test_freqs[::-1]:
-            shaper_vibrations = 0.
-            shaper_vals = np.zeros(shape=freq_bins.shape)
-            shaper = shaper_cfg.init_func(
-                    test_freq, shaper_defs.DEFAULT_DAMPING_RATIO)
-            shaper_smoothing = self._get_shaper_smoothing(shaper)
+        for i, test_freq in enumerate(test_freqs):
+            shaper_smoothing = float(shapers_smoothing[i])
             if max_smoothing and shaper_smoothing > max_smoothing and best_res:
                 return best_res
-            # Exact damping ratio of the printer is unknown, pessimizing
-            # remaining vibrations over possible damping values
-            for dr in TEST_DAMPING_RATIOS:
-                vibrations, vals = self._estimate_remaining_vibrations(
-                        shaper, dr, freq_bins, psd)
-                shaper_vals = np.maximum(shaper_vals, vals)
-                if vibrations > shaper_vibrations:
-                    shaper_vibrations = vibrations
-            max_accel = self.find_shaper_max_accel(shaper)
+            shaper_vibrations = shapers_vibrations[i]
             # The score trying to minimize vibrations, but also accounting
             # the growth of smoothing. The formula itself does not have any
             # special meaning, it simply shows good results on real user data
@@ -375,9 +436,10 @@ class ShaperCalibrate:
                                                shaper_vibrations * .2 + .01)
             results.append(
                     CalibrationResult(
-                        name=shaper_cfg.name, freq=test_freq, vals=shaper_vals,
-                        vibrs=shaper_vibrations, smoothing=shaper_smoothing,
-                        score=shaper_score, max_accel=max_accel))
+                        name=shaper_cfg.name, freq=test_freq,
+                        vals=shapers_vals[i], vibrs=shaper_vibrations,
+                        smoothing=shaper_smoothing, score=shaper_score,
+                        max_accel=float(shapers_max_accel[i])))
             if best_res is None or best_res.vibrs > results[-1].vibrs:
                 # The current frequency is better for the shaper.
                 best_res = results[-1]
@@ -389,39 +451,52 @@ class ShaperCalibrate:
                 selected = res
         return selected
 
-    def _bisect(self, func):
-        left = right = 1.
-        while not func(left):
-            right = left
-            left *= .5
-        if right == left:
-            while func(right):
-                right *= 2.
-        while right - left > 1e-8:
+    def fit_shapers(self, calibration_data, max_smoothing):
+        # Fit every autotune shaper to one set of calibration data
+        return [self.fit_shaper(shaper_cfg, calibration_data, max_smoothing)
+                for shaper_cfg in shaper_defs.INPUT_SHAPERS
+                if shaper_cfg.name in self.autotune_shapers]
+
+    def _bisect(self, func, count):
+        # Element-wise bisection: for each of 'count' problems find the
+        # largest value for which func() holds (func takes and returns
+        # arrays).  Same steps as a scalar bisection per element.
+        np = self.numpy
+        left = np.ones(count)
+        right = np.ones(count)
+        active = ~func(left)
+        while active.any():
+            right[active] = left[active]
+            left[active] *= .5
+            active &= ~func(left)
+        active = (right == left) & func(right)
+        while active.any():
+            right[active] *= 2.
+            active &= func(right)
+        active = right - left > 1e-8
+        while active.any():
             middle = (left + right) * .5
-            if func(middle):
-                left = middle
-            else:
-                right = middle
+            ok = func(middle)
+            left = np.where(active & ok, middle, left)
+            right = np.where(active & ~ok, middle, right)
+            active = right - left > 1e-8
         return left
 
     def find_shaper_max_accel(self, shaper):
+        np = self.numpy
+        A, T = np.array([shaper[0]]), np.array([shaper[1]])
+        return float(self.find_shapers_max_accel(A, T)[0])
+
+    def find_shapers_max_accel(self, A, T):
         # Just some empirically chosen value which produces good projections
         # for max_accel without much smoothing
         TARGET_SMOOTHING = 0.12
-        max_accel = self._bisect(lambda test_accel: self._get_shaper_smoothing(
-            shaper, test_accel) <= TARGET_SMOOTHING)
-        return max_accel
+        return self._bisect(lambda test_accel: self._get_shapers_smoothing(
+            A, T, test_accel) <= TARGET_SMOOTHING, A.shape[0])
 
-    def find_best_shaper(self, calibration_data, max_smoothing, logger=None):
+    def select_best_shaper(self, all_shapers, logger=None):
         best_shaper = None
-        all_shapers = []
-        for shaper_cfg in shaper_defs.INPUT_SHAPERS:
-            # if shaper_cfg.name not in AUTOTUNE_SHAPERS:
-            if shaper_cfg.name not in self.autotune_shapers:
-                continue
-            shaper = self.background_process_exec(self.fit_shaper, (
-                shaper_cfg, calibration_data, max_smoothing))
+        for shaper in all_shapers:
             if logger is not None:
                 logger("Fitted shaper '%s' frequency = %.1f Hz "
                        "(vibrations = %.1f%%, smoothing ~= %.3f)" % (
@@ -430,7 +505,6 @@ class ShaperCalibrate:
                 logger("To avoid too much smoothing with '%s', suggested "
                        "max_accel <= %.0f mm/sec^2" % (
                            shaper.name, round(shaper.max_accel / 100.) * 100.))
-            all_shapers.append(shaper)
             if (best_shaper is None or shaper.score * 1.2 < best_shaper.score or
                     (shaper.score * 1.05 < best_shaper.score and
                         shaper.smoothing * 1.1 < best_shaper.smoothing)):
@@ -439,6 +513,11 @@ class ShaperCalibrate:
                 best_shaper = shaper
         return best_shaper, all_shapers
 
+    def find_best_shaper(self, calibration_data, max_smoothing, logger=None):
+        all_shapers = self.background_process_exec(self.fit_shapers, (
+            calibration_data, max_smoothing))
+        return self.select_best_shaper(all_shapers, logger)
+
     def save_params(self, configfile, axis, shaper_name, shaper_freq):
         if axis == 'xy':
             self.save_params(configfile, 'x', shaper_name, shaper_freq)
@@ -3,7 +3,7 @@
 # Copyright (C) 2018-2021  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import os, time, logging
+import os, time, json, struct, logging
 
 class PrinterSysStats:
     def __init__(self, config):
@@ -49,25 +49,258 @@ class PrinterSysStats:
                 'cputime': self.total_process_time,
                 'memavail': self.last_mem_avail}
 
+class StatsGroup:
+    """Numeric statistics of one printer object
+
+    Counters and gauges are declared once with add_counter() and
+    add_gauge().  The owner's update callback stores new values into the
+    `values` dict in place, and the log line, get_status() snapshots and
+    the "stats/dump" webhook are all rendered from it."""
+    def __init__(self, name, update_cb=None, log_prefix=None):
+        self.name = name
+        self.update_cb = update_cb
+        self.log_prefix = log_prefix
+        self.fields = []
+        self.kinds = {}
+        self.values = {}
+        self.last_values = {}
+        self.log_format = None
+    def _add_field(self, field, kind, fmt, value):
+        if field not in self.kinds:
+            self.fields.append((field, fmt))
+        self.kinds[field] = kind
+        self.values[field] = value
+        self.log_format = None
+    def add_counter(self, field, fmt="%d"):
+        self._add_field(field, "counter", fmt, 0)
+    def add_gauge(self, field, fmt="%.3f"):
+        self._add_field(field, "gauge", fmt, 0.)
+    def update(self, eventtime):
+        if self.update_cb is not None:
+            self.update_cb(eventtime, self.values)
+        # Callers may hold on to the snapshot (eg, in get_status())
+        self.last_values = dict(self.values)
+        return self.last_values
+    def render(self):
+        if self.log_format is None:
+            parts = ["%s=%s" % (field, fmt) for field, fmt in self.fields]
+            if self.log_prefix:
+                parts.insert(0, self.log_prefix + ":")
+            self.log_format = ' '.join(parts)
+        values = self.last_values
+        return self.log_format % tuple([values[field]
+                                        for field, fmt in self.fields])
+
+STATS_FILE_MAGIC = b"KSTATS2\n"
+STATS_SECTION_HEADER = struct.Struct('<IQ')
+STATS_SECTION_OPEN = 0xffffffffffffffff
+
+class StatsFile:
+    """Binary columnar copy of the periodic statistics
+
+    The file is a series of sections.  Each section starts with
+    STATS_FILE_MAGIC, a little-endian uint32 header length, a uint64 row
+    count (STATS_SECTION_OPEN for the section being written) and a JSON
+    header listing the columns (padded so that the data starts on an 8
+    byte boundary).  Each sample is then appended as one row of
+    little-endian doubles, with NaN for missing values, so every section
+    can be memory-mapped as a 2D array (see scripts/graphstats.py).
+    When a sample has a value that is not in the current columns (eg,
+    sd_pos once a print starts) the section is closed and a new one with
+    the additional columns is started.  A file that can not be parsed is
+    renamed to "<filename>.old"."""
+    def __init__(self, filename):
+        self.filename = filename
+        self.columns = None
+        self.column_set = set()
+        self.row_struct = None
+        self.section_start = self.data_start = None
+        self.file = None
+    def _read_sections(self, f):
+        # Return (start, data start, columns, rows) of each section
+        sections = []
+        size = f.seek(0, os.SEEK_END)
+        pos = 0
+        hsize = len(STATS_FILE_MAGIC) + STATS_SECTION_HEADER.size
+        while pos < size:
+            f.seek(pos)
+            data = f.read(hsize)
+            if (len(data) != hsize
+                or data[:len(STATS_FILE_MAGIC)] != STATS_FILE_MAGIC):
+                raise ValueError("Invalid stats file section")
+            hlen, rows = STATS_SECTION_HEADER.unpack_from(
+                data, len(STATS_FILE_MAGIC))
+            columns = json.loads(f.read(hlen).decode())['columns']
+            if not columns:
+                raise ValueError("Invalid stats file section")
+            data_start = pos + hsize + hlen
+            row_size = 8 * len(columns)
+            if rows == STATS_SECTION_OPEN:
+                # The last section (may end with a partial row)
+                rows = (size - data_start) // row_size
+                sections.append((pos, data_start, columns, rows))
+                break
+            sections.append((pos, data_start, columns, rows))
+            pos = data_start + rows * row_size
+        return sections
+    def _start_section(self, columns):
+        header = json.dumps({'version': 2, 'columns': columns}).encode()
+        hlen = len(STATS_FILE_MAGIC) + STATS_SECTION_HEADER.size + len(header)
+        header += b' ' * (-hlen % 8)
+        self.section_start = self.file.seek(0, os.SEEK_END)
+        self.file.write(STATS_FILE_MAGIC + STATS_SECTION_HEADER.pack(
+            len(header), STATS_SECTION_OPEN) + header)
+        self.data_start = self.file.tell()
+        self._set_columns(columns)
+    def _finish_section(self):
+        # Store the row count so that a new section can follow
+        rows = ((self.file.seek(0, os.SEEK_END) - self.data_start)
+                // self.row_struct.size)
+        self.file.seek(self.section_start + len(STATS_FILE_MAGIC) + 4)
+        self.file.write(struct.pack('<Q', rows))
+        self.file.seek(self.data_start + rows * self.row_struct.size)
+        self.file.truncate()
+    def _set_columns(self, columns):
+        self.columns = columns
+        self.column_set = set(columns)
+        self.row_struct = struct.Struct('<%dd' % (len(columns),))
+    def _open(self):
+        try:
+            self.file = open(self.filename, 'r+b')
+        except (IOError, OSError):
+            self.file = open(self.filename, 'w+b')
+        try:
+            sections = self._read_sections(self.file)
+        except (ValueError, UnicodeDecodeError, KeyError):
+            self.file.close()
+            os.rename(self.filename, self.filename + ".old")
+            self.file = open(self.filename, 'w+b')
+            sections = []
+        if not sections:
+            self._set_columns([])
+            return
+        # Continue the last section (dropping any partial row left by an
+        # interrupted write)
+        self.section_start, self.data_start, columns, rows = sections[-1]
+        self._set_columns(columns)
+        self.file.seek(self.data_start + rows * self.row_struct.size)
+        self.file.truncate()
+    def write(self, row):
+        if self.file is None:
+            self._open()
+        new_columns = [name for name in row if name not in self.column_set]
+        if new_columns:
+            if self.section_start is not None:
+                self._finish_section()
+            self._start_section(self.columns + new_columns)
+        nan = float('nan')
+        self.file.write(self.row_struct.pack(
+            *[row.get(name, nan) for name in self.columns]))
+        self.file.flush()
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.section_start = self.data_start = None
+
+def parse_stats_text(text, row):
+    # Add the "key=value" pairs of a stats() string to a stats file row
+    prefix = ""
+    for part in text.split():
+        if '=' not in part:
+            prefix = part
+            continue
+        name, val = part.split('=', 1)
+        try:
+            row[prefix + name] = float(val)
+        except ValueError:
+            pass
+
 class PrinterStats:
     def __init__(self, config):
         self.printer = config.get_printer()
         reactor = self.printer.get_reactor()
         self.stats_timer = reactor.register_timer(self.generate_stats)
         self.stats_cb = []
+        self.groups = {}
+        self.stats_file = None
+        filename = config.get('stats_file', None)
+        if filename is not None:
+            self.stats_file = StatsFile(os.path.expanduser(filename))
+            self.printer.register_event_handler("klippy:disconnect",
+                                                self._close_stats_file)
         self.printer.register_event_handler("klippy:ready", self.handle_ready)
+        webhooks = self.printer.lookup_object('webhooks')
+        webhooks.register_endpoint("stats/dump", self._handle_dump)
+    def add_group(self, name, update_cb=None, log_prefix=None):
+        # Register the statistics of printer object "name"
+        group = self.groups.get(name)
+        if group is None:
+            group = self.groups[name] = StatsGroup(name, update_cb,
+                                                   log_prefix)
+        return group
+    def _group_stats(self, group):
+        def stats(eventtime):
+            group.update(eventtime)
+            return False, group.render()
+        return stats
     def handle_ready(self):
-        self.stats_cb = [o.stats for n, o in self.printer.lookup_objects()
-                         if hasattr(o, 'stats')]
+        # Registered stats groups replace an object's stats() method (the
+        # log line keeps the printer object order)
+        self.stats_cb = []
+        for name, obj in self.printer.lookup_objects():
+            group = self.groups.get(name)
+            if group is not None:
+                self.stats_cb.append((self._group_stats(group), group))
+            elif hasattr(obj, 'stats'):
+                self.stats_cb.append((obj.stats, None))
         if self.printer.get_start_args().get('debugoutput') is None:
             reactor = self.printer.get_reactor()
             reactor.update_timer(self.stats_timer, reactor.NOW)
     def generate_stats(self, eventtime):
-        stats = [cb(eventtime) for cb in self.stats_cb]
-        if max([s[0] for s in stats]):
+        stats = [cb(eventtime) for cb, group in self.stats_cb]
+        is_active = max([s[0] for s in stats])
+        if is_active:
             logging.info("Stats %.1f: %s", eventtime,
                          ' '.join([s[1] for s in stats]))
+        if self.stats_file is not None:
+            self._write_stats_file(eventtime, is_active, stats)
         return eventtime + 3.
+    def _write_stats_file(self, eventtime, is_active, stats):
+        row = {'#sampletime': eventtime, '#walltime': time.time(),
+               '#active': float(is_active)}
+        for (cb, group), (active, text) in zip(self.stats_cb, stats):
+            if group is None:
+                parse_stats_text(text, row)
+                continue
+            prefix = "%s:" % (group.log_prefix,) if group.log_prefix else ""
+            for name, value in group.last_values.items():
+                row[prefix + name] = value
+        try:
+            self.stats_file.write(row)
+        except (IOError, OSError):
+            logging.exception("statistics: unable to write %s",
+                              self.stats_file.filename)
+            self._close_stats_file()
+    def _close_stats_file(self):
+        if self.stats_file is not None:
+            self.stats_file.close()
+            self.stats_file = None
+    def _handle_dump(self, web_request):
+        # The values from the last periodic update (or new values if the
+        # "update" parameter is set)
+        names = web_request.get('groups', None, types=(list,))
+        if names is None:
+            names = list(self.groups.keys())
+        groups = [self.groups[n] for n in names if n in self.groups]
+        eventtime = self.printer.get_reactor().monotonic()
+        if web_request.get('update', False, types=(bool,)):
+            for group in groups:
+                group.update(eventtime)
+        web_request.send({
+            'eventtime': eventtime,
+            'values': {g.name: g.last_values for g in groups},
+            'types': {g.name: dict(g.kinds) for g in groups}})
 
 def load_config(config):
     config.get_printer().add_object('system_stats', PrinterSysStats(config))
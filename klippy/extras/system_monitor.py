@@ -19,9 +19,23 @@
 
 import time
 import logging
-import json
-import os
+import itertools
 from collections import deque
+from . import metric_history, error_journal
+
+ERROR_HISTORY_SIZE = 500
+
+def _bisect_time(events, timestamp, after=False):
+    """Index of the first event at (or after) timestamp in sorted events"""
+    lo, hi = 0, len(events)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        event_time = events[mid]["timestamp"]
+        if event_time < timestamp or (after and event_time == timestamp):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
 
 class SystemMonitor:
     def __init__(self, config):
@@ -30,7 +44,8 @@ class SystemMonitor:
         self.gcode = self.printer.lookup_object('gcode')
 
         # Error and state history
-        self.error_history = deque(maxlen=500)
+        self.error_history = deque(maxlen=ERROR_HISTORY_SIZE)
+        self.error_index = {}  # severity -> deque of events in error_history
         self.state_history = deque(maxlen=100)
         self.last_status = {}
 
@@ -44,11 +59,31 @@ class SystemMonitor:
         self.cache_timestamp = 0
         self.cache_max_age = 2.0  # Use cached data if less than 2 seconds old
 
+        # Push subscriptions - one sample per update_interval for all clients
+        self.subscribers = {}
+        self.sample_timer = None
+        self.last_sample = None
+
         # Configuration
         self.update_interval = config.getfloat('update_interval', 0.5, above=0.1)
         self.persist_errors = config.getboolean('persist_errors', True)
         self.error_log_path = config.get('error_log_path',
                                          '/usr/data/printer_data/logs/system_errors.jsonl')
+        self.journal = None
+        if self.persist_errors:
+            self.journal = error_journal.ErrorJournal(
+                self.error_log_path,
+                config.getint('error_log_max_size', 1024*1024, minval=4096),
+                config.getint('error_log_backups', 3, minval=0))
+            for event in self.journal.load_recent(ERROR_HISTORY_SIZE):
+                self._add_history(event)
+
+        # Metric history - history_size samples every history_interval
+        self.history_interval = config.getfloat('history_interval', 5.,
+                                                minval=0.5)
+        self.history_size = config.getint('history_size', 7200, minval=10)
+        self.history = None
+        self.history_timer = None
 
         # Safe query mode - use cached data during sensitive operations
         self.safe_query_mode = config.getboolean('safe_query_mode', True)
@@ -74,6 +109,10 @@ class SystemMonitor:
                                    self._handle_log_error_request)
         webhooks.register_endpoint("system_monitor/clear_errors",
                                    self._handle_clear_errors_request)
+        webhooks.register_endpoint("system_monitor/subscribe",
+                                   self._handle_subscribe_request)
+        webhooks.register_endpoint("system_monitor/history",
+                                   self._handle_history_request)
 
         # Register G-code commands
         self.gcode.register_command("SYSTEM_STATUS", self.cmd_SYSTEM_STATUS,
@@ -90,6 +129,13 @@ class SystemMonitor:
         self.pause_resume = None
         self.toolhead = None
         self.gcode_move = None
+        self.heater_objs = []
+        self.fan_objs = []
+        self.filament_sensor = None
+        self.box = None
+        self.system_stats = None
+        self.mcu = None
+        self.virtual_sdcard = None
 
         # Critical operation tracking
         self.is_homing = False
@@ -104,6 +150,30 @@ class SystemMonitor:
         self.pause_resume = self.printer.lookup_object('pause_resume', None)
         self.toolhead = self.printer.lookup_object('toolhead', None)
         self.gcode_move = self.printer.lookup_object('gcode_move', None)
+        self.heater_objs = [
+            (name, self.printer.lookup_object(name, None))
+            for name in ['extruder', 'heater_bed', 'chamber_heater']]
+        self.heater_objs = [(n, o) for n, o in self.heater_objs if o]
+        self.fan_objs = [
+            (name, self.printer.lookup_object('output_pin ' + name, None))
+            for name in ['fan0', 'fan1', 'fan2']]
+        self.fan_objs = [(n, o) for n, o in self.fan_objs if o]
+        self.filament_sensor = self.printer.lookup_object(
+            'filament_switch_sensor filament_sensor', None)
+        self.box = self.printer.lookup_object('box', None)
+        self.system_stats = self.printer.lookup_object('system_stats', None)
+        self.mcu = self.printer.lookup_object('mcu', None)
+        self.virtual_sdcard = self.printer.lookup_object('virtual_sdcard',
+                                                         None)
+
+        # Fixed set of history metrics, allocated once
+        names = []
+        for heater_name, heater in self.heater_objs:
+            names.extend([heater_name + "_temp", heater_name + "_power"])
+        names.extend(["mcu_load", "sysload", "memavail", "print_progress"])
+        self.history = metric_history.MetricHistory(names, self.history_size)
+        self.history_timer = self.reactor.register_timer(
+            self._history_event, self.reactor.NOW)
 
         logging.info("SystemMonitor ready")
         self.log_event("INFO", "I000", "System monitor started")
@@ -115,6 +185,8 @@ class SystemMonitor:
     def _handle_disconnect(self):
         """Called on MCU disconnect"""
         self.log_event("ERROR", "E401", "MCU communication lost")
+        if self.journal is not None:
+            self.journal.stop()
 
     def _handle_homing_begin(self, homing_state):
         """Called when homing/probing begins - CRITICAL: avoid all queries"""
@@ -145,7 +217,7 @@ class SystemMonitor:
             "state": self._get_current_state()
         }
 
-        self.error_history.append(event)
+        self._add_history(event)
 
         # Log to console
         log_func = {
@@ -157,20 +229,22 @@ class SystemMonitor:
 
         log_func("[%s] %s: %s" % (code, severity, message))
 
-        # Persist to file
-        if self.persist_errors and severity in ["ERROR", "CRITICAL"]:
-            self._persist_error(event)
+        # Persist to file (written by the journal's background thread)
+        if self.journal is not None and severity in ["ERROR", "CRITICAL"]:
+            self.journal.log(event)
 
         return event
 
-    def _persist_error(self, event):
-        """Write error to log file (JSONL format)"""
-        try:
-            os.makedirs(os.path.dirname(self.error_log_path), exist_ok=True)
-            with open(self.error_log_path, 'a') as f:
-                f.write(json.dumps(event) + '\n')
-        except Exception as e:
-            logging.error("Failed to persist error: %s" % str(e))
+    def _add_history(self, event):
+        """Append to error_history and keep the per-severity index in step"""
+        if len(self.error_history) == self.error_history.maxlen:
+            evicted = self.error_history[0]
+            self.error_index[evicted["severity"]].popleft()
+        self.error_history.append(event)
+        severity = event.get("severity")
+        if severity not in self.error_index:
+            self.error_index[severity] = deque()
+        self.error_index[severity].append(event)
 
     # Status Aggregation
 
@@ -276,29 +350,95 @@ class SystemMonitor:
                 }
         else:
             # Safe to query - update cache
-            status = {
-                "timestamp": eventtime,
-                "state": self._get_state_status(eventtime),
-                "motion": self._get_motion_status(eventtime),
-                "thermal": self._get_thermal_status(eventtime),
-                "sensors": self._get_sensor_status(eventtime),
-                "cfs": self._get_cfs_status(eventtime),
-                "resources": self._get_resource_status(eventtime),
-                "cached": False
-            }
-
-            # Update cache
-            self.cached_state = status["state"]
-            self.cached_motion = status["motion"]
-            self.cached_thermal = status["thermal"]
-            self.cached_sensors = status["sensors"]
-            self.cached_cfs = status["cfs"]
-            self.cached_resources = status["resources"]
-            self.cache_timestamp = eventtime
+            status = dict(self._take_sample(eventtime))
+            status["timestamp"] = eventtime
+            status["cached"] = False
 
         self.last_status = status
         return status
 
+    def _take_sample(self, eventtime):
+        """Query every section once and refresh the cache"""
+        sample = {
+            "state": self._get_state_status(eventtime),
+            "motion": self._get_motion_status(eventtime),
+            "thermal": self._get_thermal_status(eventtime),
+            "sensors": self._get_sensor_status(eventtime),
+            "cfs": self._get_cfs_status(eventtime),
+            "resources": self._get_resource_status(eventtime)
+        }
+
+        # Update cache
+        self.cached_state = sample["state"]
+        self.cached_motion = sample["motion"]
+        self.cached_thermal = sample["thermal"]
+        self.cached_sensors = sample["sensors"]
+        self.cached_cfs = sample["cfs"]
+        self.cached_resources = sample["resources"]
+        self.cache_timestamp = eventtime
+        return sample
+
+    def _sample_event(self, eventtime):
+        """Timer: sample once and push changed fields to all subscribers"""
+        for cconn in list(self.subscribers.keys()):
+            if cconn.is_closed():
+                del self.subscribers[cconn]
+        if not self.subscribers:
+            # Unregister timer if there are no longer any subscriptions
+            self.reactor.unregister_timer(self.sample_timer)
+            self.sample_timer = None
+            return self.reactor.NEVER
+
+        # CRITICAL: never query during homing/probing - wait for next interval
+        if self.is_homing or self.is_probing:
+            return eventtime + self.update_interval
+
+        last_sample = self.last_sample or {}
+        sample = self.last_sample = self._take_sample(eventtime)
+
+        # Only send fields that changed since the previous sample
+        changes = {}
+        for section, values in sample.items():
+            last_values = last_sample.get(section, {})
+            cres = {}
+            for key, value in values.items():
+                if value != last_values.get(key):
+                    cres[key] = value
+            if cres:
+                changes[section] = cres
+        if changes:
+            for cconn, template in self.subscribers.items():
+                tmp = dict(template)
+                tmp['params'] = {'eventtime': eventtime, 'status': changes}
+                cconn.send(tmp)
+        return eventtime + self.update_interval
+
+    def _history_event(self, eventtime):
+        """Timer: append one sample of every numeric metric"""
+        # CRITICAL: never query during homing/probing - leave a gap instead
+        if self.is_homing or self.is_probing:
+            return eventtime + self.history_interval
+        values = {}
+        for heater_name, heater in self.heater_objs:
+            try:
+                h_status = heater.get_status(eventtime)
+                values[heater_name + "_temp"] = h_status["temperature"]
+                values[heater_name + "_power"] = h_status["power"]
+            except Exception as e:
+                logging.debug("History heater %s failed: %s" % (heater_name, str(e)))
+        if self.mcu:
+            last_stats = self.mcu.get_status(eventtime).get("last_stats", {})
+            if "mcu_awake" in last_stats:
+                values["mcu_load"] = last_stats["mcu_awake"]
+        if self.system_stats:
+            stats = self.system_stats.get_status(eventtime)
+            values["sysload"] = stats.get("sysload", 0.)
+            values["memavail"] = stats.get("memavail", 0)
+        if self.virtual_sdcard:
+            values["print_progress"] = self.virtual_sdcard.progress()
+        self.history.append(eventtime, values)
+        return eventtime + self.history_interval
+
     def _get_state_status(self, eventtime):
         """Get printer state"""
         state = {
@@ -376,27 +516,17 @@ class SystemMonitor:
         """Get thermal system status (non-blocking)"""
         thermal = {}
 
-        # Get all heaters - wrapped for safety
-        try:
-            heaters = self.printer.lookup_object('heaters', None)
-            if heaters:
-                for heater_name in ['extruder', 'heater_bed', 'chamber_heater']:
-                    try:
-                        heater = self.printer.lookup_object(heater_name, None)
-                        if heater:
-                            h_status = heater.get_status(eventtime)
-                            thermal[heater_name] = {
-                                "current": round(h_status.get("temperature", 0), 1),
-                                "target": round(h_status.get("target", 0), 1),
-                                "power": round(h_status.get("power", 0) * 100, 1)
-                            }
-                    except Exception as e:
-                        logging.debug("Failed to query heater %s: %s" % (heater_name, str(e)))
-        except Exception as e:
-            # Failed to query heaters - use cached if available
-            if self.cached_thermal:
-                return self.cached_thermal
-            logging.debug("Thermal status query failed: %s" % str(e))
+        # Heaters resolved at ready - wrapped for safety
+        for heater_name, heater in self.heater_objs:
+            try:
+                h_status = heater.get_status(eventtime)
+                thermal[heater_name] = {
+                    "current": round(h_status.get("temperature", 0), 1),
+                    "target": round(h_status.get("target", 0), 1),
+                    "power": round(h_status.get("power", 0) * 100, 1)
+                }
+            except Exception as e:
+                logging.debug("Failed to query heater %s: %s" % (heater_name, str(e)))
 
         return thermal
 
@@ -406,7 +536,7 @@ class SystemMonitor:
 
         # Filament sensor
         try:
-            filament = self.printer.lookup_object('filament_switch_sensor filament_sensor', None)
+            filament = self.filament_sensor
             if filament:
                 f_status = filament.get_status(eventtime)
                 sensors["filament_sensor"] = {
@@ -422,14 +552,12 @@ class SystemMonitor:
 
         # Fans - wrap each query individually
         sensors["fans"] = {}
-        for fan_name in ['fan0', 'fan1', 'fan2']:
+        for fan_name, fan in self.fan_objs:
             try:
-                fan = self.printer.lookup_object('output_pin ' + fan_name, None)
-                if fan:
-                    f_status = fan.get_status(eventtime)
-                    sensors["fans"][fan_name] = {
-                        "speed": int(f_status.get("value", 0) * 255)
-                    }
+                f_status = fan.get_status(eventtime)
+                sensors["fans"][fan_name] = {
+                    "speed": int(f_status.get("value", 0) * 255)
+                }
             except Exception as e:
                 logging.debug("Fan %s query failed: %s" % (fan_name, str(e)))
 
@@ -445,7 +573,7 @@ class SystemMonitor:
         }
 
         try:
-            box = self.printer.lookup_object('box', None)
+            box = self.box
             if box:
                 box_status = box.get_status(eventtime)
                 cfs["connected"] = True
@@ -468,7 +596,7 @@ class SystemMonitor:
 
         # System stats - can be slow
         try:
-            system_stats = self.printer.lookup_object('system_stats', None)
+            system_stats = self.system_stats
             if system_stats:
                 stats = system_stats.get_status(eventtime)
                 resources["cpu_usage"] = round(stats.get("cputime", 0), 1)
@@ -478,7 +606,7 @@ class SystemMonitor:
 
         # MCU stats - critical not to interfere
         try:
-            mcu = self.printer.lookup_object('mcu', None)
+            mcu = self.mcu
             if mcu:
                 mcu_stats = mcu.get_status(eventtime)
                 resources["mcu_load"] = round(mcu_stats.get("mcu_awake", 0) * 100, 1)
@@ -496,20 +624,62 @@ class SystemMonitor:
         web_request.send(status)
         return status
 
+    def _handle_subscribe_request(self, web_request):
+        """API endpoint: Subscribe to pushed status changes"""
+        cconn = web_request.get_client_connection()
+        template = web_request.get_dict('response_template', {})
+        eventtime = self.reactor.monotonic()
+        if self.last_sample is None or (
+                self.sample_timer is None
+                and not (self.is_homing or self.is_probing)):
+            self.last_sample = self._take_sample(eventtime)
+        web_request.send({'eventtime': eventtime,
+                          'status': self.last_sample})
+        self.subscribers[cconn] = template
+        if self.sample_timer is None:
+            self.sample_timer = self.reactor.register_timer(
+                self._sample_event, eventtime + self.update_interval)
+
+    def _handle_history_request(self, web_request):
+        """API endpoint: Downsampled metric history (min/max/mean)"""
+        if self.history is None:
+            raise web_request.error("System monitor not ready")
+        eventtime = self.reactor.monotonic()
+        end = web_request.get('end', eventtime, types=(int, float))
+        start = web_request.get('start', None, types=(int, float))
+        if start is None:
+            duration = web_request.get('duration', None, types=(int, float))
+            start = 0. if duration is None else end - duration
+        points = web_request.get_int('points', 300)
+        metrics = web_request.get('metrics', None, types=(list,))
+        result = self.history.query(start, end, points, metrics)
+        result['eventtime'] = eventtime
+        result['interval'] = self.history_interval
+        web_request.send(result)
+        return result
+
     def _handle_errors_request(self, web_request):
         """API endpoint: Get error history"""
-        params = web_request.get_args()
-        limit = int(params.get('limit', 50))
-        offset = int(params.get('offset', 0))
-        severity = params.get('severity', None)
+        limit = web_request.get_int('limit', 50)
+        offset = web_request.get_int('offset', 0)
+        severity = web_request.get('severity', None)
+        since = web_request.get('since', None, types=(int, float))
+        until = web_request.get('until', None, types=(int, float))
 
-        # Filter errors
-        errors = list(self.error_history)
+        # Select from the index - no copy of the whole history
         if severity:
-            errors = [e for e in errors if e['severity'] == severity]
+            events = self.error_index.get(severity, ())
+        else:
+            events = self.error_history
+        start, end = 0, len(events)
+        if since is not None:
+            start = _bisect_time(events, since)
+        if until is not None:
+            end = max(start, _bisect_time(events, until, after=True))
 
-        total = len(errors)
-        errors = errors[offset:offset + limit]
+        total = end - start
+        errors = list(itertools.islice(events, start + offset,
+                                       min(end, start + offset + limit)))
 
         result = {
             "errors": errors,
@@ -535,6 +705,7 @@ class SystemMonitor:
     def _handle_clear_errors_request(self, web_request):
         """API endpoint: Clear error history"""
         self.error_history.clear()
+        self.error_index.clear()
         logging.info("Error history cleared")
         web_request.send({"success": True})
 
@@ -612,7 +783,10 @@ class SystemMonitor:
         return {
             "error_count": len(self.error_history),
             "last_error": self.error_history[-1] if self.error_history else None,
-            "current_state": self._get_current_state()
+            "current_state": self._get_current_state(),
+            "subscribers": len(self.subscribers),
+            "history": self.history.get_status(eventtime) if self.history else {},
+            "journal": self.journal.get_status(eventtime) if self.journal else {}
         }
 
 def load_config(config):
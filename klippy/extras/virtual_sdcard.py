@@ -6,6 +6,7 @@
 import os, logging, io, json, time, re, threading
 from .tool import reportInformation
 from .base_info import base_dir, system_info_instance
+from . import gcode_stream, metadata_cache, resume_index
 
 VALID_GCODE_EXTS = ['gcode', 'g', 'gco']
 LAYER_KEYS = ["; layer #", ";LAYER:", "; layer:", "; LAYER:", ";AFTER_LAYER_CHANGE", ";LAYER_CHANGE"]
@@ -79,6 +80,9 @@ class VirtualSD:
         sd = config.get('path')
         self.offset_value = config.getfloat('offset_value', 0) # ϵƫƲֵ
         self.forced_leveling = config.getboolean('forced_leveling',  default=False)
+        self.stream_mode = config.getboolean('stream_mode', False)
+        self.line_classifier = gcode_stream.LineClassifier(LAYER_KEYS)
+        self.stream_stats = gcode_stream.StreamStats()
         self.sdcard_dirname = os.path.normpath(os.path.expanduser(sd))
         self.current_file = None
         self.file_position = self.file_size = 0
@@ -115,12 +119,16 @@ class VirtualSD:
         self.do_resume_status = False
         self.eepromWriteCount = 1
         self.fan_state = {}
+        self.active_tool = ""
+        self.resume_index = resume_index.ResumeIndex(LAYER_KEYS)
         self.gcode_layer_path = os.path.join(base_dir, "creality/userdata/config/gcode_layer.json")
         self.user_print_refer_path = os.path.join(base_dir, "creality/userdata/config/user_print_refer.json")
         self.print_file_name_path = os.path.join(base_dir, "creality/userdata/config/print_file_name.json")
         self.speed_mode_path = os.path.join(base_dir, "creality/userdata/config/speed_mode.json")
         self.flow_rate_path = os.path.join(base_dir, "creality/userdata/config/flow_rate.json")
         self.maintenance_item_path = os.path.join(base_dir, "creality/userdata/config/maintenance_item.json")
+        self.metadata_cache = metadata_cache.MetadataCache(
+            os.path.join(base_dir, "creality/userdata/config/gcode_metadata_cache.json"))
         self.print_first_layer = False
         self.first_layer_stop = False
         self.count_M204 = 0
@@ -421,7 +429,7 @@ class VirtualSD:
                 logging.exception("virtual_sdcard get_file_list")
                 raise self.gcode.error("Unable to get file list")
     def get_status(self, eventtime):
-        return {
+        status = {
             'file_path': self.file_path(),
             'progress': self.progress(),
             'is_active': self.is_active(),
@@ -433,6 +441,9 @@ class VirtualSD:
             'run_dis': self.run_dis,
             'bed_mesh_calibate_state': self.bed_mesh_calibate_state
         }
+        if self.stream_mode:
+            status['stream'] = self.stream_stats.get_status(eventtime)
+        return status
     def file_path(self):
         if self.current_file:
             return self.current_file.name
@@ -475,12 +486,24 @@ class VirtualSD:
         self.is_cancel = False
         self.file_position = self.file_size = 0.
 
+    def clear_resume_index(self):
+        file_path = None
+        if self.current_file is not None:
+            file_path = self.current_file.name
+        elif os.path.exists(self.print_file_name_path):
+            try:
+                with open(self.print_file_name_path, "r") as f:
+                    file_path = json.loads(f.read()).get("file_path")
+            except Exception as err:
+                logging.error("clear_resume_index err:%s" % err)
+        self.resume_index.clear(file_path)
+
     def cmd_CLEAR_EEPROM_INFO(self, gcmd):
         from subprocess import call
+        self.clear_resume_index()
         if os.path.exists(self.print_file_name_path):
             os.remove(self.print_file_name_path)
-        if os.path.exists(self.gcode.exclude_object_info):
-            os.remove(self.gcode.exclude_object_info)
+        self.gcode.clear_exclude_object_info()
         call("sync", shell=True)
         try:
             power_loss_switch = False
@@ -545,6 +568,9 @@ class VirtualSD:
         if filename[0] == '/':
             filename = filename[1:]
         self._load_file(gcmd, filename, check_subdirs=True)
+        if not self.is_continue_print:
+            self.active_tool = ""
+            self.clear_resume_index()
         self.load_gcode_metadata(str(self.current_file.name))
         self.record_print_history(str(self.current_file.name))
         self.do_resume()
@@ -641,9 +667,8 @@ class VirtualSD:
                 bl24c16f = self.printer.lookup_object('bl24c16f') if "bl24c16f" in self.printer.objects and power_loss_switch else None
                 if power_loss_switch and bl24c16f:
                     os.remove(self.print_file_name_path)
-                    if os.path.exists(self.gcode.exclude_object_info):
-                        os.remove(self.gcode.exclude_object_info)
-                    self.gcode.run_script_from_command("EEPROM_WRITE_BYTE ADDR=1 VAL=255")
+                    self.gcode.clear_exclude_object_info()
+                    bl24c16f.setEepromDisable()
                     logging.info("rm power_loss info success")
             except Exception as err:
                 logging.error("rm power_loss info fail, err:%s" % err)
@@ -666,6 +691,7 @@ class VirtualSD:
         if filename.startswith('/'):
             filename = filename[1:]
         self._load_file(gcmd, filename)
+        self.load_gcode_metadata(str(self.current_file.name))
     def _load_file(self, gcmd, filename, check_subdirs=False):
         files = self.get_file_list(check_subdirs)
         flist = [f[0] for f in files]
@@ -675,7 +701,10 @@ class VirtualSD:
             if fname not in flist:
                 fname = files_by_lower[fname.lower()]
             fname = os.path.join(self.sdcard_dirname, fname)
-            f = io.open(fname, 'r', newline='')
+            if self.stream_mode:
+                f = io.open(fname, 'rb')
+            else:
+                f = io.open(fname, 'r', newline='')
             f.seek(0, os.SEEK_END)
             fsize = f.tell()
             f.seek(0)
@@ -762,6 +791,17 @@ class VirtualSD:
         return result
 
     def getXYZET(self, file_path, file_position):
+        try:
+            state = self.resume_index.lookup(
+                file_path, file_position,
+                pause=lambda: self.reactor.pause(self.reactor.NOW))
+        except Exception as err:
+            logging.exception("power_loss resume_index lookup: %s" % err)
+            state = None
+        if state is not None:
+            result = state.get_xyzet()
+            logging.info("power_loss get XYZET from resume index:%s" % str(result))
+            return result
         # TnõֵĻ ֤Ƕɫļ ҪTֵ˳ѭ
         Tn = self.check_Tn(file_path)
         result = {"X": 0, "Y": 0, "Z": 0, "E": 0, "T": ""}
@@ -837,15 +877,12 @@ class VirtualSD:
         bed = 50
         extruder = 202.0
         chamber_heater = 0
-        if os.path.exists(self.gcode.last_temperature_info):
+        result = self.gcode.get_temperature_info()
+        if result:
             try:
-                with open(self.gcode.last_temperature_info, "r") as f:
-                    result = f.read()
-                    if len(result) > 0:
-                        result = json.loads(result)
-                        bed = float(result.get("bed", 0))
-                        extruder = float(result.get("extruder", 201.0))
-                        chamber_heater = float(result.get("chamber_heater", 0))
+                bed = float(result.get("bed", 0))
+                extruder = float(result.get("extruder", 201.0))
+                chamber_heater = float(result.get("chamber_heater", 0))
             except Exception as err:
                 logging.error("get_print_temperature: %s" % err)
         logging.info("power_loss get_print_temperature: bed:%s, extruder:%s, chamber_heater:%s" % (bed, extruder, chamber_heater))
@@ -874,18 +911,10 @@ class VirtualSD:
         return layer
 
     def get_print_file_metadata(self, filename, filepath=""):
-        from subprocess import check_output
         if not filepath:
             filepath = os.path.join(base_dir, "printer_data/gcodes")
-        result = {}
-        python_env = "/usr/share/klippy-env/bin/python3"
-        # -f gcode filename  -p gcode file dir
-        cmd = "%s /usr/share/klipper/klippy/extras/metadata.py -f '%s' -p %s" % (python_env, filename, filepath)
-        try:
-            result = json.loads(check_output(cmd, shell=True).decode("utf-8"))
-        except Exception as err:
-            logging.error(err)
-        return result
+        # Parsed once per (path, size, mtime) and shared by all callers
+        return self.metadata_cache.get(os.path.join(filepath, filename))
     
     def get_file_layer_count(self, filename, metadata_info=None):
         filename = filename.split("/")[-1]
@@ -894,7 +923,7 @@ class VirtualSD:
         if metadata_info:
             result = metadata_info
         else:
-            result = self.get_print_file_metadata(filename, get_layer_count=True)
+            result = self.get_print_file_metadata(filename)
         if not result:
             return layer_count
         try:
@@ -990,8 +1019,7 @@ class VirtualSD:
                 else:
                     # clear power_loss info
                     os.remove(self.print_file_name_path)
-                    if os.path.exists(self.gcode.exclude_object_info):
-                        os.remove(self.gcode.exclude_object_info)
+                    self.gcode.clear_exclude_object_info()
                     if power_loss_switch and bl24c16f:
                         bl24c16f.setEepromDisable()
         if power_loss_switch and self.is_continue_print and not self.do_resume_status and sameFileName and bl24c16f:
@@ -1003,9 +1031,7 @@ class VirtualSD:
                         self.is_continue_print = False
                         logging.info("power_loss start do_resume...")
                         logging.info("power_loss start print, filename:%s" % self.current_file.name)
-                        pos = bl24c16f.eepromReadHeader()
-                        logging.info("power_loss pos:%s" % pos)
-                        print_info = bl24c16f.eepromReadBody(pos)
+                        print_info = bl24c16f.checkpoint_read()
                         logging.info("power_loss print_info:%s" % str(print_info))
                         self.file_position = int(print_info.get("file_position", 0))
                         logging.info("power_loss file_position:%s" % self.file_position)
@@ -1016,14 +1042,14 @@ class VirtualSD:
                         gcode.run_script_from_command("M109 S%s" % temperature[1])
                         gcode.run_script_from_command("M141 S%s" % temperature[2]) if temperature[2] > 0 else None
                         XYZET = self.getXYZET(self.current_file.name, self.file_position)
+                        self.active_tool = XYZET.get("T", "")
                         logging.info("power_loss XYZET:%s, file_position:%s  " % (str(XYZET), self.file_position))
                         if XYZET.get("Z") == 0:
                             logging.error("power_loss gcode Z == 0 err")
                             from subprocess import call
                             if os.path.exists(self.print_file_name_path):
                                 os.remove(self.print_file_name_path)
-                            if os.path.exists(self.gcode.exclude_object_info):
-                                os.remove(self.gcode.exclude_object_info)
+                            self.gcode.clear_exclude_object_info()
                             call("sync", shell=True)
                             try:
                                 power_loss_switch = False
@@ -1075,29 +1101,10 @@ class VirtualSD:
                 self.last_layer = self.layer
                 start_time = end_time
                 base_position_e = round(list(gcode_move.base_position)[-1], 2)
-                pos = bl24c16f.eepromReadHeader()
-                if eepromState:
-                    # eeprom first enable
-                    self.gcode.run_script("EEPROM_WRITE_BYTE ADDR=1 VAL=1")
-                    self.gcode.run_script("EEPROM_WRITE_INT ADDR=%s VAL=%s" % (pos*8, int(self.file_position)))
-                    self.gcode.run_script("EEPROM_WRITE_FLOAT ADDR=%s VAL=%s" % (pos*8+4, base_position_e))
-                    self.gcode.run_script("EEPROM_WRITE_BYTE ADDR=0 VAL=%d" % pos)
-                    eepromState = False
-                else:
-                    # pos = bl24c16f.eepromReadHeader()
-                    if self.eepromWriteCount < 256:
-                        self.gcode.run_script("EEPROM_WRITE_INT ADDR=%s VAL=%s" % (pos*8, int(self.file_position)))
-                        self.gcode.run_script("EEPROM_WRITE_FLOAT ADDR=%s VAL=%s" % (pos*8+4, base_position_e))
-                    else:
-                        self.eepromWriteCount = 1
-                        pos += 1
-                        if pos == 256:
-                            pos = 1
-                        self.gcode.run_script("EEPROM_WRITE_INT ADDR=%s VAL=%s" % (pos*8, int(self.file_position)))
-                        self.gcode.run_script("EEPROM_WRITE_FLOAT ADDR=%s VAL=%s" % (pos*8+4, base_position_e))
-                        self.gcode.run_script("EEPROM_WRITE_BYTE ADDR=0 VAL=%d" % pos)
-                    # logging.info("eepromWriteCount:%d, pos:%d" % (self.eepromWriteCount, pos))
+                # One packed record, written from the bl24c16f reactor timer
+                bl24c16f.checkpoint_write(self.file_position, base_position_e)
                 self.eepromWriteCount += 1
+                self.record_resume_checkpoint(gcode_move)
         except Exception as err:
             logging.error("EEPROM_WRITE ERROR:%s" % str(err))
         
@@ -1109,6 +1116,17 @@ class VirtualSD:
             gcode_move.recordPrintFileName(self.print_file_name_path, self.current_file.name, fan_state=self.fan_state, filament_used=self.print_stats.filament_used, last_print_duration=self.print_stats.print_duration)
         return start_time, end_time, interval_start_time, interval_end_time
 
+    def record_resume_checkpoint(self, gcode_move):
+        state = resume_index.ResumeState()
+        state.position = gcode_move._get_gcode_position()
+        state.speed = gcode_move._get_gcode_speed()
+        state.tool = self.active_tool
+        state.fan_state = dict(self.fan_state)
+        state.layer = self.layer
+        state.absolute_coord = gcode_move.absolute_coord
+        state.absolute_extrude = gcode_move.absolute_extrude
+        self.resume_index.record(self.current_file.name, self.file_position, state)
+
     def judge_line_starts_with(self, line, power_loss_switch, bl24c16f):
         if not power_loss_switch:
             return line
@@ -1122,16 +1140,20 @@ class VirtualSD:
                 self.fan_state["M106 P1"] = M106_line
             elif M106_line.startswith("M106 P2"):
                 self.fan_state["M106 P2"] = M106_line
+        elif line.startswith("T"):
+            m = resume_index.TOOL_RE.match(line)
+            if m is not None:
+                self.active_tool = "T%s" % (m.group(1),)
         elif line.startswith("END_PRINT"):
             self.end_print_state = True
+            self.clear_resume_index()
             if self.print_id and os.path.exists("/tmp/camera_main"):
                 reportInformation("key608", data={"print_id": self.print_id})
             if os.path.exists(self.print_file_name_path):
                 os.remove(self.print_file_name_path)
-            if os.path.exists(self.gcode.exclude_object_info):
-                os.remove(self.gcode.exclude_object_info)
+            self.gcode.clear_exclude_object_info()
             if power_loss_switch and bl24c16f:
-                self.gcode.run_script("EEPROM_WRITE_BYTE ADDR=1 VAL=255")
+                bl24c16f.setEepromDisable()
         elif line.startswith("M600"):
             line = "PAUSE"
         return line
@@ -1173,6 +1195,25 @@ class VirtualSD:
             capture(end_print=True, frame=frame)
             self.reactor.pause(self.reactor.monotonic() + 1.2)
 
+    def stream_line_hooks(self, line, line_class, power_loss_switch, bl24c16f,
+                          toolhead, delay_photography_switch, frame):
+        # Stream mode: only lines classified as relevant reach the hooks
+        hook_name = gcode_stream.HOOK_NAMES.get(line_class)
+        if hook_name is None:
+            return line
+        start = time.perf_counter()
+        if line_class == gcode_stream.LINE_LAYER:
+            self.record_layer_info(line, power_loss_switch)
+            self.first_floor_pause(line, toolhead)
+            if self.slow_print == True and self.layer > 0 and self.slow_count < self.layer:
+                self.resume_print_speed()
+        else:
+            line = self.judge_line_starts_with(line, power_loss_switch, bl24c16f)
+            if line_class == gcode_stream.LINE_END_PRINT:
+                self.check_end_print(line, power_loss_switch, delay_photography_switch, frame)
+        self.stream_stats.note_hook(hook_name, start)
+        return line
+
     # Background work timer
     def work_handler(self, eventtime):
         logging.info("work_handler start print, filename:%s" % self.current_file.name)
@@ -1203,7 +1244,12 @@ class VirtualSD:
             return self.reactor.NEVER
         self.print_stats.note_start()
         gcode_mutex = self.gcode.get_mutex()
-        partial_input = ""
+        stream_mode = self.stream_mode
+        empty_input = b"" if stream_mode else ""
+        newline = b"\n" if stream_mode else "\n"
+        if stream_mode:
+            self.stream_stats.reset(self.reactor.monotonic())
+        partial_input = empty_input
         lines = []
         error_message = None
         # жǷȴƽ
@@ -1243,16 +1289,16 @@ class VirtualSD:
                     break
                 if not data:
                     # End of file
+                    self.clear_resume_index()
                     self.current_file.close()
                     self.current_file = None
                     logging.info("Finished SD card print")
                     self.gcode.respond_raw("Done printing file")
                     if os.path.exists(self.print_file_name_path):
                         os.remove(self.print_file_name_path)
-                    if os.path.exists(self.gcode.exclude_object_info):
-                        os.remove(self.gcode.exclude_object_info)
+                    self.gcode.clear_exclude_object_info()
                     if power_loss_switch and bl24c16f:
-                        self.gcode.run_script("EEPROM_WRITE_BYTE ADDR=1 VAL=255")
+                        bl24c16f.setEepromDisable()
                     self.first_layer_stop = False
                     self.print_first_layer = False
                     self.count_M204 = 0
@@ -1267,7 +1313,7 @@ class VirtualSD:
                     self.cur_print_data = {}
                     self.print_id = ""
                     break
-                lines = data.split('\n')
+                lines = data.split(newline)
                 lines[0] = partial_input + lines[0]
                 partial_input = lines.pop()
                 lines.reverse()
@@ -1280,8 +1326,22 @@ class VirtualSD:
             # Dispatch command
             self.cmd_from_sd = True
             line = lines.pop()
-            # next_file_position = self.file_position + len(line) + 1
-            next_file_position = self.file_position + len(line.encode('utf-8')) + 1
+            if stream_mode:
+                # Byte offsets come straight from the raw line length
+                next_file_position = self.file_position + len(line) + 1
+                self.stream_stats.note_line(len(line) + 1)
+                line_class = self.line_classifier.classify(line)
+                try:
+                    line = line.decode('utf-8')
+                except UnicodeDecodeError as err:
+                    logging.exception(err)
+                    err_msg = '{"code": "key571", "msg": "File UnicodeDecodeError"}'
+                    self.gcode._respond_error(err_msg)
+                    self.gcode.run_script("CANCEL_PRINT")
+                    break
+            else:
+                # next_file_position = self.file_position + len(line) + 1
+                next_file_position = self.file_position + len(line.encode('utf-8')) + 1
             self.next_file_position = next_file_position
             end_time = interval_end_time = self.reactor.monotonic()
             # µǰӡϢ,Ѵӡʱ䡢ʣʱ, ϵ򿪹ؿ²Žж
@@ -1291,17 +1351,21 @@ class VirtualSD:
                 # ¼ϵϢ, ϵ򿪹ؿ²Žж
                 start_time, end_time, interval_start_time, interval_end_time = self.record_power_loss_info(power_loss_switch, bl24c16f,eepromState, 
                                                                                                            gcode_move, start_time, end_time, interval_start_time, interval_end_time)
-                # жline ǷΪM106END_PRINTһЩ
-                line = self.judge_line_starts_with(line, power_loss_switch, bl24c16f)
-                # жline ¼Ϣ
-                self.record_layer_info(line, power_loss_switch)
-                # ײͣӡ
-                self.first_floor_pause(line, toolhead)
-                # ϵٴӡָٶ
-                if self.slow_print == True and self.layer > 0 and self.slow_count < self.layer:
-                    self.resume_print_speed()
-                # ڶEND_PRINTʱ жǷҪ
-                self.check_end_print(line, power_loss_switch, delay_photography_switch, frame)
+                if stream_mode:
+                    line = self.stream_line_hooks(line, line_class, power_loss_switch, bl24c16f,
+                                                  toolhead, delay_photography_switch, frame)
+                else:
+                    # жline ǷΪM106END_PRINTһЩ
+                    line = self.judge_line_starts_with(line, power_loss_switch, bl24c16f)
+                    # жline ¼Ϣ
+                    self.record_layer_info(line, power_loss_switch)
+                    # ײͣӡ
+                    self.first_floor_pause(line, toolhead)
+                    # ϵٴӡָٶ
+                    if self.slow_print == True and self.layer > 0 and self.slow_count < self.layer:
+                        self.resume_print_speed()
+                    # ڶEND_PRINTʱ жǷҪ
+                    self.check_end_print(line, power_loss_switch, delay_photography_switch, frame)
                 if self.is_move_out_of_range_in_printing and pause_resume.pause_start == False:
                     self.is_move_out_of_range_in_printing = False
                     self.gcode.run_script_from_command("PAUSE")
@@ -1339,7 +1403,7 @@ class VirtualSD:
                     self.work_timer = None
                     return self.reactor.NEVER
                 lines = []
-                partial_input = ""
+                partial_input = empty_input
         logging.info("Exiting SD card print (position %d)", self.file_position)
         self.count_line = 0
         self.count_G1 = 0
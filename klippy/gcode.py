@@ -3,12 +3,11 @@
 # Copyright (C) 2016-2021  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import os, re, logging, collections, shlex
+import os, re, logging, collections, shlex, functools
 import time
 from extras.tool import reportInformation
 from extras.base_info import base_dir
-import cProfile
-import pstats
+from extras import recovery_state
 class CommandError(Exception):
     pass
 
@@ -120,6 +119,23 @@ class GCodeDispatch:
             self.register_command(cmd, func, True, desc)
         self.last_temperature_info = os.path.join(base_dir, "creality/userdata/config/temperature_info.json")
         self.exclude_object_info = os.path.join(base_dir, "creality/userdata/config/exclude_object_info.json")
+        reactor = printer.get_reactor()
+        self.temperature_state = recovery_state.TemperatureState(
+            reactor, self.last_temperature_info)
+        self.exclude_object_state = recovery_state.ExcludeObjectState(
+            reactor, self.exclude_object_info)
+        # Parsed (cmd, params) of recently seen command lines
+        self.parse_cache = collections.OrderedDict()
+        # Commands whose arguments are saved for power loss recovery
+        self.record_handlers = {
+            'M104': functools.partial(self.set_temperature, "extruder"),
+            'M109': functools.partial(self.set_temperature, "extruder"),
+            'M140': functools.partial(self.set_temperature, "bed"),
+            'M190': functools.partial(self.set_temperature, "bed"),
+            'M141': functools.partial(self.set_temperature, "chamber_heater"),
+            'EXCLUDE_OBJECT_DEFINE': self.record_exclude_object_info,
+            'EXCLUDE_OBJECT': self.record_exclude_object_info,
+        }
     def is_traditional_gcode(self, cmd):
         # A "traditional" g-code command is a letter and followed by a number
         try:
@@ -168,12 +184,14 @@ class GCodeDispatch:
     def register_output_handler(self, cb):
         self.output_callbacks.append(cb)
     def _handle_shutdown(self):
+        self.flush_recovery_state()
         if not self.is_printer_ready:
             return
         self.is_printer_ready = False
         self.gcode_handlers = self.base_gcode_handlers
         self._respond_state("Shutdown")
     def _handle_disconnect(self):
+        self.flush_recovery_state()
         self._respond_state("Disconnect")
     def _handle_ready(self):
         self.is_printer_ready = True
@@ -192,6 +210,25 @@ class GCodeDispatch:
                 return param[:i], param[i:]
         return param, ''
     args_r = re.compile('([A-Z_]+|[A-Z*/])')
+    # Each word is split at its first digit or delimiter ("S200" ->
+    # "S", "200"; "ACCEL=500" -> "ACCEL", "=500")
+    param_r = re.compile(r'(?=\S)([^\s0-9=+\-.]*)(\S*)')
+    PARSE_CACHE_SIZE = 256
+    def parse_line(self, line):
+        # Returns (cmd, params) for a stripped, comment free command line
+        cache = self.parse_cache
+        res = cache.get(line)
+        if res is not None:
+            cache.move_to_end(line)
+            cmd, params = res
+            return cmd, dict(params)
+        words = self.param_r.findall(line.upper())
+        cmd = "".join(words[0])
+        params = dict(words)
+        cache[line] = (cmd, params)
+        if len(cache) > self.PARSE_CACHE_SIZE:
+            cache.popitem(last=False)
+        return cmd, dict(params)
     def _process_commands(self, commands, need_ack=True):
         for line in commands:
             
@@ -231,21 +268,7 @@ class GCodeDispatch:
                     elif cpos == 0:
                         continue
 
-                parts = line.upper().split()
-                # print(f"process_commands parts {parts}")
-                cmd = parts[0]
-                params = {}
-                for part in parts:
-                    isset=False
-                    for i, char in enumerate(part):
-                        if self.is_digit_or_delimiter(char):
-                            params[part[:i]] = part[i:]
-                            isset=True
-                            break
-                    if isset:
-                        continue
-                    params[part] = ''
-                # print(f"process_commands params {params},cmd {cmd}")
+                cmd, params = self.parse_line(line)
                 gcmd = GCodeCommand(self, cmd, origline, params, need_ack)
                 # Invoke handler for command
                 handler = self.gcode_handlers.get(cmd, self.cmd_default)
@@ -264,75 +287,32 @@ class GCodeDispatch:
                     if not need_ack:
                         raise
                 gcmd.ack()
-                if line.startswith("M104"):
-                    self.set_temperature("extruder", line)
-                elif line.startswith("M140"):
-                    self.set_temperature("bed", line)
-                elif line.startswith("M109"):
-                    self.set_temperature("extruder", line)
-                elif line.startswith("M190"):
-                    self.set_temperature("bed", line)
-                elif line.startswith("EXCLUDE_OBJECT_DEFINE") or line.startswith("EXCLUDE_OBJECT NAME"):
-                    self.record_exclude_object_info(line)
-                elif line.startswith("M141"):
-                    self.set_temperature("chamber_heater", line)
+                record = self.record_handlers.get(cmd)
+                if record is not None and line.startswith(cmd):
+                    record(line)
     def set_temperature(self, key, value):
-        import json
         try:
-            # configfile = self.printer.lookup_object('configfile')
-            # print_stats = self.printer.load_object(configfile, 'print_stats')
             temp_value = float(value.strip("\n").split("S")[-1])
-            # if key == "extruder" and print_stats and print_stats.state == "printing":
-            #     if temp_value >= 240:
-            #         self.run_script_from_command("M107 P1")
-            #         logging.info("Fan Off SET M107 P1")
-            #     elif temp_value >= 170:
-            #         self.run_script_from_command("M106 P1 S255")
-            #         logging.info("Fan On SET M106 P1 S255")
             if key == "extruder" and temp_value < 170:
                 return
-            if not os.path.exists(self.last_temperature_info):
-                from subprocess import call
-                call("touch %s" % self.last_temperature_info, shell=True)
-            with open(self.last_temperature_info, "r") as f:
-                ret = f.read()
-                if len(ret) > 0:
-                    ret = json.loads(ret)
-                else:
-                    ret = {}
-            ret[key] = temp_value
-            with open(self.last_temperature_info, "w") as f:
-                f.write(json.dumps(ret))
-                f.flush()
+            self.temperature_state.set_temperature(key, temp_value)
         except Exception as err:
             logging.error("set_temperature error: %s" % err)
     def record_exclude_object_info(self, line):
-        import json
-        try:
-            if not os.path.exists(self.exclude_object_info):
-                with open(self.exclude_object_info, "w") as f:
-                    data = {}
-                    data["EXCLUDE_OBJECT_DEFINE"] = []
-                    data["EXCLUDE_OBJECT"] = []
-                    f.write(json.dumps(data))
-                    f.flush()
-            with open(self.exclude_object_info, "r") as f:
-                ret = f.read()
-                if len(ret) > 0:
-                    ret = eval(ret)
-                else:
-                    ret = {}
-            if line.startswith("EXCLUDE_OBJECT_DEFINE"):
-                if line not in ret["EXCLUDE_OBJECT_DEFINE"]:
-                    ret["EXCLUDE_OBJECT_DEFINE"].append(line)
-            elif line.startswith("EXCLUDE_OBJECT NAME"):
-                if line not in ret["EXCLUDE_OBJECT"]:
-                    ret["EXCLUDE_OBJECT"].append(line)
-            with open(self.exclude_object_info, "w") as f:
-                f.write(json.dumps(ret))
-                f.flush()
-        except Exception as err:
-            logging.error("record_exclude_object_info error: %s" % err)
+        if line.startswith("EXCLUDE_OBJECT_DEFINE"):
+            self.exclude_object_state.add("EXCLUDE_OBJECT_DEFINE", line)
+        elif line.startswith("EXCLUDE_OBJECT NAME"):
+            self.exclude_object_state.add("EXCLUDE_OBJECT", line)
+    def get_temperature_info(self):
+        return dict(self.temperature_state.get())
+    def get_exclude_object_info(self):
+        return {key: list(lines) for key, lines
+                in self.exclude_object_state.get().items()}
+    def clear_exclude_object_info(self):
+        self.exclude_object_state.clear()
+    def flush_recovery_state(self):
+        self.temperature_state.flush()
+        self.exclude_object_state.flush()
     def run_script_from_command(self, script):
         self._process_commands(script.split('\n'), need_ack=False)
     def run_script(self, script):
@@ -550,8 +530,6 @@ class GCodeIO:
     def _process_data(self, eventtime):
         # Read input, separate by newline, and add to pending_commands
         # start_time = time.time()
-        profile = cProfile.Profile()
-        profile.enable()
         try:
             data = str(os.read(self.fd, 4096).decode())
         except (os.error, UnicodeDecodeError):
@@ -596,10 +574,6 @@ class GCodeIO:
         if self.fd_handle is None:
             self.fd_handle = self.reactor.register_fd(self.fd,
                                                       self._process_data)
-        profile.disable()
-        stats = pstats.Stats(profile)
-        stats.sort_stats('cumulative')
-        stats.print_stats(20)
     def _respond_raw(self, msg):
         if self.pipe_is_active:
             try:
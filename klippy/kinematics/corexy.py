@@ -23,8 +23,9 @@ class CoreXYKinematics:
         for s in self.get_steppers():
             s.set_trapq(toolhead.get_trapq())
             toolhead.register_step_generator(s.generate_steps)
-        config.get_printer().register_event_handler("stepper_enable:motor_off",
-                                                    self._motor_off)
+        self.printer = config.get_printer()
+        self.printer.register_event_handler("stepper_enable:motor_off",
+                                            self._motor_off)
         # Setup boundary checks
         max_velocity, max_accel = toolhead.get_max_velocity()
         self.__max_z_velocity = config.getfloat(
@@ -35,28 +36,28 @@ class CoreXYKinematics:
         ranges = [r.get_range() for r in self.rails]
         self.axes_min = toolhead.Coord(*[r[0] for r in ranges], e=0.)
         self.axes_max = toolhead.Coord(*[r[1] for r in ranges], e=0.)
+        self._set_kin_info()
+    def _set_kin_info(self):
         mymovie.Py_set_corexykin_info(self.limits[0][0], self.limits[0][1],
                                        self.limits[1][0], self.limits[1][1],
                                        self.limits[2][0], self.limits[2][1],
                                        self.__max_z_velocity, self.__max_z_accel)
+    def _note_limits(self):
+        # Axis limits (and thus homed state) changed
+        self._set_kin_info()
+        self.printer.send_event("kinematics:limits_changed")
     def get_max_z_velocity(self):
         return self.__max_z_velocity
     def set_max_z_velocity(self, max_velocity):
         self.__max_z_velocity = max_velocity
-        mymovie.Py_set_corexykin_info(self.limits[0][0], self.limits[0][1],
-                                       self.limits[1][0], self.limits[1][1],
-                                       self.limits[2][0], self.limits[2][1],
-                                       self.__max_z_velocity, self.__max_z_accel)
+        self._set_kin_info()
     def get_max_z_accel(self):
         return self.__max_z_accel
     def set_max_z_accel(self, max_accel):
         for frame in inspect.stack():
              print(frame.function)
         self.__max_z_accel = max_accel
-        mymovie.Py_set_corexykin_info(self.limits[0][0], self.limits[0][1],
-                                       self.limits[1][0], self.limits[1][1],
-                                       self.limits[2][0], self.limits[2][1],
-                                       self.__max_z_velocity, self.__max_z_accel)
+        self._set_kin_info()
     def get_steppers(self):
         return [s for rail in self.rails for s in rail.get_steppers()]
     def calc_position(self, stepper_positions):
@@ -64,48 +65,30 @@ class CoreXYKinematics:
         return [0.5 * (pos[0] + pos[1]), 0.5 * (pos[0] - pos[1]), pos[2]]
     def set_z_limit(self, min_z, max_z):
         self.limits[2] = (min_z, max_z)
-        mymovie.Py_set_corexykin_info(self.limits[0][0], self.limits[0][1],
-                                       self.limits[1][0], self.limits[1][1],
-                                       self.limits[2][0], self.limits[2][1],
-                                       self.__max_z_velocity, self.__max_z_accel)
+        self._note_limits()
     def set_limits(self, min_x, max_x, min_y, max_y):
         self.limits[0] = (min_x,max_x)
         self.limits[1] = (min_y,max_y)
-        mymovie.Py_set_corexykin_info(self.limits[0][0], self.limits[0][1],
-                                       self.limits[1][0], self.limits[1][1],
-                                       self.limits[2][0], self.limits[2][1],
-                                       self.__max_z_velocity, self.__max_z_accel)
+        self._note_limits()
     def restore_limits(self):
         for i, rail in enumerate(self.rails):
             if i==0 or i==1:
                 self.limits[i] = rail.get_range()
-        mymovie.Py_set_corexykin_info(self.limits[0][0], self.limits[0][1],
-                                       self.limits[1][0], self.limits[1][1],
-                                       self.limits[2][0], self.limits[2][1],
-                                       self.__max_z_velocity, self.__max_z_accel)
+        self._note_limits()
     def set_position(self, newpos, homing_axes):
         for i, rail in enumerate(self.rails):
             rail.set_position(newpos)
             if i in homing_axes:
                 self.limits[i] = rail.get_range()
-        mymovie.Py_set_corexykin_info(self.limits[0][0], self.limits[0][1],
-                                       self.limits[1][0], self.limits[1][1],
-                                       self.limits[2][0], self.limits[2][1],
-                                       self.__max_z_velocity, self.__max_z_accel)
+        self._note_limits()
     def note_z_not_homed(self):
         # Helper for Safe Z Home
         self.limits[2] = (1.0, -1.0)
-        mymovie.Py_set_corexykin_info(self.limits[0][0], self.limits[0][1],
-                                       self.limits[1][0], self.limits[1][1],
-                                       self.limits[2][0], self.limits[2][1],
-                                       self.__max_z_velocity, self.__max_z_accel)
+        self._note_limits()
     def note_xy_not_homed(self):
         self.limits[0] = (1.0, -1.0)
         self.limits[1] = (1.0, -1.0)
-        mymovie.Py_set_corexykin_info(self.limits[0][0], self.limits[0][1],
-                                       self.limits[1][0], self.limits[1][1],
-                                       self.limits[2][0], self.limits[2][1],
-                                       self.__max_z_velocity, self.__max_z_accel)
+        self._note_limits()
     def home_z_with_sensorless(self, homing_state, top):
         # Each axis is homed independently and in order
         # for axis in homing_state.get_axes():
@@ -150,10 +133,7 @@ class CoreXYKinematics:
             homing_state.home_rails([rail], forcepos, homepos)
     def _motor_off(self, print_time):
         self.limits = [(1.0, -1.0)] * 3
-        mymovie.Py_set_corexykin_info(self.limits[0][0], self.limits[0][1],
-                                       self.limits[1][0], self.limits[1][1],
-                                       self.limits[2][0], self.limits[2][1],
-                                       self.__max_z_velocity, self.__max_z_accel)
+        self._note_limits()
     def _check_endstops(self, move):
         end_pos = move.end_pos
         for i in (0, 1, 2):
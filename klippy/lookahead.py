@@ -0,0 +1,100 @@
+# Reference look-ahead planner using the chelper moveq code
+#
+# Copyright (C) 2025 K2 Unleashed Contributors
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import chelper
+
+# Return codes written to toolhead.double_array[13] (same as mymovie)
+MOVE_OK = 0
+MOVE_EXTRUDE_ONLY = 1
+MOVE_EMPTY = -1
+MOVE_NOT_HOMED = -2
+MOVE_OUT_OF_RANGE = -3
+MOVE_COLD_EXTRUDE = -4
+
+# Python view of the pending C move for the check_move() callbacks
+class ReferenceMove:
+    def __init__(self, printer, cmove):
+        self.printer = printer
+        self.cmove = cmove
+        self.start_pos = tuple(cmove.start_pos)
+        self.end_pos = tuple(cmove.end_pos)
+        self.axes_d = list(cmove.axes_d)
+        self.axes_r = list(cmove.axes_r)
+        self.move_d = cmove.move_d
+        self.is_kinematic_move = cmove.is_kinematic_move
+        self.min_move_t = cmove.min_move_t
+    def limit_speed(self, speed, accel):
+        ffi_main, ffi_lib = chelper.get_ffi()
+        ffi_lib.moveq_limit_speed(self.cmove, speed, accel)
+        self.min_move_t = self.cmove.min_move_t
+    def move_error(self, msg="Move out of range"):
+        ep = self.end_pos
+        m = "%s: %.3f %.3f %.3f [%.3f]" % (msg, ep[0], ep[1], ep[2], ep[3])
+        return self.printer.command_error(m)
+
+# Drop-in replacement for the mymovie planning calls used by toolhead.py
+class ReferencePlanner:
+    def __init__(self, toolhead, printer):
+        self.toolhead = toolhead
+        self.printer = printer
+        ffi_main, ffi_lib = chelper.get_ffi()
+        self.ffi_main = ffi_main
+        self.moveq = ffi_main.gc(ffi_lib.moveq_alloc(), ffi_lib.moveq_free)
+        self.moveq_prepare = ffi_lib.moveq_prepare
+        self.moveq_commit = ffi_lib.moveq_commit
+        self.moveq_flush = ffi_lib.moveq_flush
+        self.moveq_get_moves = ffi_lib.moveq_get_moves
+        self.moveq_del = ffi_lib.moveq_del
+    def Py_set_cur_move_addr(self, addr):
+        # Parameters are read directly from toolhead.double_array
+        pass
+    def Py_set_extruder_info(self, addr):
+        # Extruder limits are checked through toolhead.extruder
+        pass
+    def _extruder_corner_v(self):
+        extruder = self.toolhead.extruder
+        if hasattr(extruder, 'info_array'):
+            return float(extruder.info_array[6])
+        return -1.
+    def _check_move(self, move):
+        # Returns a mymovie style status code for the pending move
+        toolhead = self.toolhead
+        if not move.move_d:
+            return MOVE_EMPTY
+        if move.is_kinematic_move:
+            try:
+                toolhead.kin.check_move(move)
+            except self.printer.command_error as e:
+                if str(e).startswith("Must home axis first"):
+                    return MOVE_NOT_HOMED
+                return MOVE_OUT_OF_RANGE
+        if move.axes_d[3]:
+            heater = getattr(toolhead.extruder, 'heater', None)
+            if heater is not None and not heater.can_extrude:
+                return MOVE_COLD_EXTRUDE
+            toolhead.extruder.check_move(move)
+        if not move.is_kinematic_move:
+            return MOVE_EXTRUDE_ONLY
+        return MOVE_OK
+    def PyMove(self):
+        da = self.toolhead.double_array
+        cmove = self.moveq_prepare(
+            self.moveq, [da[4], da[5], da[6], da[7]],
+            [da[8], da[9], da[10], da[11]], da[12], da[1], da[0], da[3],
+            da[2])
+        move = ReferenceMove(self.printer, cmove)
+        da[13] = status = self._check_move(move)
+        if status >= 0:
+            if self.moveq_commit(self.moveq, self._extruder_corner_v()) < 0:
+                raise self.printer.command_error("Unable to queue move")
+        return move
+    def Py_move_queue_flush_cal(self, flush_count, lazy):
+        return self.moveq_flush(self.moveq, lazy)
+    def Py_get_moveq_only_data_buffer(self):
+        moves = self.moveq_get_moves(self.moveq,
+                                     len(self.toolhead.move_queue.queue))
+        return int(self.ffi_main.cast('uintptr_t', moves))
+    def Py_move_queue_del(self, count):
+        self.moveq_del(self.moveq, count)
@@ -567,6 +567,27 @@ class CommandWrapper:
         cmd = self._cmd.encode(data)
         self._serial.raw_send(cmd, minclock, reqclock, self._cmd_queue)
 
+# Sensors checked when an mcu reports "ADC out of range" (mcu0 is the
+# main board adc, noz0 the nozzle board adc).  Only configured sections
+# are checked; readings outside ADC_RANGE_LIMITS are reported with the
+# low or high error code, and each flag is cleared once all of its
+# sensors are within ADC_RANGE_RECOVER.
+ADC_RANGE_CHECKS = [
+    # (adc, flag, report, config section, label, low code, high code)
+    ('noz0', 'noz0', 'nozzle', 'extruder', 'extruder_temp',
+     'key509', 'key515'),
+    ('mcu0', 'bed0', 'bed', 'heater_bed', 'heater_bed_temp',
+     'key510', 'key516'),
+    ('mcu0', 'mcu0', 'mcu', 'temperature_sensor chamber_temp', 'chamber_temp',
+     'key511', 'key517'),
+    ('mcu0', 'mcu0', 'mcu', 'temperature_sensor mcu_temp', 'mcu_temp',
+     'key512', 'key518'),
+]
+ADC_RANGE_FLAGS = ('mcu0', 'noz0')
+ADC_RANGE_LIMITS = (0., 500.)
+ADC_RANGE_RECOVER = (-20., 500.)
+ADC_RANGE_RECHECK_TIME = 3.
+
 class MCU:
     error = error
     def __init__(self, config, clocksync):
@@ -626,6 +647,14 @@ class MCU:
         self._mcu_tick_avg = 0.
         self._mcu_tick_stddev = 0.
         self._mcu_tick_awake = 0.
+        pstats = printer.load_object(config, 'statistics_ext')
+        self._stats_group = pstats.add_group(config.get_name(),
+                                             self._update_stats, self._name)
+        self._stats_group.add_gauge('mcu_awake', "%.03f")
+        self._stats_group.add_gauge('mcu_task_avg', "%.06f")
+        self._stats_group.add_gauge('mcu_task_stddev', "%.06f")
+        self._serial.add_stats_fields(self._stats_group)
+        self._clocksync.add_stats_fields(self._stats_group)
         # Register handlers
         printer.register_event_handler("klippy:firmware_restart",
                                        self._firmware_restart)
@@ -635,74 +664,82 @@ class MCU:
         printer.register_event_handler("klippy:shutdown", self._shutdown)
         printer.register_event_handler("klippy:disconnect", self._disconnect)
         self.cur_code_key = ""
+        self._adc_checks = None
         if self._name == "mcu" or self._name == "nozzle_mcu":
-            self._do_query_timer = self._reactor.register_timer(self._do_query)
-            self._reactor.update_timer(self._do_query_timer, self._reactor.NOW)
-    def _do_query(self, eventtime):
+            self._adc_check_timer = self._reactor.register_timer(
+                self._check_adc_range)
+            self._serial.adc_out_of_range_cb = self._handle_adc_out_of_range
+            printer.register_event_handler("klippy:ready",
+                                           self._handle_adc_ready)
+    # ADC out of range reporting
+    def _resolve_adc_checks(self):
+        checks = []
+        for (adc, flag, report, section, label,
+             low_code, high_code) in ADC_RANGE_CHECKS:
+            obj = self._printer.lookup_object(section, None)
+            if obj is None:
+                continue
+            heater = getattr(obj, 'heater', None)
+            if heater is not None:
+                obj, attr = heater, 'smoothed_temp'
+            else:
+                attr = 'last_temp'
+            checks.append((adc, flag, report, obj, attr, label,
+                           low_code, high_code))
+        self._adc_checks = checks
+        return checks
+    def _handle_adc_ready(self):
+        self._resolve_adc_checks()
+        self._reactor.update_timer(
+            self._adc_check_timer,
+            self._reactor.monotonic() + ADC_RANGE_RECHECK_TIME)
+    def _handle_adc_out_of_range(self, eventtime):
+        # Called (via the reactor) when the mcu reports an ADC fault.  The
+        # faulty reading takes a while to reach the sensor temperatures,
+        # so delay the first check (otherwise the flag would be cleared
+        # before the fault is seen).  Repeated reports must not postpone a
+        # check that is already pending.
+        if self._adc_checks is not None:
+            waketime = min(self._adc_check_timer.waketime,
+                           eventtime + ADC_RANGE_RECHECK_TIME)
+            self._reactor.update_timer(self._adc_check_timer, waketime)
+    def _check_adc_range(self, eventtime):
+        info = self._serial.adc_out_of_range_info
+        min_temp, max_temp = ADC_RANGE_LIMITS
+        recover_min, recover_max = ADC_RANGE_RECOVER
+        reports = {}
+        recovered = dict.fromkeys(ADC_RANGE_FLAGS, True)
         try:
-            mcu_temp_obj = self._printer.lookup_object('temperature_sensor mcu_temp') if self._printer.objects.get('temperature_sensor mcu_temp') else None
-            chamber_temp_obj = self._printer.lookup_object('temperature_sensor chamber_temp') if self._printer.objects.get('temperature_sensor chamber_temp') else None
-            heater_bed_obj = self._printer.lookup_object('heater_bed') if self._printer.objects.get('heater_bed') else None
-            extruder_obj = self._printer.lookup_object('extruder') if self._printer.objects.get('extruder') else None
-            gcode = self._printer.lookup_object('gcode')
-            code_key_string = ""
-            msg = "adc out of range"
-            if self._serial.adc_out_of_range_info["mcu0"]:
-                if heater_bed_obj and heater_bed_obj.heater.smoothed_temp < 0:
-                    msg += " heater_bed_temp:%s" % round(heater_bed_obj.heater.smoothed_temp, 2)
-                    code_key_string = "key510"
-                elif heater_bed_obj and heater_bed_obj.heater.smoothed_temp > 500:
-                    msg += " heater_bed_temp:%s" % round(heater_bed_obj.heater.smoothed_temp, 2)
-                    code_key_string = "key516"
-                if code_key_string and not self._serial.adc_out_of_range_info["bed0_isReport"]:
-                    # self._serial.adc_out_of_range_info["bed0_isReport"] = True
+            for (adc, flag, report, obj, attr, label,
+                 low_code, high_code) in self._adc_checks:
+                temp = getattr(obj, attr)
+                ok = recover_min < temp < recover_max
+                recovered[flag] = recovered.get(flag, True) and ok
+                if not info[adc] or min_temp <= temp <= max_temp:
+                    continue
+                if flag not in reports:
+                    reports[flag] = [report, "", "adc out of range"]
+                r = reports[flag]
+                r[1] = low_code if temp < min_temp else high_code
+                r[2] += " %s:%s" % (label, round(temp, 2))
+            if reports:
+                gcode = self._printer.lookup_object('gcode')
+                for flag, (report, code_key_string, msg) in reports.items():
+                    if info[flag + "_isReport"]:
+                        continue
                     gcode.run_script("TURN_OFF_HEATERS")
-                    gcode._respond_error("""{"code": "%s", "msg":"bed %s", "values": []}""" % (code_key_string, self._name + " " + msg))
-                code_key_string = ""
-                if chamber_temp_obj and chamber_temp_obj.last_temp < 0:
-                    msg += " chamber_temp:%s" % round(chamber_temp_obj.last_temp, 2)
-                    code_key_string = "key511"
-                elif chamber_temp_obj and chamber_temp_obj.last_temp > 500:
-                    msg += " chamber_temp:%s" % round(chamber_temp_obj.last_temp, 2)
-                    code_key_string = "key517"
-                if mcu_temp_obj and mcu_temp_obj.last_temp < 0:
-                    msg += " mcu_temp:%s" % round(mcu_temp_obj.last_temp, 2)
-                    code_key_string = "key512"
-                elif mcu_temp_obj and mcu_temp_obj.last_temp > 500:
-                    msg += " mcu_temp:%s" % round(mcu_temp_obj.last_temp, 2)
-                    code_key_string = "key518"
-                if code_key_string and not self._serial.adc_out_of_range_info["mcu0_isReport"]:
-                    # self._serial.adc_out_of_range_info["mcu0_isReport"] = True
-                    gcode.run_script("TURN_OFF_HEATERS")
-                    gcode._respond_error("""{"code": "%s", "msg":"mcu %s", "values": []}""" % (code_key_string, self._name + " " + msg))
-                code_key_string = ""
-
-            if self._serial.adc_out_of_range_info["noz0"]:
-                if extruder_obj and extruder_obj.heater.smoothed_temp < 0:
-                    msg += " extruder_temp:%s" % round(extruder_obj.heater.smoothed_temp, 2)
-                    code_key_string = "key509"
-                elif extruder_obj and extruder_obj.heater.smoothed_temp > 500:
-                    msg += " extruder_temp:%s" % round(extruder_obj.heater.smoothed_temp, 2)
-                    code_key_string = "key515"
-                if code_key_string and not self._serial.adc_out_of_range_info["noz0_isReport"]:
-                    # self._serial.adc_out_of_range_info["noz0_isReport"] = True
-                    gcode.run_script("TURN_OFF_HEATERS")
-                    gcode._respond_error("""{"code": "%s", "msg":"nozzle %s", "values": []}""" % (code_key_string, self._name + " " + msg))
-                code_key_string = ""
-
-            if (chamber_temp_obj and -20 < chamber_temp_obj.last_temp < 500) and (mcu_temp_obj and -20 < mcu_temp_obj.last_temp < 500):
-                self._serial.adc_out_of_range_info["mcu0"] = False
-                self._serial.adc_out_of_range_info["mcu0_isReport"] = False
-            if extruder_obj and -20 < extruder_obj.heater.smoothed_temp < 500:
-                self._serial.adc_out_of_range_info["noz0"] = False
-                self._serial.adc_out_of_range_info["noz0_isReport"] = False
-            if heater_bed_obj and -20 < heater_bed_obj.heater.smoothed_temp < 500:
-                self._serial.adc_out_of_range_info["bed0"] = False
-                self._serial.adc_out_of_range_info["bed0_isReport"] = False
+                    gcode._respond_error(
+                        """{"code": "%s", "msg":"%s %s", "values": []}""" % (
+                            code_key_string, report, self._name + " " + msg))
+            for flag, ok in recovered.items():
+                if ok:
+                    info[flag] = info[flag + "_isReport"] = False
         except Exception as err:
             logging.error(err)
-        return eventtime + 3.0
-
+        # Keep checking until all reported sensors are back in range
+        if any(info[adc] for adc in ADC_RANGE_FLAGS):
+            return eventtime + ADC_RANGE_RECHECK_TIME
+        return self._reactor.NEVER
     # Serial callbacks
     def _handle_mcu_stats(self, params):
         count = params['count']
@@ -735,22 +772,15 @@ class MCU:
             code_key_string = "key91"
         elif msg == "ADC out of range":
             code_key_string = "key92"
-            mcu_temp_obj = self._printer.lookup_object('temperature_sensor mcu_temp') if self._printer.objects.get('temperature_sensor mcu_temp') else None
-            chamber_temp_obj = self._printer.lookup_object('temperature_sensor chamber_temp') if self._printer.objects.get('temperature_sensor chamber_temp') else None
-            heater_bed_obj = self._printer.lookup_object('heater_bed') if self._printer.objects.get('heater_bed') else None
-            extruder_obj = self._printer.lookup_object('extruder') if self._printer.objects.get('extruder') else None
-            if extruder_obj and extruder_obj.heater.smoothed_temp < 0:
-                msg += " extruder_temp:%s" % round(extruder_obj.heater.smoothed_temp, 2)
-                code_key_string = "key509"
-            if heater_bed_obj and heater_bed_obj.heater.smoothed_temp < 0:
-                msg += " heater_bed_temp:%s" % round(heater_bed_obj.heater.smoothed_temp, 2)
-                code_key_string = "key510"
-            if chamber_temp_obj and chamber_temp_obj.last_temp < 0:
-                msg += " chamber_temp:%s" % round(chamber_temp_obj.last_temp, 2)
-                code_key_string = "key511"
-            if mcu_temp_obj and mcu_temp_obj.last_temp < 0:
-                msg += " mcu_temp:%s" % round(mcu_temp_obj.last_temp, 2)
-                code_key_string = "key512"
+            checks = self._adc_checks
+            if checks is None:
+                checks = self._resolve_adc_checks()
+            for (adc, flag, report, obj, attr, label,
+                 low_code, high_code) in checks:
+                temp = getattr(obj, attr)
+                if temp < ADC_RANGE_LIMITS[0]:
+                    msg += " %s:%s" % (label, round(temp, 2))
+                    code_key_string = low_code
         elif msg == "Rescheduled timer in the past":
             code_key_string = "key93"
         elif msg == "Stepper too far in past":
@@ -1115,16 +1145,17 @@ class MCU:
         m = """{"code":"%s","msg":"Lost communication with MCU '%s'"}""" % (code_key, self._name)
         self._printer.invoke_shutdown(m)
     def get_status(self, eventtime=None):
-        return dict(self._get_status_info)
-    def stats(self, eventtime):
-        load = "mcu_awake=%.03f mcu_task_avg=%.06f mcu_task_stddev=%.06f" % (
-            self._mcu_tick_awake, self._mcu_tick_avg, self._mcu_tick_stddev)
-        stats = ' '.join([load, self._serial.stats(eventtime),
-                          self._clocksync.stats(eventtime)])
-        parts = [s.split('=', 1) for s in stats.split()]
-        last_stats = {k:(float(v) if '.' in v else int(v)) for k, v in parts}
-        self._get_status_info['last_stats'] = last_stats
-        return False, '%s: %s' % (self._name, stats)
+        status = dict(self._get_status_info)
+        if self._stats_group.last_values:
+            status['last_stats'] = self._stats_group.last_values
+        return status
+    def _update_stats(self, eventtime, values):
+        # Called by statistics_ext before the stats line is rendered
+        values['mcu_awake'] = self._mcu_tick_awake
+        values['mcu_task_avg'] = self._mcu_tick_avg
+        values['mcu_task_stddev'] = self._mcu_tick_stddev
+        self._serial.update_stats(values)
+        self._clocksync.update_stats(values)
 
 Common_MCU_errors = {
     ("Timer too close",): """
@@ -3,7 +3,8 @@
 # Copyright (C) 2016-2020  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import os, gc, select, math, time, logging, queue
+import os, sys, gc, select, math, time, logging, queue, bisect, threading
+import collections
 import greenlet
 import chelper, util
 import mymodule.mymovie as mymovie
@@ -14,6 +15,7 @@ class ReactorTimer:
     def __init__(self, callback, waketime):
         self.callback = callback
         self.waketime = waketime
+        self.name = None
 
 class ReactorCompletion:
     class sentinel: pass
@@ -54,6 +56,7 @@ class ReactorFileHandler:
         self.fd = fd
         self.read_callback = read_callback
         self.write_callback = write_callback
+        self.read_name = self.write_name = None
     def fileno(self):
         return self.fd
 
@@ -91,6 +94,164 @@ class ReactorMutex:
         self.next_pending = True
         self.reactor.update_timer(self.queue[0].timer, self.reactor.NOW)
 
+def _callback_name(callback):
+    owner = getattr(callback, '__self__', None)
+    if isinstance(owner, ReactorCallback):
+        # Report register_callback() users by their own callback
+        callback = owner.callback
+    func = getattr(callback, '__func__', callback)
+    module = getattr(func, '__module__', None)
+    name = getattr(func, '__qualname__', None)
+    if name is None:
+        return repr(callback)
+    if module is None:
+        return name
+    return "%s.%s" % (module, name)
+
+def _frame_name(frame):
+    return "%s:%s" % (os.path.basename(frame.f_code.co_filename),
+                      frame.f_code.co_name)
+
+# Upper bounds of the timer lateness histogram buckets (in seconds)
+LATE_BUCKETS = (.001, .005, .010, .050, .100, .500, 1.)
+SLOW_LOG_SIZE = 20
+STACK_DEPTH = 4
+
+class ReactorStats:
+    """Timer lateness, callback run time and gc pause bookkeeping
+
+    Enabled with SelectReactor.enable_stats() (see extras/reactor_stats.py).
+    A watchdog thread samples the main thread's stack when a callback has
+    been running for longer than slow_time, so the code that blocked the
+    reactor can be named even though the callback has not returned yet."""
+    def __init__(self, reactor, slow_time, watchdog):
+        self.reactor = reactor
+        self.monotonic = reactor.monotonic
+        self.slow_time = slow_time
+        self.main_ident = threading.get_ident()
+        self.current = None
+        self.gc_start = 0.
+        self.reset()
+        gc.callbacks.append(self._gc_callback)
+        self.watchdog_thread = None
+        self.watchdog_stop = threading.Event()
+        if watchdog:
+            self.watchdog_thread = threading.Thread(target=self._watchdog)
+            self.watchdog_thread.daemon = True
+            self.watchdog_thread.start()
+    def reset(self):
+        # name -> [count, total_time, max_time, max_late, late_histogram]
+        self.callbacks = {}
+        self.slow_events = collections.deque([], SLOW_LOG_SIZE)
+        self.gc_count = 0
+        self.gc_time = self.gc_max = 0.
+        self._reset_interval()
+    def _reset_interval(self):
+        self.interval_max_late = self.interval_max_time = 0.
+        self.interval_worst = None
+        self.interval_slow = 0
+    def close(self):
+        if self._gc_callback in gc.callbacks:
+            gc.callbacks.remove(self._gc_callback)
+        if self.watchdog_thread is not None:
+            self.watchdog_stop.set()
+            self.watchdog_thread.join()
+            self.watchdog_thread = None
+    # Callback timing
+    def run(self, name, callback, eventtime, waketime=_NOW):
+        start = self.monotonic()
+        cur = self.current = [name, start, None]
+        res = callback(eventtime)
+        if self.current is cur:
+            # Callback returned without pausing its greenlet
+            self.current = None
+            self._note(cur, self.monotonic() - start, waketime)
+        return res
+    def note_pause(self):
+        # The dispatch greenlet paused - account the time run so far to
+        # the current callback (its remainder is timed on resume)
+        cur = self.current
+        if cur is not None:
+            self.current = None
+            self._note(cur, self.monotonic() - cur[1], _NOW)
+    def _note(self, cur, run_time, waketime):
+        name, start, blocker = cur
+        info = self.callbacks.get(name)
+        if info is None:
+            info = self.callbacks[name] = [0, 0., 0., 0.,
+                                           [0] * (len(LATE_BUCKETS) + 1)]
+        info[0] += 1
+        info[1] += run_time
+        if run_time > info[2]:
+            info[2] = run_time
+        if run_time > self.interval_max_time:
+            self.interval_max_time = run_time
+            self.interval_worst = name
+        if waketime != _NOW:
+            late = start - waketime
+            info[4][bisect.bisect_left(LATE_BUCKETS, late)] += 1
+            if late > info[3]:
+                info[3] = late
+            if late > self.interval_max_late:
+                self.interval_max_late = late
+        if run_time >= self.slow_time:
+            self.interval_slow += 1
+            self.slow_events.append((start, name, run_time, blocker))
+    # Garbage collection
+    def _gc_callback(self, phase, info):
+        if phase == 'start':
+            self.gc_start = self.monotonic()
+            return
+        pause = self.monotonic() - self.gc_start
+        self.gc_count += 1
+        self.gc_time += pause
+        if pause > self.gc_max:
+            self.gc_max = pause
+    # Blocked reactor detection
+    def _watchdog(self):
+        interval = self.slow_time * .5
+        while not self.watchdog_stop.wait(interval):
+            cur = self.current
+            if (cur is None or cur[2] is not None
+                or self.monotonic() - cur[1] < self.slow_time):
+                continue
+            frame = sys._current_frames().get(self.main_ident)
+            names = []
+            while frame is not None and len(names) < STACK_DEPTH:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            del frame
+            cur[2] = " <- ".join(names)
+    # Reporting
+    def get_greenlet_count(self):
+        return len(self.reactor._all_greenlets)
+    def get_stats(self, top_count=10):
+        reactor = self.reactor
+        callbacks = sorted(self.callbacks.items(), key=lambda i: -i[1][2])
+        return {
+            'greenlets': len(reactor._all_greenlets),
+            'idle_greenlets': len(reactor._greenlets),
+            'timers': len(reactor._timers),
+            'gc': {'count': self.gc_count, 'total_time': self.gc_time,
+                   'max_time': self.gc_max},
+            'late_buckets': list(LATE_BUCKETS),
+            'callbacks': [
+                {'name': name, 'count': count, 'total_time': total,
+                 'max_time': max_time, 'max_late': max_late,
+                 'late_histogram': list(hist)}
+                for name, (count, total, max_time, max_late, hist)
+                in callbacks[:top_count]],
+            'slow_events': [
+                {'time': start, 'name': name, 'run_time': run_time,
+                 'blocked_in': blocker}
+                for start, name, run_time, blocker in self.slow_events]}
+    def get_interval_stats(self):
+        # Summary since the previous call (for the periodic stats line)
+        res = (self.interval_max_late, self.interval_max_time,
+               self.interval_worst, self.interval_slow)
+        self._reset_interval()
+        return res
+
 class SelectReactor:
     NOW = _NOW
     NEVER = _NEVER
@@ -115,8 +276,32 @@ class SelectReactor:
         self._g_dispatch = None
         self._greenlets = []
         self._all_greenlets = []
+        # Optional instrumentation (see enable_stats())
+        self._stats = None
     def get_gc_stats(self):
         return tuple(self._last_gc_times)
+    # Instrumentation
+    def enable_stats(self, slow_time=.050, watchdog=True):
+        if self._stats is None:
+            self._stats = ReactorStats(self, slow_time, watchdog)
+        return self._stats
+    def disable_stats(self):
+        if self._stats is not None:
+            self._stats.close()
+            self._stats = None
+    def _timer_name(self, t):
+        name = t.name
+        if name is None:
+            name = t.name = _callback_name(t.callback)
+        return name
+    def _fd_name(self, fd, is_write):
+        if is_write:
+            if fd.write_name is None:
+                fd.write_name = _callback_name(fd.write_callback)
+            return fd.write_name
+        if fd.read_name is None:
+            fd.read_name = _callback_name(fd.read_callback)
+        return fd.read_name
     # Timers
     def update_timer(self, timer_handler, waketime):
         timer_handler.waketime = waketime
@@ -154,11 +339,16 @@ class SelectReactor:
             return min(1., max(.001, self._next_timer - eventtime))
         self._next_timer = self.NEVER
         g_dispatch = self._g_dispatch
+        stats = self._stats
         for t in self._timers:
             waketime = t.waketime
             if eventtime >= waketime:
                 t.waketime = self.NEVER
-                t.waketime = waketime = t.callback(eventtime)
+                if stats is None:
+                    t.waketime = waketime = t.callback(eventtime)
+                else:
+                    t.waketime = waketime = stats.run(
+                        self._timer_name(t), t.callback, eventtime, waketime)
                 if g_dispatch is not self._g_dispatch:
                     self._next_timer = min(self._next_timer, waketime)
                     self._end_greenlet(g_dispatch)
@@ -223,6 +413,15 @@ class SelectReactor:
             self._all_greenlets.append(g_next)
         g_next.parent = g.parent
         g.timer = self.register_timer(g.switch, waketime)
+        if self._stats is not None:
+            self._stats.note_pause()
+            # Name the resume timer after the code that paused
+            frame = sys._getframe(1)
+            while frame is not None and frame.f_code.co_filename == __file__:
+                frame = frame.f_back
+            if frame is not None:
+                g.timer.name = "resume:" + _frame_name(frame)
+            del frame
         self._next_timer = self.NOW
         # Switch to _dispatch_loop (via _end_greenlet or direct)
         eventtime = g_next.switch()
@@ -271,16 +470,25 @@ class SelectReactor:
             busy = False
             res = select.select(self._read_fds, self.write_fds, [], timeout)
             eventtime = self.monotonic()
+            stats = self._stats
             for fd in res[0]:
                 busy = True
-                fd.read_callback(eventtime)
+                if stats is None:
+                    fd.read_callback(eventtime)
+                else:
+                    stats.run(self._fd_name(fd, False), fd.read_callback,
+                              eventtime)
                 if g_dispatch is not self._g_dispatch:
                     self._end_greenlet(g_dispatch)
                     eventtime = self.monotonic()
                     break
             for fd in res[1]:
                 busy = True
-                fd.write_callback(eventtime)
+                if stats is None:
+                    fd.write_callback(eventtime)
+                else:
+                    stats.run(self._fd_name(fd, True), fd.write_callback,
+                              eventtime)
                 if g_dispatch is not self._g_dispatch:
                     self._end_greenlet(g_dispatch)
                     eventtime = self.monotonic()
@@ -350,16 +558,27 @@ class PollReactor(SelectReactor):
             busy = False
             res = self._poll.poll(int(math.ceil(timeout * 1000.)))
             eventtime = self.monotonic()
+            stats = self._stats
             for fd, event in res:
                 busy = True
                 if event & (select.POLLIN | select.POLLHUP):
-                    self._fds[fd].read_callback(eventtime)
+                    if stats is None:
+                        self._fds[fd].read_callback(eventtime)
+                    else:
+                        handler = self._fds[fd]
+                        stats.run(self._fd_name(handler, False),
+                                  handler.read_callback, eventtime)
                     if g_dispatch is not self._g_dispatch:
                         self._end_greenlet(g_dispatch)
                         eventtime = self.monotonic()
                         break
                 if event & select.POLLOUT:
-                    self._fds[fd].write_callback(eventtime)
+                    if stats is None:
+                        self._fds[fd].write_callback(eventtime)
+                    else:
+                        handler = self._fds[fd]
+                        stats.run(self._fd_name(handler, True),
+                                  handler.write_callback, eventtime)
                     if g_dispatch is not self._g_dispatch:
                         self._end_greenlet(g_dispatch)
                         eventtime = self.monotonic()
@@ -401,16 +620,27 @@ class EPollReactor(SelectReactor):
             busy = False
             res = self._epoll.poll(timeout)
             eventtime = self.monotonic()
+            stats = self._stats
             for fd, event in res:
                 busy = True
                 if event & (select.EPOLLIN | select.EPOLLHUP):
-                    self._fds[fd].read_callback(eventtime)
+                    if stats is None:
+                        self._fds[fd].read_callback(eventtime)
+                    else:
+                        handler = self._fds[fd]
+                        stats.run(self._fd_name(handler, False),
+                                  handler.read_callback, eventtime)
                     if g_dispatch is not self._g_dispatch:
                         self._end_greenlet(g_dispatch)
                         eventtime = self.monotonic()
                         break
                 if event & select.EPOLLOUT:
-                    self._fds[fd].write_callback(eventtime)
+                    if stats is None:
+                        self._fds[fd].write_callback(eventtime)
+                    else:
+                        handler = self._fds[fd]
+                        stats.run(self._fd_name(handler, True),
+                                  handler.write_callback, eventtime)
                     if g_dispatch is not self._g_dispatch:
                         self._end_greenlet(g_dispatch)
                         eventtime = self.monotonic()
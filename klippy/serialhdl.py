@@ -23,6 +23,7 @@ class SerialReader:
         self.serialqueue = None
         self.default_cmd_queue = self.alloc_command_queue()
         self.stats_buf = self.ffi_main.new('char[4096]')
+        self.stats_values = self.ffi_main.new('struct serialqueue_stats *')
         # Threading
         self.lock = threading.Lock()
         self.background_thread = None
@@ -37,6 +38,7 @@ class SerialReader:
         self.finetuning_status = {}
         self.adc_out_of_range_info = {"mcu0": False, "mcu0_isReport": False, "noz0": False, "noz0_isReport": False,
                                       "bed0": False, "bed0_isReport": False}
+        self.adc_out_of_range_cb = None
     def _bg_thread(self):
         response = self.ffi_main.new('struct pull_queue_message *')
         try:
@@ -239,6 +241,27 @@ class SerialReader:
         self.ffi_lib.serialqueue_get_stats(self.serialqueue,
                                            self.stats_buf, len(self.stats_buf))
         return str(self.ffi_main.string(self.stats_buf).decode())
+    STATS_COUNTERS = ('bytes_write', 'bytes_read', 'bytes_retransmit',
+                      'bytes_invalid', 'send_seq', 'receive_seq',
+                      'retransmit_seq')
+    STATS_GAUGES = ('srtt', 'rttvar', 'rto')
+    STATS_BYTES = ('ready_bytes', 'stalled_bytes')
+    def add_stats_fields(self, group):
+        # Same fields (and log format) as stats()
+        for name in self.STATS_COUNTERS:
+            group.add_counter(name)
+        for name in self.STATS_GAUGES:
+            group.add_gauge(name)
+        # Queue levels (not totals)
+        for name in self.STATS_BYTES:
+            group.add_gauge(name, "%d")
+    def update_stats(self, values):
+        if self.serialqueue is None:
+            return
+        sv = self.stats_values
+        self.ffi_lib.serialqueue_get_stats_values(self.serialqueue, sv)
+        for name in self.STATS_COUNTERS + self.STATS_GAUGES + self.STATS_BYTES:
+            values[name] = getattr(sv, name)
     def get_reactor(self):
         return self.reactor
     def get_msgparser(self):
@@ -323,6 +346,9 @@ class SerialReader:
                     self.adc_out_of_range_info["mcu0"] = True
                 elif params.get("static_string_id", "")==("noz0 ADC out of range"):
                     self.adc_out_of_range_info["noz0"] = True
+                if self.adc_out_of_range_cb is not None:
+                    self.reactor.register_async_callback(
+                        self.adc_out_of_range_cb)
 # Class to send a query command and return the received response
 class SerialRetryCommand:
     def __init__(self, serial, name, oid=None):
@@ -4,7 +4,7 @@
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
 import math, logging, importlib, os, json
-import mcu, chelper, kinematics.extruder
+import mcu, chelper, kinematics.extruder, lookahead
 from extras.base_info import base_dir
 import time
 import inspect
@@ -20,6 +20,66 @@ import pstats
 # Class to track each move request
 
 LOOKAHEAD_FLUSH_TIME = 0.250
+HIST_BUCKETS = 16
+
+# Power-of-two histogram bucket (bucket i holds values in [2^(i-1), 2^i))
+def _hist_bucket(value):
+    return min(int(value).bit_length(), HIST_BUCKETS - 1)
+
+# Cheap always-on counters for the lookahead flush pipeline
+class FlushStats:
+    def __init__(self):
+        self.reset()
+    def reset(self):
+        self.flushes = self.junction_flushes = self.empty_flushes = 0
+        self.moves = 0
+        self.size_hist = [0] * HIST_BUCKETS
+        # Times in seconds; histograms are in microseconds
+        self.cal_time = self.cal_max = 0.
+        self.cal_hist = [0] * HIST_BUCKETS
+        self.process_time = self.process_max = 0.
+        self.process_hist = [0] * HIST_BUCKETS
+        self.stall_waits = 0
+        self.stall_time = 0.
+    def note_flush(self, count, lazy, cal_time, process_time):
+        self.flushes += 1
+        if lazy:
+            self.junction_flushes += 1
+        self.cal_time += cal_time
+        self.cal_hist[_hist_bucket(cal_time * 1000000.)] += 1
+        if cal_time > self.cal_max:
+            self.cal_max = cal_time
+        if not count:
+            self.empty_flushes += 1
+            return
+        self.moves += count
+        self.size_hist[_hist_bucket(count)] += 1
+        self.process_time += process_time
+        self.process_hist[_hist_bucket(process_time * 1000000.)] += 1
+        if process_time > self.process_max:
+            self.process_max = process_time
+    def note_stall(self, stall_time):
+        self.stall_waits += 1
+        self.stall_time += stall_time
+    def get_stats(self):
+        return ("flushes=%d junction_flushes=%d flush_moves=%d"
+                " flush_cal_time=%.3f flush_process_time=%.3f"
+                " stall_waits=%d" % (
+                    self.flushes, self.junction_flushes, self.moves,
+                    self.cal_time, self.process_time, self.stall_waits))
+    def get_status(self):
+        return {'flushes': self.flushes,
+                'junction_flushes': self.junction_flushes,
+                'empty_flushes': self.empty_flushes,
+                'moves': self.moves,
+                'size_hist': list(self.size_hist),
+                'cal_time': self.cal_time, 'cal_max': self.cal_max,
+                'cal_hist': list(self.cal_hist),
+                'process_time': self.process_time,
+                'process_max': self.process_max,
+                'process_hist': list(self.process_hist),
+                'stall_waits': self.stall_waits,
+                'stall_time': self.stall_time}
 
 # Class to track a list of pending move requests and to facilitate
 # "look-ahead" across moves to reduce acceleration between moves.
@@ -28,8 +88,9 @@ class MoveQueue:
         self.toolhead = toolhead
         self.queue = []
         self.junction_flush = LOOKAHEAD_FLUSH_TIME
+        self.stats = FlushStats()
     def reset(self):
-        mymovie.Py_move_queue_del(len(self.queue))
+        self.toolhead.planner.Py_move_queue_del(len(self.queue))
         del self.queue[:]
         self.junction_flush = LOOKAHEAD_FLUSH_TIME
     def set_flush_time(self, flush_time):
@@ -48,18 +109,19 @@ class MoveQueue:
         # if flush_count > 150:
         #     profile = cProfile.Profile()
         #     profile.enable()
-        starttime = time.time()
-        flush_count=mymovie.Py_move_queue_flush_cal(flush_count,lazy)
-        # print(f"flush_count:{flush_count} time:{time.time()-starttime}")
+        starttime = time.perf_counter()
+        flush_count=self.toolhead.planner.Py_move_queue_flush_cal(flush_count,lazy)
+        cal_endtime = time.perf_counter()
         # Generate step times for all moves ready to be flushed
+        process_time = 0.
         if flush_count:
-            # starttime = time.time()
             self.toolhead._process_moves(queue[:flush_count])
-            # print(f"_process_moves flush_count:{flush_count} time:{time.time()-starttime}")
+            process_time = time.perf_counter() - cal_endtime
             # Remove processed moves from the queue
-            mymovie.Py_move_queue_del(flush_count)
-            print(f"c++ flush:{flush_count} time:{time.time()-starttime}")
+            self.toolhead.planner.Py_move_queue_del(flush_count)
             del queue[:flush_count]
+        self.stats.note_flush(flush_count, lazy, cal_endtime - starttime,
+                              process_time)
         # if flush_count > 150:
         #     profile.disable()
         #     stats = pstats.Stats(profile)
@@ -86,6 +148,10 @@ SDS_CHECK_TIME = 0.001 # step+dir+step filter in stepcompress.c
 
 DRIP_SEGMENT_TIME = 0.050
 DRIP_TIME = 0.100
+
+# Planner status codes (double_array[13]) for moves that are not queued
+MOVE_REJECTED = (-1, -2, -3, -4, -5, -6)
+
 class DripModeEndSignal(Exception):
     pass
 
@@ -104,7 +170,14 @@ class ToolHead:
 
         self.double_array = np.array(self._double_array, dtype=np.float64)
         self.double_array_ptr_int = self.double_array.ctypes.data
-        mymovie.Py_set_cur_move_addr(self.double_array_ptr_int)
+        # Look-ahead planner: closed mymovie module or the chelper reference
+        self.planner = mymovie
+        planner = config.getchoice('lookahead_planner', {
+            'mymovie': 'mymovie', 'reference': 'reference'}, 'mymovie')
+        if planner == 'reference':
+            self.planner = lookahead.ReferencePlanner(self,
+                                                      config.get_printer())
+        self.planner.Py_set_cur_move_addr(self.double_array_ptr_int)
         self.config = config
         self.qmode_flag = 0
         self.printer = config.get_printer()
@@ -123,6 +196,10 @@ class ToolHead:
         self.double_array[7]=self.commanded_pos[3]
         self.printer.register_event_handler("klippy:shutdown",
                                             self._handle_shutdown)
+        self.printer.register_event_handler("klippy:connect",
+                                            self._handle_connect)
+        # Objects used when reporting rejected moves
+        self.print_stats = self.pause_resume = self.v_sd = None
         # Velocity and acceleration control
         self.__max_velocity = config.getfloat('max_velocity', above=0.)
         self.double_array[1]=self.__max_velocity
@@ -168,11 +245,11 @@ class ToolHead:
         self.trapq_append_from_moveq = ffi_lib.trapq_append_from_moveq
         self.step_generators = []
         # Create kinematics class
-        gcode = self.printer.lookup_object('gcode')
+        gcode = self.gcode = self.printer.lookup_object('gcode')
         self.Coord = gcode.Coord
         self.extruder = kinematics.extruder.DummyExtruder(self.printer)
         if hasattr(self.extruder, 'info_array_addr_int'):
-            mymovie.Py_set_extruder_info(self.extruder.info_array_addr_int)
+            self.planner.Py_set_extruder_info(self.extruder.info_array_addr_int)
         kin_name = config.get('kinematics')
         try:
             mod = importlib.import_module('kinematics.' + kin_name)
@@ -273,7 +350,7 @@ class ToolHead:
         # Queue moves into trapezoid motion queue (trapq)
         next_move_time = self.print_time
         # start=time.time()
-        return_value=self.trapq_append_from_moveq(self.trapq,self.extruder.trapq,next_move_time,mymovie.Py_get_moveq_only_data_buffer(),len(moves))
+        return_value=self.trapq_append_from_moveq(self.trapq,self.extruder.trapq,next_move_time,self.planner.Py_get_moveq_only_data_buffer(),len(moves))
         if return_value.extru_last_position < 109999999:
             self.extruder.last_position=return_value.extru_last_position
         # for move in moves:
@@ -343,6 +420,7 @@ class ToolHead:
             if not self.can_pause:
                 self.need_check_stall = self.reactor.NEVER
                 return
+            self.move_queue.stats.note_stall(min(1., stall_time))
             eventtime = self.reactor.pause(eventtime + min(1., stall_time))
         if not self.special_queuing_state:
             # In main state - defer stall checking until needed
@@ -406,14 +484,14 @@ class ToolHead:
             except Exception as err:
                 logging.error(err)
     def check_move_out_of_range(self, ep):
-        toolhead = self.printer.lookup_object('toolhead')
+        limits = self.kin.limits
         code_key = "key243"
-        min_x = toolhead.kin.limits[0][0]
-        max_x = toolhead.kin.limits[0][1]
-        min_y = toolhead.kin.limits[1][0]
-        max_y = toolhead.kin.limits[1][1]
-        min_z = toolhead.kin.limits[2][0]
-        max_z = toolhead.kin.limits[2][1]
+        min_x = limits[0][0]
+        max_x = limits[0][1]
+        min_y = limits[1][0]
+        max_y = limits[1][1]
+        min_z = limits[2][0]
+        max_z = limits[2][1]
         if min_x > ep[0] or ep[0] > max_x:
             code_key = "key585"
         elif min_y > ep[1] or ep[1] > max_y:
@@ -421,10 +499,41 @@ class ToolHead:
         elif min_z > ep[2] or ep[2] > max_z:
             code_key = "key587"
         msg="Move out of range"
-        logging.info("stepper xyz min_x:%s max_x:%s|min_y:%s max_y:%s|min_z:%s max_z:%s, toolhead.kin.limits:%s" % (min_x, max_x, min_y, max_y, min_z, max_z, str(toolhead.kin.limits)))
+        logging.info("stepper xyz min_x:%s max_x:%s|min_y:%s max_y:%s|min_z:%s max_z:%s, toolhead.kin.limits:%s" % (min_x, max_x, min_y, max_y, min_z, max_z, str(limits)))
         m = """{"code":"%s","msg":"%s: %.3f %.3f %.3f [%.3f]", "values":[%.3f, %.3f, %.3f, %.3f]}""" % (
             code_key, msg, ep[0], ep[1], ep[2], ep[3], ep[0], ep[1], ep[2], ep[3])
         return m
+    def _reject_move(self, status, newpos):
+        # Report a move rejected by the planner (double_array[13] < 0)
+        print_stats = self.print_stats
+        gcode = self.gcode
+        if status==-4:
+            m = """{"code":"key111", "msg": "Extrude below minimum temp, See the 'min_extrude_temp' config option for details", "values": []}"""
+            if print_stats.state == "printing" and self.extrude_below_min_temp_err_is_report==False:
+                gcode._respond_error(m)
+                self.extrude_below_min_temp_err_is_report = True
+                gcode.respond_info("state:%s pause_start:%s" % (print_stats.state, self.pause_resume.pause_start))
+                if print_stats.state == "printing" and self.pause_resume.pause_start == False:
+                    gcode.run_script_from_command("PAUSE")
+            elif print_stats.state == "standby":
+            # elif print_stats.state != "printing":
+                gcode._respond_error(m)
+            # raise self.printer.command_error("""{"code":"key111", "msg": "Extrude below minimum temp\nSee the 'min_extrude_temp' config option for details", "values": []}""")
+        elif status==-2:
+            raise self.printer.command_error("Must home axis first")
+        elif status==-3:
+            m = self.check_move_out_of_range(newpos)
+            if print_stats.state == "printing" and self.pause_resume.pause_start == False and self.v_sd.is_move_out_of_range_in_printing==False:
+                self.v_sd.is_move_out_of_range_in_printing=True
+                gcode._respond_error(m)
+            elif print_stats.state != "printing" and print_stats.state != "paused":
+                gcode._respond_error(m)
+            # raise self.printer.command_error(m)
+            # raise self.printer.command_error("Move out of range")
+        elif status==-5:
+            raise self.printer.command_error("Extrude only move too long")
+        elif status==-6:
+            raise self.printer.command_error("""{"code":"key112", "msg": "Move exceeds maximum extrusion (%.3fmm^2 vs %.3fmm^2)\nSee the 'max_extrude_cross_section' config option for details", "values": [%.3f, %.3f]}""")
     def simple_move(self, newpos):
         # print("get #################################################move: %s %s" % (newpos, speed))
         if newpos[2] < self.kin.limits[2][1]:
@@ -436,48 +545,17 @@ class ToolHead:
         # print(f"time cost of move: {time.time()-starttime}")
         
         # starttime=time.time()
-        move = mymovie.PyMove()
+        move = self.planner.PyMove()
         # print(f"time cost of PyMove: {time.time()-starttime}")
         
-        if self.double_array[13]==0:
+        status = self.double_array[13]
+        if status==0:
             self.commanded_pos[:] = newpos
-        elif self.double_array[13]==1:
+        elif status==1:
             self.commanded_pos[3] = newpos[3]
-        elif self.double_array[13]==-4:
-            print_stats = self.printer.lookup_object('print_stats')
-            gcode = self.printer.lookup_object('gcode')
-            m = """{"code":"key111", "msg": "Extrude below minimum temp, See the 'min_extrude_temp' config option for details", "values": []}"""
-            if print_stats.state == "printing" and self.extrude_below_min_temp_err_is_report==False:
-                gcode._respond_error(m)
-                self.extrude_below_min_temp_err_is_report = True
-                gcode.respond_info("state:%s pause_start:%s" % (self.printer.lookup_object('print_stats').state, self.printer.lookup_object('pause_resume').pause_start))
-                if self.printer.lookup_object('print_stats').state == "printing" and self.printer.lookup_object('pause_resume').pause_start == False:
-                    self.printer.lookup_object('gcode').run_script_from_command("PAUSE")
-            elif print_stats.state == "standby":
-            # elif print_stats.state != "printing":
-                gcode._respond_error(m)
-            return
-            # raise self.printer.command_error("""{"code":"key111", "msg": "Extrude below minimum temp\nSee the 'min_extrude_temp' config option for details", "values": []}""")
-        elif self.double_array[13]==-2:
-            raise self.printer.command_error("Must home axis first")
-        elif self.double_array[13]==-3:
-            m = self.check_move_out_of_range(newpos)
-            # self.printer.lookup_object('gcode')._respond_error(m)
-            print_stats = self.printer.lookup_object('print_stats')
-            if print_stats.state == "printing" and self.printer.lookup_object('pause_resume').pause_start == False and self.printer.lookup_object('virtual_sdcard').is_move_out_of_range_in_printing==False:
-                self.printer.lookup_object('virtual_sdcard').is_move_out_of_range_in_printing=True
-                self.printer.lookup_object('gcode')._respond_error(m)
-            elif print_stats.state != "printing" and print_stats.state != "paused":
-                self.printer.lookup_object('gcode')._respond_error(m)
-            return
-            # raise self.printer.command_error(m)
-            # raise self.printer.command_error("Move out of range")
-        elif self.double_array[13]==-1:
+        elif status in MOVE_REJECTED:
+            self._reject_move(status, newpos)
             return
-        elif self.double_array[13]==-5:
-            raise self.printer.command_error("Extrude only move too long")
-        elif self.double_array[13]==-6:
-            raise self.printer.command_error("""{"code":"key112", "msg": "Move exceeds maximum extrusion (%.3fmm^2 vs %.3fmm^2)\nSee the 'max_extrude_cross_section' config option for details", "values": [%.3f, %.3f]}""")
         # if not move.move_d:
         #     return
         # if move.is_kinematic_move:
@@ -508,48 +586,17 @@ class ToolHead:
         # print(f"time cost of move: {time.time()-starttime}")
         
         # starttime=time.time()
-        move = mymovie.PyMove()
+        move = self.planner.PyMove()
         # print(f"time cost of PyMove: {time.time()-starttime}")
         # print(f"return:{self.double_array[13]}")
-        if self.double_array[13]==0:
+        status = self.double_array[13]
+        if status==0:
             self.commanded_pos[:] = newpos
-        elif self.double_array[13]==1:
+        elif status==1:
             self.commanded_pos[3] = newpos[3]
-        elif self.double_array[13]==-4:
-            print_stats = self.printer.lookup_object('print_stats')
-            gcode = self.printer.lookup_object('gcode')
-            m = """{"code":"key111", "msg": "Extrude below minimum temp, See the 'min_extrude_temp' config option for details", "values": []}"""
-            if print_stats.state == "printing" and self.extrude_below_min_temp_err_is_report==False:
-                gcode._respond_error(m)
-                self.extrude_below_min_temp_err_is_report = True
-                gcode.respond_info("state:%s pause_start:%s" % (self.printer.lookup_object('print_stats').state, self.printer.lookup_object('pause_resume').pause_start))
-                if self.printer.lookup_object('print_stats').state == "printing" and self.printer.lookup_object('pause_resume').pause_start == False:
-                    self.printer.lookup_object('gcode').run_script_from_command("PAUSE")
-            elif print_stats.state == "standby":
-            # elif print_stats.state != "printing":
-                gcode._respond_error(m)
-            return
-            # raise self.printer.command_error("""{"code":"key111", "msg": "Extrude below minimum temp\nSee the 'min_extrude_temp' config option for details", "values": []}""")
-        elif self.double_array[13]==-2:
-            raise self.printer.command_error("Must home axis first")
-        elif self.double_array[13]==-3:
-            m = self.check_move_out_of_range(newpos)
-            # self.printer.lookup_object('gcode')._respond_error(m)
-            print_stats = self.printer.lookup_object('print_stats')
-            if print_stats.state == "printing" and self.printer.lookup_object('pause_resume').pause_start == False and self.printer.lookup_object('virtual_sdcard').is_move_out_of_range_in_printing==False:
-                self.printer.lookup_object('virtual_sdcard').is_move_out_of_range_in_printing=True
-                self.printer.lookup_object('gcode')._respond_error(m)
-            elif print_stats.state != "printing" and print_stats.state != "paused":
-                self.printer.lookup_object('gcode')._respond_error(m)
+        elif status in MOVE_REJECTED:
+            self._reject_move(status, newpos)
             return
-            # raise self.printer.command_error(m)
-            # raise self.printer.command_error("Move out of range")
-        elif self.double_array[13]==-1:
-            return
-        elif self.double_array[13]==-5:
-            raise self.printer.command_error("Extrude only move too long")
-        elif self.double_array[13]==-6:
-            raise self.printer.command_error("""{"code":"key112", "msg": "Move exceeds maximum extrusion (%.3fmm^2 vs %.3fmm^2)\nSee the 'max_extrude_cross_section' config option for details", "values": [%.3f, %.3f]}""")
         # if not move.move_d:
         #     return
         # if move.is_kinematic_move:
@@ -582,7 +629,7 @@ class ToolHead:
     def set_extruder(self, extruder, extrude_pos):
         self.extruder = extruder
         if hasattr(self.extruder, 'info_array_addr_int'):
-            mymovie.Py_set_extruder_info(self.extruder.info_array_addr_int)
+            self.planner.Py_set_extruder_info(self.extruder.info_array_addr_int)
         self.commanded_pos[3] = extrude_pos
         self.double_array[7]=self.commanded_pos[3]
     def get_extruder(self):
@@ -634,8 +681,9 @@ class ToolHead:
         is_active = buffer_time > -60. or not self.special_queuing_state
         if self.special_queuing_state == "Drip":
             buffer_time = 0.
-        return is_active, "print_time=%.3f buffer_time=%.3f print_stall=%d" % (
-            self.print_time, max(buffer_time, 0.), self.print_stall)
+        return is_active, "print_time=%.3f buffer_time=%.3f print_stall=%d %s" % (
+            self.print_time, max(buffer_time, 0.), self.print_stall,
+            self.move_queue.stats.get_stats())
     def check_busy(self, eventtime):
         est_print_time = self.mcu.estimated_print_time(eventtime)
         lookahead_empty = not self.move_queue.queue
@@ -646,6 +694,7 @@ class ToolHead:
         res = dict(self.kin.get_status(eventtime))
         res.update({ 'print_time': print_time,
                      'stalls': self.print_stall,
+                     'lookahead': self.move_queue.stats.get_status(),
                      'estimated_print_time': estimated_print_time,
                      'extruder': self.extruder.get_name(),
                      'position': self.Coord(*self.commanded_pos),
@@ -655,6 +704,10 @@ class ToolHead:
                      'square_corner_velocity': self.square_corner_velocity,
                      "G29_flag": self.G29_flag})
         return res
+    def _handle_connect(self):
+        self.print_stats = self.printer.lookup_object('print_stats', None)
+        self.pause_resume = self.printer.lookup_object('pause_resume', None)
+        self.v_sd = self.printer.lookup_object('virtual_sdcard', None)
     def _handle_shutdown(self):
         self.can_pause = False
         self.move_queue.reset()
@@ -3,10 +3,14 @@
 # Copyright (C) 2020 Eric Callahan <arksine.code@gmail.com>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license
-import logging, socket, os, sys, errno, json, collections
+import logging, socket, os, sys, errno, json, collections, functools, time
 import gcode
 
 REQUEST_LOG_SIZE = 20
+# Chunks passed to a single sendmsg() call
+SEND_IOV_MAX = 64
+# Pending output allowed for a client before it is disconnected
+SEND_BACKLOG_LIMIT = 8 * 1024 * 1024
 
 # Json decodes strings as unicode types in Python 2.x.  This doesn't
 # play well with some parts of Klipper (particuarly displays), so we
@@ -26,6 +30,9 @@ if sys.version_info.major < 3:
                     for k, v in data.items()}
         return data
 
+def encode_message(data):
+    return json.dumps(data, separators=(',', ':')).encode() + b"\x03"
+
 class WebRequestError(gcode.CommandError):
     def __init__(self, message,):
         Exception.__init__(self, message)
@@ -182,7 +189,13 @@ class ClientConnection:
         self.sock = sock
         self.fd_handle = self.reactor.register_fd(
             self.sock.fileno(), self.process_received, self._do_send)
-        self.partial_data = self.send_buffer = b""
+        self.partial_data = b""
+        # Outgoing messages; a message is either encoded bytes or a
+        # [key, data] list holding a status update not yet encoded
+        self.send_queue = collections.deque()
+        self.send_offset = 0
+        self.send_size = 0
+        self.pending_updates = {}
         self.is_blocking = False
         self.blocking_count = 0
         self.set_client_info("?", "New connection")
@@ -213,6 +226,9 @@ class ClientConnection:
         self.set_client_info(None, "Disconnected")
         self.reactor.unregister_fd(self.fd_handle)
         self.fd_handle = None
+        self.send_queue.clear()
+        self.pending_updates.clear()
+        self.send_size = self.send_offset = 0
         try:
             self.sock.close()
         except socket.error:
@@ -271,24 +287,91 @@ class ClientConnection:
             return
         self.send(result)
 
-    def send(self, data):
-        jmsg = json.dumps(data, separators=(',', ':'))
-        self.send_buffer += jmsg.encode() + b"\x03"
+    def send(self, data, coalesce_key=None, encoded=None):
+        # Messages sent with a coalesce_key are status updates of the form
+        # {'params': {'eventtime': ..., 'status': {obj: {field: value}}}}.
+        # While the client is not reading, a newer update with the same
+        # key is merged into the queued one (newest value wins).  The
+        # caller may pass the already encoded message in 'encoded'.
+        if self.fd_handle is None:
+            return
+        pending = self.pending_updates.get(coalesce_key)
+        if coalesce_key is None or (pending is None and not self.is_blocking):
+            msg = encoded or encode_message(data)
+            self.send_queue.append(msg)
+            self.send_size += len(msg)
+        elif pending is None:
+            pending = self.pending_updates[coalesce_key] = [
+                coalesce_key, self._copy_update(data)]
+            self.send_queue.append(pending)
+        else:
+            self._merge_update(pending[1], data)
+        if self.send_size > SEND_BACKLOG_LIMIT:
+            logging.info("webhooks: client %s send backlog of %d bytes,"
+                         " closing", self.uid, self.send_size)
+            self.close()
+            return
         if not self.is_blocking:
             self._do_send()
 
+    def _copy_update(self, data):
+        msg = dict(data)
+        params = msg['params'] = dict(data['params'])
+        params['status'] = {obj: dict(fields)
+                            for obj, fields in params['status'].items()}
+        return msg
+
+    def _merge_update(self, msg, data):
+        params = msg['params']
+        status = params['status']
+        for key, value in data['params'].items():
+            if key != 'status':
+                params[key] = value
+        for obj, fields in data['params']['status'].items():
+            if obj in status:
+                status[obj].update(fields)
+            else:
+                status[obj] = dict(fields)
+
+    def _encode_pending(self, index):
+        # Encode a queued status update before it is written
+        key, data = self.send_queue[index]
+        del self.pending_updates[key]
+        msg = encode_message(data)
+        self.send_queue[index] = msg
+        self.send_size += len(msg)
+        return msg
+
     def _do_send(self, eventtime=None):
         if self.fd_handle is None:
             return
-        try:
-            sent = self.sock.send(self.send_buffer)
-        except socket.error as e:
-            if e.errno not in [errno.EAGAIN, errno.EWOULDBLOCK]:
-                logging.info("webhooks: socket write error %d" % (self.uid,))
-                self.close()
-                return
-            sent = 0
-        if sent < len(self.send_buffer):
+        send_queue = self.send_queue
+        iov = []
+        for i in range(min(len(send_queue), SEND_IOV_MAX)):
+            msg = send_queue[i]
+            if type(msg) is list:
+                msg = self._encode_pending(i)
+            iov.append(msg)
+        if iov and self.send_offset:
+            iov[0] = memoryview(iov[0])[self.send_offset:]
+        sent = 0
+        if iov:
+            try:
+                sent = self.sock.sendmsg(iov)
+            except socket.error as e:
+                if e.errno not in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                    logging.info("webhooks: socket write error %d" % (self.uid,))
+                    self.close()
+                    return
+        # Drop the data that was written
+        self.send_size -= sent
+        sent += self.send_offset
+        for i in range(len(iov)):
+            if sent < len(send_queue[0]):
+                break
+            sent -= len(send_queue.popleft())
+        self.send_offset = sent
+        if send_queue:
             if not self.is_blocking:
                 self.reactor.set_fd_wake(self.fd_handle, False, True)
                 self.is_blocking = True
@@ -296,7 +379,6 @@ class ClientConnection:
         elif self.is_blocking:
             self.reactor.set_fd_wake(self.fd_handle, True, False)
             self.is_blocking = False
-        self.send_buffer = self.send_buffer[sent:]
 
 class WebHooks:
     def __init__(self, printer):
@@ -470,37 +552,59 @@ class QueryStatusHelper:
         self.pending_queries = []
         self.query_timer = None
         self.last_query = {}
+        self.status_cost = {}
+        self.client_groups = 0
         # Register webhooks
         webhooks = printer.lookup_object('webhooks')
         webhooks.register_endpoint("objects/list", self._handle_list)
         webhooks.register_endpoint("objects/query", self._handle_query)
         webhooks.register_endpoint("objects/subscribe", self._handle_subscribe)
+        webhooks.register_endpoint("objects/status_cost",
+                                   self._handle_status_cost)
     def _handle_list(self, web_request):
         objects = [n for n, o in self.printer.lookup_objects()
                    if hasattr(o, 'get_status')]
         web_request.send({'objects': objects})
+    def _get_object_status(self, obj_name, eventtime):
+        po = self.printer.lookup_object(obj_name, None)
+        if po is None or not hasattr(po, 'get_status'):
+            return {}
+        start = time.perf_counter()
+        res = po.get_status(eventtime)
+        cost = time.perf_counter() - start
+        stats = self.status_cost.get(obj_name)
+        if stats is None:
+            stats = self.status_cost[obj_name] = [0, 0., 0.]
+        stats[0] += 1
+        stats[1] += cost
+        stats[2] = max(stats[2], cost)
+        return res
     def _do_query(self, eventtime):
         last_query = self.last_query
         query = self.last_query = {}
         msglist = self.pending_queries
         self.pending_queries = []
         msglist.extend(self.clients.values())
-        # Generate get_status() info for each client
-        for cconn, subscription, send_func, template in msglist:
+        # Clients with identical subscriptions get identical updates, so
+        # each update is built and encoded once per group of clients
+        group_msgs = {}
+        for cconn, subscription, send_func, template, group_key in msglist:
             is_query = cconn is None
             if not is_query and cconn.is_closed():
                 del self.clients[cconn]
                 continue
+            if group_key in group_msgs:
+                msg, encoded = group_msgs[group_key]
+                if msg is not None:
+                    send_func(msg, encoded=encoded)
+                continue
             # Query each requested printer object
             cquery = {}
             for obj_name, req_items in subscription.items():
                 res = query.get(obj_name, None)
                 if res is None:
-                    po = self.printer.lookup_object(obj_name, None)
-                    if po is None or not hasattr(po, 'get_status'):
-                        res = query[obj_name] = {}
-                    else:
-                        res = query[obj_name] = po.get_status(eventtime)
+                    res = query[obj_name] = self._get_object_status(
+                        obj_name, eventtime)
                 if req_items is None:
                     req_items = list(res.keys())
                     if req_items:
@@ -514,10 +618,18 @@ class QueryStatusHelper:
                 if cres or is_query:
                     cquery[obj_name] = cres
             # Send data
+            msg = encoded = None
             if cquery or is_query:
-                tmp = dict(template)
-                tmp['params'] = {'eventtime': eventtime, 'status': cquery}
-                send_func(tmp)
+                msg = dict(template)
+                msg['params'] = {'eventtime': eventtime, 'status': cquery}
+                if is_query:
+                    send_func(msg)
+                else:
+                    encoded = encode_message(msg)
+                    send_func(msg, encoded=encoded)
+            if group_key is not None:
+                group_msgs[group_key] = (msg, encoded)
+        self.client_groups = len(group_msgs)
         if not query:
             # Unregister timer if there are no longer any subscriptions
             reactor = self.printer.get_reactor()
@@ -525,6 +637,18 @@ class QueryStatusHelper:
             self.query_timer = None
             return reactor.NEVER
         return eventtime + SUBSCRIPTION_REFRESH_TIME
+    def _handle_status_cost(self, web_request):
+        # Time spent in get_status() for each object polled by queries
+        # and subscriptions
+        objects = {}
+        for obj_name, (calls, total, max_time) in self.status_cost.items():
+            objects[obj_name] = {'calls': calls, 'total_time': total,
+                                 'avg_time': total / calls,
+                                 'max_time': max_time}
+        if web_request.get('reset', False, types=(bool,)):
+            self.status_cost = {}
+        web_request.send({'objects': objects, 'clients': len(self.clients),
+                          'client_groups': self.client_groups})
     def _handle_query(self, web_request, is_subscribe=False, handle_subscribe=False):
         objects = web_request.get_dict('objects')
         logging.info("_handle_query objects/subscribe:%s" % str(objects)) if handle_subscribe else None
@@ -543,7 +667,8 @@ class QueryStatusHelper:
             del self.clients[cconn]
         reactor = self.printer.get_reactor()
         complete = reactor.completion()
-        self.pending_queries.append((None, objects, complete.complete, {}))
+        self.pending_queries.append((None, objects, complete.complete, {},
+                                     None))
         # Start timer if needed
         if self.query_timer is None:
             qt = reactor.register_timer(self._do_query, reactor.NOW)
@@ -554,7 +679,12 @@ class QueryStatusHelper:
         logging.info("_handle_query after complete.wait:%s" % str(msg['params'])) if handle_subscribe else None
         web_request.send(msg['params'])
         if is_subscribe:
-            self.clients[cconn] = (cconn, objects, cconn.send, template)
+            send_func = functools.partial(cconn.send,
+                                          coalesce_key="objects/subscribe")
+            group_key = (json.dumps(objects, sort_keys=True),
+                         json.dumps(template, sort_keys=True))
+            self.clients[cconn] = (cconn, objects, send_func, template,
+                                   group_key)
     def _handle_subscribe(self, web_request):
         self._handle_query(web_request, is_subscribe=True, handle_subscribe=True)
 
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# Benchmark the accelerometer sample export to shared memory
+#
+# Copyright (C) 2025 K2 Unleashed Contributors
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, struct, time
+from multiprocessing import shared_memory
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy'))
+from extras import adxl345
+
+SAMPLES_PER_MSG = 3200 // 10
+SAMPLE_RATE = 3200.
+
+class FakeGCode:
+    def respond_info(self, msg):
+        pass
+
+class FakeReactor:
+    NOW = 0.
+    def monotonic(self):
+        return time.monotonic()
+    def pause(self, waketime):
+        return self.monotonic()
+
+class FakePrinter:
+    def __init__(self):
+        self.reactor = FakeReactor()
+        self.gcode = FakeGCode()
+    def get_reactor(self):
+        return self.reactor
+    def lookup_object(self, name):
+        return self.gcode
+
+class FakeConnection:
+    def __init__(self, msgs):
+        self.msgs = msgs
+    def get_messages(self):
+        return self.msgs
+
+def make_messages(count):
+    msgs = []
+    ptime = 0.
+    for i in range(0, count, SAMPLES_PER_MSG):
+        data = []
+        for j in range(min(SAMPLES_PER_MSG, count - i)):
+            ptime = round(ptime + 1. / SAMPLE_RATE, 6)
+            data.append((ptime, round(i * .5, 6), round(-j * .25, 6),
+                         9806.65))
+        msgs.append({'params': {'data': data}})
+    return msgs
+
+def make_helper(msgs):
+    helper = adxl345.AccelQueryHelper.__new__(adxl345.AccelQueryHelper)
+    helper.printer = FakePrinter()
+    helper.cconn = FakeConnection(msgs)
+    helper.samples = helper.raw_samples = []
+    helper.request_start_time = msgs[0]['params']['data'][0][0]
+    helper.request_end_time = msgs[-1]['params']['data'][-1][0]
+    return helper
+
+# Previous implementation: one struct.pack() per value
+def legacy_export(helper):
+    raw_samples = helper._get_raw_samples()
+    total = sum([len(m['params']['data']) for m in raw_samples])
+    shm_size = 4 + 8 * 4 * total
+    shm = shared_memory.SharedMemory(name="psm_samples", create=True,
+                                     size=shm_size)
+    buffer = shm.buf
+    count = 4
+    for msg in raw_samples:
+        for samp_time, x, y, z in msg['params']['data']:
+            if samp_time < helper.request_start_time:
+                continue
+            if samp_time > helper.request_end_time:
+                break
+            for val in (samp_time, x, y, z):
+                buffer[count:count+8] = bytearray(struct.pack("d", val))
+                count += 8
+    struct.pack_into("<I", buffer, 0, count)
+    del buffer
+    shm.close()
+
+def read_export():
+    shm = shared_memory.SharedMemory(name="psm_samples")
+    count, = struct.unpack_from("<I", shm.buf, 0)
+    data = bytes(shm.buf[:count])
+    shm.close()
+    shm.unlink()
+    return data
+
+def run(name, func, helper, count):
+    start = time.perf_counter()
+    func(helper)
+    elapsed = time.perf_counter() - start
+    data = read_export()
+    print("%-8s %9d samples %8.3fs %12.0f samples/sec" % (
+        name, count, elapsed, count / elapsed))
+    return data
+
+def main():
+    usage = "%prog [options]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-n", "--samples", type="int", dest="samples",
+                    default=1000000, help="number of samples to export")
+    options, args = opts.parse_args()
+    if args:
+        opts.error("Incorrect number of arguments")
+    msgs = make_messages(options.samples)
+    try:
+        # Remove a segment left behind by an interrupted run
+        shared_memory.SharedMemory(name="psm_samples").unlink()
+    except FileNotFoundError:
+        pass
+    old = run("legacy", legacy_export, make_helper(msgs), options.samples)
+    new = run("bulk", adxl345.AccelQueryHelper.get_samples_to_shared_mem,
+              make_helper(msgs), options.samples)
+    if old != new:
+        sys.stderr.write("ERROR: exported data differs\n")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
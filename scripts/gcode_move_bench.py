@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# Time G0/G1 handling in klippy on a Z-hop heavy G-Code file
+#
+# Copyright (C) 2025 K2 Unleashed Contributors
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+#
+# Run this on two checkouts (or before/after a change) with the same
+# config and G-Code file to compare the time spent per G0/G1 line:
+#   gcode_move_bench.py --generate zhop.gcode
+#   gcode_move_bench.py -d out/klipper.dict printer.cfg zhop.gcode
+# or time GCodeMove.simple_cmd_G1() alone with stub printer objects:
+#   gcode_move_bench.py --micro old_gcode_move.py new_gcode_move.py
+import sys, os, optparse, tempfile, time, logging, collections
+import importlib.util
+from lookahead_replay import KLIPPY_DIR, arg_dictionary
+
+def generate(filename, layers, hops):
+    # Short travel moves with a Z lift and drop around each one (the
+    # pattern produced by slicers with "retract + Z hop" enabled)
+    with open(filename, "w") as f:
+        f.write("G28\nG90\nM83\nG1 Z0.2 F600\n")
+        for layer in range(layers):
+            z = 0.2 + 0.2 * layer
+            for i in range(hops):
+                x = 50. + (i % 20) * 5.
+                y = 50. + (i // 20 % 20) * 5.
+                f.write("G1 Z%.3f F900\n" % (z + 0.4,))
+                f.write("G0 X%.3f Y%.3f F12000\n" % (x, y))
+                f.write("G1 Z%.3f F900\n" % (z,))
+                f.write("G1 X%.3f Y%.3f E0.05 F3000\n" % (x + 2., y))
+            f.write("G1 Z%.3f F600\n" % (z + 0.2,))
+        f.write("M400\n")
+
+def run(options, config_file, gcode_file):
+    sys.path.append(KLIPPY_DIR)
+    import klippy, reactor
+    logging.getLogger().setLevel(logging.WARNING)
+    tmpdir = tempfile.mkdtemp(prefix="gcode_move_bench_")
+    start_args = {
+        'config_file': os.path.abspath(config_file),
+        'apiserver': None, 'start_reason': 'startup',
+        'debuginput': gcode_file,
+        'debugoutput': os.path.join(tmpdir, "bench.serial"),
+        'software_version': "bench", 'cpu_info': ""}
+    start_args.update(options.dictionary)
+    gcode_input = open(gcode_file, 'rb')
+    start_args['gcode_fd'] = gcode_input.fileno()
+    printer = klippy.Printer(reactor.Reactor(), None, start_args)
+    times = {'z': [], 'xy': []}
+    def handle_connect():
+        # Time every line taken by the GCodeDispatch G0/G1 fast path
+        gcode_move = printer.lookup_object('gcode_move')
+        orig_simple_cmd_G1 = gcode_move.simple_cmd_G1
+        def simple_cmd_G1(line):
+            start = time.perf_counter()
+            try:
+                orig_simple_cmd_G1(line)
+            finally:
+                kind = 'z' if 'Z' in line or 'z' in line else 'xy'
+                times[kind].append(time.perf_counter() - start)
+        gcode_move.simple_cmd_G1 = simple_cmd_G1
+    printer.register_event_handler("klippy:connect", handle_connect)
+    start_time = time.perf_counter()
+    res = printer.run()
+    run_time = time.perf_counter() - start_time
+    print("result=%s run time=%.3fs" % (res, run_time))
+    for kind, label in (('z', "G1 with Z"), ('xy', "G0/G1 without Z")):
+        t = sorted(times[kind])
+        if not t:
+            continue
+        print("%-18s lines=%d lines/sec=%.0f avg=%.1fus p50=%.1fus"
+              " p99=%.1fus" % (
+                  label, len(t), len(t) / sum(t), sum(t) / len(t) * 1000000.,
+                  t[len(t) // 2] * 1000000.,
+                  t[min(len(t) - 1, int(len(t) * .99))] * 1000000.))
+
+######################################################################
+# Micro-benchmark (no mcu or klippy environment needed)
+######################################################################
+
+# Stub printer objects for GCodeMove.simple_cmd_G1(); the toolhead and
+# kinematics get_status() bodies match the real ones
+MicroCoord = collections.namedtuple('MicroCoord', ('x', 'y', 'z', 'e'))
+
+class MicroObject:
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+class MicroClockSync:
+    # Same arithmetic as clocksync.ClockSync.estimated_print_time()
+    def __init__(self):
+        self.mcu_freq = 400000000.
+        self.clock_est = (0., 0., self.mcu_freq)
+    def estimated_print_time(self, eventtime):
+        sample_time, clock, freq = self.clock_est
+        clock = int(clock + (eventtime - sample_time) * freq)
+        return float(clock) / self.mcu_freq
+
+class MicroFlushStats:
+    def __init__(self):
+        self.hist = [0] * 8
+    def get_status(self):
+        return {'flushes': 0, 'junction_flushes': 0, 'empty_flushes': 0,
+                'moves': 0, 'size_hist': list(self.hist),
+                'cal_time': 0., 'cal_max': 0., 'cal_hist': list(self.hist),
+                'process_time': 0., 'process_max': 0.,
+                'process_hist': list(self.hist),
+                'stall_waits': 0, 'stall_time': 0.}
+
+class MicroKinematics:
+    def __init__(self):
+        self.limits = [(0., 300.), (0., 300.), (0., 300.)]
+        self.axes_min = MicroCoord(0., 0., 0., 0.)
+        self.axes_max = MicroCoord(300., 300., 300., 0.)
+    def get_status(self, eventtime):
+        axes = [a for a, (l, h) in zip("xyz", self.limits) if l <= h]
+        return {'homed_axes': "".join(axes), 'axis_minimum': self.axes_min,
+                'axis_maximum': self.axes_max}
+
+class MicroToolhead:
+    def __init__(self):
+        self.kin = MicroKinematics()
+        self.mcu = MicroClockSync()
+        self.stats = MicroFlushStats()
+        self.commanded_pos = [0., 0., 0., 0.]
+    def get_kinematics(self):
+        return self.kin
+    def get_position(self):
+        return list(self.commanded_pos)
+    def move(self, newpos, speed):
+        pass
+    def get_status(self, eventtime):
+        estimated_print_time = self.mcu.estimated_print_time(eventtime)
+        res = dict(self.kin.get_status(eventtime))
+        res.update({'print_time': 0., 'stalls': 0,
+                    'lookahead': self.stats.get_status(),
+                    'estimated_print_time': estimated_print_time,
+                    'extruder': "extruder",
+                    'position': MicroCoord(*self.commanded_pos),
+                    'max_velocity': 800., 'max_accel': 20000.,
+                    'max_accel_to_decel': 10000.,
+                    'square_corner_velocity': 5., "G29_flag": False})
+        return res
+
+class MicroPrinter:
+    def __init__(self):
+        self.objects = {}
+        self.event_handlers = {}
+    def get_reactor(self):
+        return MicroObject(monotonic=time.monotonic)
+    def register_event_handler(self, event, callback):
+        self.event_handlers.setdefault(event, []).append(callback)
+    def lookup_object(self, name, default=KeyError):
+        if name in self.objects:
+            return self.objects[name]
+        if default is KeyError:
+            raise KeyError(name)
+        return default
+
+def make_gcode_move(module):
+    printer = MicroPrinter()
+    printer.objects.update({
+        'gcode': MicroObject(Coord=MicroCoord,
+                             register_command=lambda *a, **kw: None,
+                             _respond_error=lambda msg: None),
+        'toolhead': MicroToolhead(),
+        'print_stats': MicroObject(state="printing"),
+        'pause_resume': MicroObject(pause_start=False),
+        'virtual_sdcard': MicroObject(is_move_out_of_range_in_printing=False),
+    })
+    config = MicroObject(get_printer=lambda: printer,
+                         has_section=lambda name: False)
+    gcode_move = module.GCodeMove(config)
+    for callback in printer.event_handlers["klippy:ready"]:
+        callback()
+    return gcode_move
+
+def load_gcode_move(filename, name):
+    spec = importlib.util.spec_from_file_location(name, filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def time_lines(module, lines, repeat):
+    best = {}
+    for r in range(repeat):
+        g1 = make_gcode_move(module).simple_cmd_G1
+        times = {'z': 0., 'xy': 0.}
+        for line in lines:
+            kind = 'z' if 'Z' in line else 'xy'
+            start = time.perf_counter()
+            g1(line)
+            times[kind] += time.perf_counter() - start
+        for kind, t in times.items():
+            best[kind] = min(best.get(kind, t), t)
+    return best
+
+def run_micro(options, filenames):
+    # Time simple_cmd_G1 of two gcode_move.py versions on the generated
+    # Z-hop pattern, eg:
+    #   git show <rev>:klippy/extras/gcode_move.py > /tmp/old_gcode_move.py
+    #   gcode_move_bench.py --micro /tmp/old_gcode_move.py \
+    #       ../klippy/extras/gcode_move.py
+    filename = os.path.join(tempfile.mkdtemp(prefix="gcode_move_bench_"),
+                            "zhop.gcode")
+    generate(filename, options.layers, options.hops)
+    with open(filename) as f:
+        lines = [l.strip() for l in f if l.startswith(("G0 ", "G1 "))]
+    counts = {'z': len([l for l in lines if 'Z' in l])}
+    counts['xy'] = len(lines) - counts['z']
+    results = [time_lines(load_gcode_move(fname, "gcode_move_%d" % (i,)),
+                          lines, options.repeat)
+               for i, fname in enumerate(filenames)]
+    old, new = results
+    for kind, label in (('z', "G1 with Z"), ('xy', "G0/G1 without Z")):
+        if not counts[kind]:
+            continue
+        print("%-18s lines=%d old=%.2fus new=%.2fus speedup=%.1fx" % (
+            label, counts[kind], old[kind] / counts[kind] * 1000000.,
+            new[kind] / counts[kind] * 1000000., old[kind] / new[kind]))
+    print("all %d lines: old=%.3fs new=%.3fs speedup=%.2fx" % (
+        len(lines), sum(old.values()), sum(new.values()),
+        sum(old.values()) / sum(new.values())))
+
+def main():
+    usage = ("%prog [options] <config file> <gcode file>\n"
+             "       %prog --micro <old gcode_move.py> <new gcode_move.py>")
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-d", "--dictionary", dest="dictionary", type="string",
+                    action="callback", callback=arg_dictionary, default={},
+                    help="file to read for mcu protocol dictionary")
+    opts.add_option("--generate", dest="generate",
+                    help="write a Z-hop heavy test file and exit")
+    opts.add_option("--layers", type="int", dest="layers", default=100,
+                    help="layers in the generated file")
+    opts.add_option("--hops", type="int", dest="hops", default=200,
+                    help="Z hops per layer in the generated file")
+    opts.add_option("--micro", action="store_true", dest="micro",
+                    help="compare simple_cmd_G1 of two gcode_move.py files")
+    opts.add_option("-r", "--repeat", type="int", dest="repeat", default=5,
+                    help="timed runs per file in --micro mode")
+    options, args = opts.parse_args()
+    if options.micro:
+        if len(args) != 2:
+            opts.error("Incorrect number of arguments")
+        run_micro(options, args)
+        return
+    if options.generate:
+        generate(options.generate, options.layers, options.hops)
+        return
+    if len(args) != 2:
+        opts.error("Incorrect number of arguments")
+    run(options, args[0], args[1])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# Benchmark G-Code command line parsing in GCodeDispatch
+#
+# Copyright (C) 2025 K2 Unleashed Contributors
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, time, collections
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy'))
+import gcode
+
+# Previous implementation of the parameter split in _process_commands()
+def is_digit_or_delimiter(c):
+    if '0' <= c <= '9':
+        return True
+    if c in '=+-.':
+        return True
+    return False
+
+def legacy_parse(line):
+    parts = line.upper().split()
+    cmd = parts[0]
+    params = {}
+    for part in parts:
+        isset=False
+        for i, char in enumerate(part):
+            if is_digit_or_delimiter(char):
+                params[part[:i]] = part[i:]
+                isset=True
+                break
+        if isset:
+            continue
+        params[part] = ''
+    return cmd, params
+
+def make_dispatch():
+    dispatch = gcode.GCodeDispatch.__new__(gcode.GCodeDispatch)
+    dispatch.parse_cache = collections.OrderedDict()
+    return dispatch
+
+def load_lines(filenames):
+    # Return the lines that take the generic (non G0/G1) parse path
+    lines = []
+    for filename in filenames:
+        with open(filename, 'r', errors='replace') as f:
+            for line in f:
+                if (len(line) > 2 and line[0] in "Gg" and line[1] in "01"
+                        and line[2] == " "):
+                    continue
+                line = line.strip()
+                cpos = line.find(';')
+                if cpos == 0 or not line:
+                    continue
+                if cpos > 0:
+                    line = line[:cpos]
+                lines.append(line)
+    return lines
+
+def time_parser(parse, lines):
+    by_cmd = collections.defaultdict(list)
+    for line in lines:
+        by_cmd[line.upper().split()[0]].append(line)
+    results = {}
+    for cmd, cmd_lines in by_cmd.items():
+        start = time.perf_counter()
+        for line in cmd_lines:
+            parse(line)
+        results[cmd] = (len(cmd_lines), time.perf_counter() - start)
+    return results
+
+def main():
+    usage = "%prog [options] <gcode file> [<gcode file> ...]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-r", "--repeat", type="int", dest="repeat", default=5,
+                    help="number of passes over the input")
+    opts.add_option("-t", "--top", type="int", dest="top", default=20,
+                    help="number of command types to report")
+    options, args = opts.parse_args()
+    if not args:
+        opts.error("Incorrect number of arguments")
+    lines = load_lines(args) * options.repeat
+    dispatch = make_dispatch()
+    # Check that both parsers agree
+    for line in set(lines):
+        if legacy_parse(line) != dispatch.parse_line(line):
+            sys.stderr.write("ERROR: parse mismatch on %r\n" % (line,))
+            sys.exit(1)
+    dispatch = make_dispatch()
+    old = time_parser(legacy_parse, lines)
+    new = time_parser(dispatch.parse_line, lines)
+    print("%-24s %9s %14s %14s %7s" % (
+        "command", "lines", "legacy l/s", "new l/s", "speedup"))
+    order = sorted(old, key=lambda c: -old[c][0])
+    for cmd in order[:options.top]:
+        count, old_t = old[cmd]
+        new_t = new[cmd][1]
+        print("%-24s %9d %14.0f %14.0f %6.1fx" % (
+            cmd[:24], count, count / old_t, count / new_t, old_t / new_t))
+    count = len(lines)
+    old_t = sum([t for c, t in old.values()])
+    new_t = sum([t for c, t in new.values()])
+    print("%-24s %9d %14.0f %14.0f %6.1fx" % (
+        "total", count, count / old_t, count / new_t, old_t / new_t))
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,8 @@
 # Copyright (C) 2016-2021  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import optparse, datetime
+import optparse, datetime, os, re, json, multiprocessing
+import numpy
 import matplotlib
 
 MAXBANDWIDTH=25000.
@@ -18,37 +19,215 @@ APPLY_PREFIX = [
     'target', 'temp', 'pwm'
 ]
 
-def parse_log(logname, mcu):
+# Stats are returned as a dict of column name to numpy float array (NaN
+# where a sample did not report a value), including a "#sampletime"
+# column.  Samples without a "print_time" are dropped.
+
+######################################################################
+# Binary stats file (see the stats_file option of statistics_ext.py)
+######################################################################
+
+STATS_FILE_MAGIC = b"KSTATS2\n"
+STATS_SECTION_OPEN = 0xffffffffffffffff
+
+def load_stats_file(filename, mcu):
     if mcu is None:
         mcu = "mcu"
+    # Map each section and join them (columns that are missing from a
+    # section read as NaN)
+    size = os.path.getsize(filename)
+    hsize = len(STATS_FILE_MAGIC) + 12
+    sections = []
+    columns = []
+    pos = 0
+    with open(filename, 'rb') as f:
+        while pos + hsize <= size:
+            f.seek(pos)
+            head = f.read(hsize)
+            if head[:len(STATS_FILE_MAGIC)] != STATS_FILE_MAGIC:
+                raise ValueError("%s is not a stats file" % (filename,))
+            hlen = int(numpy.frombuffer(head, '<u4', 1,
+                                        len(STATS_FILE_MAGIC))[0])
+            rows = int(numpy.frombuffer(head, '<u8', 1,
+                                        len(STATS_FILE_MAGIC) + 4)[0])
+            scolumns = json.loads(f.read(hlen).decode())['columns']
+            offset = pos + hsize + hlen
+            is_last = rows == STATS_SECTION_OPEN
+            if is_last:
+                rows = (size - offset) // (8 * len(scolumns))
+            if rows > 0:
+                sections.append(numpy.memmap(
+                    filename, dtype='<f8', mode='r', offset=offset,
+                    shape=(rows, len(scolumns))))
+                columns.extend(scolumns[len(columns):])
+            if is_last:
+                break
+            pos = offset + rows * 8 * len(scolumns)
+    if not sections:
+        return {}
+    # Later sections only add columns, so section columns are a prefix
+    # of the full column list
+    if len(sections) == 1:
+        data = {name: sections[0][:, i] for i, name in enumerate(columns)}
+    else:
+        data = {}
+        for i, name in enumerate(columns):
+            data[name] = numpy.concatenate([
+                s[:, i] if i < s.shape[1]
+                else numpy.full(s.shape[0], numpy.nan) for s in sections])
+    # Columns of the selected mcu are also available without a prefix
+    # (as in the text log parser)
+    mcu_prefix = mcu + ":"
+    for name in columns:
+        if name.startswith(mcu_prefix):
+            data[name[len(mcu_prefix):]] = data[name]
+    keep = (data['#active'] != 0.)
+    if 'print_time' in data:
+        keep &= ~numpy.isnan(data['print_time'])
+    else:
+        keep[:] = False
+    return {name: values[keep] for name, values in data.items()}
+
+######################################################################
+# Text log parsing
+######################################################################
+
+BLOCK_SIZE = 16 * 1024 * 1024
+STATS_RE = re.compile(r'^(?:INFO:root:)?Stats ([0-9.]+): (.*)$', re.M)
+VALUE_RE = re.compile(r'=(\S*)')
+
+def to_float(val):
+    try:
+        return float(val)
+    except ValueError:
+        return float('nan')
+
+def parse_block(args):
+    # Parse the Stats lines in one block of the log into columns
+    logname, mcu, start, end = args
     mcu_prefix = mcu + ":"
     apply_prefix = { p: 1 for p in APPLY_PREFIX }
-    f = open(logname, 'r')
-    out = []
-    for line in f:
-        parts = line.split()
-        if not parts or parts[0] not in ('Stats', 'INFO:root:Stats'):
-            #if parts and parts[0] == 'INFO:root:shutdown:':
-            #    break
+    with open(logname, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('utf-8', 'replace')
+    # Lines with the same keys share a layout; the values of a layout are
+    # converted to floats with a single numpy call
+    layouts = {}
+    count = 0
+    for m in STATS_RE.finditer(text):
+        # Splitting on the values leaves the keys (and prefixes) between
+        # them: "a=1 b=2" -> ["a", "1", " b", "2", ""]
+        parts = VALUE_RE.split(m.group(2))
+        skeleton = ''.join(parts[0::2])
+        layout = layouts.get(skeleton)
+        if layout is None:
+            prefix = ""
+            names = []
+            segments = parts[0::2]
+            for i, keys in enumerate(segments):
+                keys = keys.split()
+                # Words before the key (or after the last value) are
+                # prefixes
+                name = None
+                if i < len(segments) - 1:
+                    name = keys.pop() if keys else ''
+                for p in keys:
+                    prefix = p
+                    if prefix == mcu_prefix:
+                        prefix = ''
+                if name is None:
+                    continue
+                if name in apply_prefix:
+                    name = prefix + name
+                names.append(name)
+            names.append('#sampletime')
+            layout = layouts[skeleton] = (names, 'print_time' in names,
+                                          [], [])
+        names, is_print, rows, vals = layout
+        if not is_print:
             continue
-        prefix = ""
-        keyparts = {}
-        for p in parts[2:]:
-            if '=' not in p:
-                prefix = p
-                if prefix == mcu_prefix:
-                    prefix = ''
-                continue
-            name, val = p.split('=', 1)
-            if name in apply_prefix:
-                name = prefix + name
-            keyparts[name] = val
-        if 'print_time' not in keyparts:
+        line_vals = parts[1::2]
+        line_vals.append(m.group(1))
+        rows.append(count)
+        vals.append(line_vals)
+        count += 1
+    columns = {}
+    for names, is_print, rows, vals in layouts.values():
+        if not rows:
             continue
-        keyparts['#sampletime'] = float(parts[1][:-1])
-        out.append(keyparts)
-    f.close()
-    return out
+        try:
+            values = numpy.array(vals, dtype=float)
+        except ValueError:
+            values = numpy.array([[to_float(v) for v in r] for r in vals])
+        rows = numpy.array(rows)
+        # A repeated key keeps its last value on the line
+        for i, name in enumerate(names):
+            col = columns.get(name)
+            if col is None:
+                col = columns[name] = numpy.full(count, numpy.nan)
+            col[rows] = values[:, i]
+    return count, columns
+
+def find_blocks(logname):
+    # Split the log into blocks that end on a line boundary
+    size = os.path.getsize(logname)
+    blocks = []
+    with open(logname, 'rb') as f:
+        start = 0
+        while start < size:
+            end = min(start + BLOCK_SIZE, size)
+            if end < size:
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            blocks.append((start, end))
+            start = end
+    return blocks
+
+def parse_log(logname, mcu):
+    if mcu is None:
+        mcu = "mcu"
+    blocks = [(logname, mcu, start, end)
+              for start, end in find_blocks(logname)]
+    if len(blocks) > 1:
+        pool = multiprocessing.Pool()
+        try:
+            results = pool.map(parse_block, blocks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [parse_block(b) for b in blocks]
+    # Join the per block columns
+    total = sum([count for count, columns in results])
+    if not total:
+        return {}
+    names = set()
+    for count, columns in results:
+        names.update(columns.keys())
+    data = {name: numpy.full(total, numpy.nan) for name in names}
+    pos = 0
+    for count, columns in results:
+        for name, values in columns.items():
+            data[name][pos:pos+count] = values
+        pos += count
+    return data
+
+def load_data(filename, mcu):
+    with open(filename, 'rb') as f:
+        is_stats_file = f.read(len(STATS_FILE_MAGIC)) == STATS_FILE_MAGIC
+    if is_stats_file:
+        return load_stats_file(filename, mcu)
+    return parse_log(filename, mcu)
+
+def get_column(data, name, default=0.):
+    values = data.get(name)
+    if values is None:
+        return numpy.full(len(data['#sampletime']), default)
+    return numpy.where(numpy.isnan(values), default, values)
+
+def to_datetimes(sampletimes):
+    return [datetime.datetime.utcfromtimestamp(st) for st in sampletimes]
 
 def setup_matplotlib(output_to_file):
     global matplotlib
@@ -61,10 +240,13 @@ def find_print_restarts(data):
     runoff_samples = {}
     last_runoff_start = last_buffer_time = last_sampletime = 0.
     last_print_stall = 0
-    for d in reversed(data):
+    sampletimes = data['#sampletime'].tolist()
+    buffer_times = get_column(data, 'buffer_time').tolist()
+    print_stalls = get_column(data, 'print_stall').tolist()
+    for i in reversed(range(len(sampletimes))):
         # Check for buffer runoff
-        sampletime = d['#sampletime']
-        buffer_time = float(d.get('buffer_time', 0.))
+        sampletime = sampletimes[i]
+        buffer_time = buffer_times[i]
         if (last_runoff_start and last_sampletime - sampletime < 5
             and buffer_time > last_buffer_time):
             runoff_samples[last_runoff_start][1].append(sampletime)
@@ -76,7 +258,7 @@ def find_print_restarts(data):
         last_buffer_time = buffer_time
         last_sampletime = sampletime
         # Check for print stall
-        print_stall = int(d['print_stall'])
+        print_stall = int(print_stalls[i])
         if print_stall < last_print_stall:
             if last_runoff_start:
                 runoff_samples[last_runoff_start][0] = True
@@ -87,39 +269,43 @@ def find_print_restarts(data):
 
 def plot_mcu(data, maxbw):
     # Generate data for plot
-    basetime = lasttime = data[0]['#sampletime']
-    lastbw = float(data[0]['bytes_write']) + float(data[0]['bytes_retransmit'])
+    sampletimes = data['#sampletime'].tolist()
+    bws = (get_column(data, 'bytes_write')
+           + get_column(data, 'bytes_retransmit')).tolist()
+    mcu_loads = (get_column(data, 'mcu_task_avg')
+                 + 3*get_column(data, 'mcu_task_stddev')).tolist()
+    buffer_times = get_column(data, 'buffer_time').tolist()
+    mcu_awake = get_column(data, 'mcu_awake').tolist()
+    basetime = lasttime = sampletimes[0]
+    lastbw = bws[0]
     sample_resets = find_print_restarts(data)
     times = []
     bwdeltas = []
     loads = []
     awake = []
     hostbuffers = []
-    for d in data:
-        st = d['#sampletime']
+    for st, bw, load, hb, ma in zip(sampletimes, bws, mcu_loads,
+                                    buffer_times, mcu_awake):
         timedelta = st - lasttime
         if timedelta <= 0.:
             continue
-        bw = float(d['bytes_write']) + float(d['bytes_retransmit'])
         if bw < lastbw:
             lastbw = bw
             continue
-        load = float(d['mcu_task_avg']) + 3*float(d['mcu_task_stddev'])
         if st - basetime < 15.:
             load = 0.
-        pt = float(d['print_time'])
-        hb = float(d['buffer_time'])
         if hb >= MAXBUFFER or st in sample_resets:
             hb = 0.
         else:
             hb = 100. * (MAXBUFFER - hb) / MAXBUFFER
         hostbuffers.append(hb)
-        times.append(datetime.datetime.utcfromtimestamp(st))
+        times.append(st)
         bwdeltas.append(100. * (bw - lastbw) / (maxbw * timedelta))
         loads.append(100. * load / TASK_MAX)
-        awake.append(100. * float(d.get('mcu_awake', 0.)) / STATS_INTERVAL)
+        awake.append(100. * ma / STATS_INTERVAL)
         lasttime = st
         lastbw = bw
+    times = to_datetimes(times)
 
     # Build plot
     fig, ax1 = matplotlib.pyplot.subplots()
@@ -139,25 +325,19 @@ def plot_mcu(data, maxbw):
 
 def plot_system(data):
     # Generate data for plot
-    lasttime = data[0]['#sampletime']
-    lastcputime = float(data[0]['cputime'])
-    times = []
-    sysloads = []
-    cputimes = []
-    memavails = []
-    for d in data:
-        st = d['#sampletime']
-        timedelta = st - lasttime
-        if timedelta <= 0.:
-            continue
-        lasttime = st
-        times.append(datetime.datetime.utcfromtimestamp(st))
-        cputime = float(d['cputime'])
-        cpudelta = max(0., min(1.5, (cputime - lastcputime) / timedelta))
-        lastcputime = cputime
-        cputimes.append(cpudelta * 100.)
-        sysloads.append(float(d['sysload']) * 100.)
-        memavails.append(float(d['memavail']))
+    sampletimes = data['#sampletime']
+    cputime = get_column(data, 'cputime')
+    # Only samples that advance the time are plotted
+    keep = numpy.diff(numpy.maximum.accumulate(sampletimes),
+                      prepend=sampletimes[0]) > 0.
+    sampletimes = sampletimes[keep]
+    timedeltas = numpy.diff(sampletimes, prepend=data['#sampletime'][0])
+    cputime = cputime[keep]
+    cpudeltas = numpy.diff(cputime, prepend=get_column(data, 'cputime')[0])
+    cputimes = numpy.clip(cpudeltas / timedeltas, 0., 1.5) * 100.
+    sysloads = get_column(data, 'sysload')[keep] * 100.
+    memavails = get_column(data, 'memavail')[keep]
+    times = to_datetimes(sampletimes.tolist())
 
     # Build plot
     fig, ax1 = matplotlib.pyplot.subplots()
@@ -181,21 +361,19 @@ def plot_system(data):
     ax1.grid(True)
     return fig
 
+def get_freq_samples(data, key):
+    values = data[key]
+    valid = ~numpy.isnan(values) & (values != 0.) & (values != 1.)
+    return to_datetimes(data['#sampletime'][valid].tolist()), values[valid]
+
 def plot_mcu_frequencies(data):
-    all_keys = {}
-    for d in data:
-        all_keys.update(d)
-    graph_keys = { key: ([], []) for key in all_keys
+    graph_keys = { key: get_freq_samples(data, key) for key in data
                    if (key in ("freq", "adj")
                        or (key.endswith(":freq") or key.endswith(":adj"))) }
-    for d in data:
-        st = datetime.datetime.utcfromtimestamp(d['#sampletime'])
-        for key, (times, values) in graph_keys.items():
-            val = d.get(key)
-            if val not in (None, '0', '1'):
-                times.append(st)
-                values.append(float(val))
-    est_mhz = { key: round((sum(values)/len(values)) / 1000000.)
+    graph_keys = { key: (times, values)
+                   for key, (times, values) in graph_keys.items()
+                   if len(values) }
+    est_mhz = { key: round(values.mean() / 1000000.)
                 for key, (times, values) in graph_keys.items() }
 
     # Build plot
@@ -208,7 +386,7 @@ def plot_mcu_frequencies(data):
         mhz = est_mhz[key]
         label = "%s(%dMhz)" % (key, mhz)
         hz = mhz * 1000000.
-        ax1.plot_date(times, [(v - hz)/mhz for v in values], '.', label=label)
+        ax1.plot_date(times, (values - hz)/mhz, '.', label=label)
     fontP = matplotlib.font_manager.FontProperties()
     fontP.set_size('x-small')
     ax1.legend(loc='best', prop=fontP)
@@ -218,18 +396,8 @@ def plot_mcu_frequencies(data):
     return fig
 
 def plot_mcu_frequency(data, mcu):
-    all_keys = {}
-    for d in data:
-        all_keys.update(d)
-    graph_keys = { key: ([], []) for key in all_keys
+    graph_keys = { key: get_freq_samples(data, key) for key in data
                    if key in ("freq", "adj") }
-    for d in data:
-        st = datetime.datetime.utcfromtimestamp(d['#sampletime'])
-        for key, (times, values) in graph_keys.items():
-            val = d.get(key)
-            if val not in (None, '0', '1'):
-                times.append(st)
-                values.append(float(val))
 
     # Build plot
     fig, ax1 = matplotlib.pyplot.subplots()
@@ -255,18 +423,13 @@ def plot_temperature(data, heaters):
         temp_key = heater + ':' + 'temp'
         target_key = heater + ':' + 'target'
         pwm_key = heater + ':' + 'pwm'
-        times = []
-        temps = []
-        targets = []
-        pwm = []
-        for d in data:
-            temp = d.get(temp_key)
-            if temp is None:
-                continue
-            times.append(datetime.datetime.utcfromtimestamp(d['#sampletime']))
-            temps.append(float(temp))
-            pwm.append(float(d.get(pwm_key, 0.)))
-            targets.append(float(d.get(target_key, 0.)))
+        if temp_key not in data:
+            continue
+        valid = ~numpy.isnan(data[temp_key])
+        times = to_datetimes(data['#sampletime'][valid].tolist())
+        temps = data[temp_key][valid]
+        pwm = get_column(data, pwm_key)[valid]
+        targets = get_column(data, target_key)[valid]
         ax1.plot_date(times, temps, '-', label='%s temp' % (heater,), alpha=0.8)
         if any(targets):
             label = '%s target' % (heater,)
@@ -290,7 +453,7 @@ def plot_temperature(data, heaters):
 
 def main():
     # Parse command-line arguments
-    usage = "%prog [options] <logfile>"
+    usage = "%prog [options] <logfile or stats file>"
     opts = optparse.OptionParser(usage)
     opts.add_option("-f", "--frequency", action="store_true",
                     help="graph mcu frequency")
@@ -308,8 +471,8 @@ def main():
     logname = args[0]
 
     # Parse data
-    data = parse_log(logname, options.mcu)
-    if not data:
+    data = load_data(logname, options.mcu)
+    if not data or not len(data['#sampletime']):
         return
 
     # Draw graph
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# Replay G-Code through klippy with each look-ahead planner and compare
+#
+# Copyright (C) 2025 K2 Unleashed Contributors
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, json, subprocess, tempfile, time, logging
+KLIPPY_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                          '..', 'klippy')
+
+PLANNERS = ['mymovie', 'reference']
+MOVE_FIELDS = ['start_v', 'cruise_v', 'end_v', 'accel_t', 'cruise_t',
+               'decel_t', 'accel']
+
+######################################################################
+# Single planner run (in a child process)
+######################################################################
+
+def write_config(config_file, planner, tmpdir):
+    fname = os.path.join(tmpdir, "replay_%s.cfg" % (planner,))
+    with open(fname, "w") as f:
+        f.write("[include %s]\n\n[printer]\nlookahead_planner: %s\n" % (
+            os.path.abspath(config_file), planner))
+    return fname
+
+def run_planner(options, config_file, gcode_file, planner):
+    sys.path.append(KLIPPY_DIR)
+    import klippy, reactor, chelper
+    logging.getLogger().setLevel(logging.WARNING)
+    tmpdir = tempfile.mkdtemp(prefix="lookahead_replay_")
+    start_args = {
+        'config_file': write_config(config_file, planner, tmpdir),
+        'apiserver': None, 'start_reason': 'startup',
+        'debuginput': gcode_file,
+        'debugoutput': os.path.join(tmpdir, "replay.serial"),
+        'software_version': "replay", 'cpu_info': ""}
+    start_args.update(options.dictionary)
+    gcode_input = open(gcode_file, 'rb')
+    start_args['gcode_fd'] = gcode_input.fileno()
+    printer = klippy.Printer(reactor.Reactor(), None, start_args)
+    ffi_main, ffi_lib = chelper.get_ffi()
+    moves = []
+    flush_times = []
+    def handle_connect():
+        # Record every move handed to the trapq and the time spent per flush
+        toolhead = printer.lookup_object('toolhead')
+        orig_append = toolhead.trapq_append_from_moveq
+        def trapq_append_from_moveq(tq, etq, next_move_time, move_data,
+                                    move_num):
+            m = ffi_main.cast('struct moveq_move *', move_data)
+            for i in range(move_num):
+                moves.append([getattr(m, f) for f in MOVE_FIELDS]
+                             + list(m.start_pos) + list(m.end_pos))
+                m = m.next
+            return orig_append(tq, etq, next_move_time, move_data, move_num)
+        toolhead.trapq_append_from_moveq = trapq_append_from_moveq
+        move_queue = toolhead.move_queue
+        orig_flush = move_queue.flush
+        def flush(lazy=False):
+            start = time.perf_counter()
+            orig_flush(lazy)
+            flush_times.append(time.perf_counter() - start)
+        move_queue.flush = flush
+    printer.register_event_handler("klippy:connect", handle_connect)
+    start_time = time.perf_counter()
+    res = printer.run()
+    run_time = time.perf_counter() - start_time
+    toolhead = printer.lookup_object('toolhead', None)
+    lookahead = {}
+    if toolhead is not None:
+        lookahead = toolhead.move_queue.stats.get_status()
+    flush_times.sort()
+    def percentile(p):
+        if not flush_times:
+            return 0.
+        return flush_times[min(len(flush_times) - 1,
+                               int(len(flush_times) * p))]
+    result = {
+        'planner': planner, 'result': res, 'run_time': run_time,
+        'moves': len(moves), 'moves_per_sec': len(moves) / run_time,
+        'flushes': len(flush_times),
+        'flush_avg': sum(flush_times) / max(1, len(flush_times)),
+        'flush_p50': percentile(.5), 'flush_p99': percentile(.99),
+        'flush_max': percentile(1.), 'lookahead': lookahead}
+    with open(options.output % (planner,), "w") as f:
+        json.dump({'result': result, 'moves': moves}, f)
+
+######################################################################
+# Comparison
+######################################################################
+
+def compare_moves(base, other):
+    if len(base) != len(other):
+        return "move count differs (%d vs %d)" % (len(base), len(other))
+    max_diff = [0.] * len(base[0]) if base else []
+    for bm, om in zip(base, other):
+        for i, (b, o) in enumerate(zip(bm, om)):
+            max_diff[i] = max(max_diff[i], abs(b - o))
+    names = MOVE_FIELDS + ['start_x', 'start_y', 'start_z', 'start_e',
+                           'end_x', 'end_y', 'end_z', 'end_e']
+    return "max abs diff: " + " ".join(
+        ["%s=%.3g" % (n, d) for n, d in zip(names, max_diff)])
+
+def arg_dictionary(option, opt_str, value, parser):
+    # Same "-d [mcu=]file" handling as klippy.py
+    key, fname = "dictionary", value
+    if '=' in value:
+        mcu_name, fname = value.split('=', 1)
+        key = "dictionary_" + mcu_name
+    parser.values.dictionary[key] = fname
+
+def main():
+    usage = "%prog [options] <config file> <gcode file>"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-d", "--dictionary", dest="dictionary", type="string",
+                    action="callback", callback=arg_dictionary, default={},
+                    help="file to read for mcu protocol dictionary")
+    opts.add_option("-p", "--planner", dest="planners", action="append",
+                    help="planner to run (default: all)")
+    opts.add_option("--output", dest="output",
+                    default=os.path.join(tempfile.gettempdir(),
+                                         "lookahead_replay_%s.json"),
+                    help="result file pattern (%s is the planner name)")
+    opts.add_option("--run", dest="run", help=optparse.SUPPRESS_HELP)
+    options, args = opts.parse_args()
+    if len(args) != 2:
+        opts.error("Incorrect number of arguments")
+    config_file, gcode_file = args
+    if options.run:
+        run_planner(options, config_file, gcode_file, options.run)
+        return
+    planners = options.planners or PLANNERS
+    results = {}
+    for planner in planners:
+        # Each planner runs in its own process (klippy keeps global state)
+        cmd = [sys.executable, os.path.realpath(__file__), "--run", planner,
+               "--output", options.output]
+        for key, fname in options.dictionary.items():
+            if key == "dictionary":
+                cmd += ["-d", fname]
+            else:
+                cmd += ["-d", "%s=%s" % (key[len("dictionary_"):], fname)]
+        subprocess.check_call(cmd + [config_file, gcode_file])
+        with open(options.output % (planner,), "r") as f:
+            results[planner] = json.load(f)
+    for planner in planners:
+        r = results[planner]['result']
+        print("%-10s moves=%d time=%.3fs moves/sec=%.0f flushes=%d"
+              " flush avg=%.1fus p50=%.1fus p99=%.1fus max=%.1fus" % (
+                  planner, r['moves'], r['run_time'], r['moves_per_sec'],
+                  r['flushes'], r['flush_avg'] * 1000000.,
+                  r['flush_p50'] * 1000000., r['flush_p99'] * 1000000.,
+                  r['flush_max'] * 1000000.))
+    base = planners[0]
+    for planner in planners[1:]:
+        print("%s vs %s: %s" % (planner, base, compare_moves(
+            results[base]['moves'], results[planner]['moves'])))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# Benchmark gcode_macro template rendering on a set of config files
+#
+# Copyright (C) 2025 K2 Unleashed Contributors
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+#
+# Renders every [gcode_macro] in the given config files with the previous
+# template context (a deep copy of each referenced status) and the
+# current one (read-only status views), checks that both produce the same
+# output and reports the time taken:
+#   macro_render_bench.py config/F012_CR0CN200400C10/*.cfg
+import sys, os, optparse, time, copy, ast, collections, configparser
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy'))
+from extras import gcode_macro
+
+Coord = collections.namedtuple('Coord', ('x', 'y', 'z', 'e'))
+
+# Missing status fields read as 0 (there is no real printer to query)
+class LenientDict(dict):
+    def __missing__(self, key):
+        return 0
+
+class StaticStatus:
+    def __init__(self, status):
+        self.status = status
+    def get_status(self, eventtime):
+        return self.status
+
+class BenchReactor:
+    def monotonic(self):
+        return time.monotonic()
+
+class BenchPrinter:
+    command_error = Exception
+    def __init__(self):
+        self.objects = {}
+        self.reactor = BenchReactor()
+    def get_reactor(self):
+        return self.reactor
+    def lookup_object(self, name, default=None):
+        if name not in self.objects:
+            self.objects[name] = StaticStatus(LenientDict())
+        return self.objects[name]
+
+class BenchConfig:
+    def __init__(self, printer):
+        self.printer = printer
+    def get_printer(self):
+        return self.printer
+
+def load_macros(filenames, printer):
+    fileconfig = configparser.RawConfigParser(
+        strict=False, inline_comment_prefixes=(';', '#'))
+    for filename in filenames:
+        with open(filename, 'r', encoding='utf-8', errors='replace') as f:
+            fileconfig.read_file(f, filename)
+    macros = []
+    raw_config = {}
+    settings = {}
+    for section in fileconfig.sections():
+        options = dict(fileconfig.items(section))
+        raw_config[section] = options
+        settings[section.lower()] = parsed = {}
+        for option, value in options.items():
+            try:
+                parsed[option] = ast.literal_eval(value)
+            except (ValueError, SyntaxError):
+                parsed[option] = value
+        if not section.startswith('gcode_macro ') or 'gcode' not in options:
+            continue
+        variables = LenientDict()
+        for option, value in parsed.items():
+            if option.startswith('variable_'):
+                variables[option[len('variable_'):]] = value
+        printer.objects[section] = StaticStatus(variables)
+        macros.append((section, options['gcode'], variables))
+    printer.objects['configfile'] = StaticStatus({
+        'config': raw_config, 'settings': settings, 'warnings': [],
+        'save_config_pending': False, 'save_config_pending_items': {}})
+    printer.objects['toolhead'] = StaticStatus(LenientDict({
+        'homed_axes': "xyz", 'position': Coord(150., 150., 10., 0.),
+        'axis_minimum': Coord(-2., -2., -2., 0.),
+        'axis_maximum': Coord(300., 300., 300., 0.),
+        'max_velocity': 800., 'max_accel': 20000.}))
+    printer.objects['extruder'] = StaticStatus(LenientDict({
+        'temperature': 220., 'target': 220., 'can_extrude': True}))
+    printer.objects['print_stats'] = StaticStatus(LenientDict({
+        'state': "printing", 'filename': "test.gcode"}))
+    return macros
+
+######################################################################
+# Previous implementation
+######################################################################
+
+class LegacyGetStatusWrapper:
+    def __init__(self, printer, eventtime=None):
+        self.printer = printer
+        self.eventtime = eventtime
+        self.cache = {}
+    def __getitem__(self, val):
+        sval = str(val).strip()
+        if sval in self.cache:
+            return self.cache[sval]
+        po = self.printer.lookup_object(sval, None)
+        if po is None or not hasattr(po, 'get_status'):
+            raise KeyError(val)
+        if self.eventtime is None:
+            self.eventtime = self.printer.get_reactor().monotonic()
+        self.cache[sval] = res = copy.deepcopy(po.get_status(self.eventtime))
+        return res
+
+def legacy_context(gm, printer, variables):
+    kwparams = dict(variables)
+    kwparams.update({
+        'printer': LegacyGetStatusWrapper(printer),
+        'action_emergency_stop': gm._action_emergency_stop,
+        'action_respond_info': gm._action_respond_info,
+        'action_raise_error': gm._action_raise_error,
+        'action_call_remote_method': gm._action_call_remote_method,
+    })
+    kwparams['params'] = {}
+    kwparams['rawparams'] = ""
+    return kwparams
+
+def current_context(gm, printer, variables):
+    kwparams = dict(variables)
+    kwparams.update(gm.create_template_context())
+    kwparams['params'] = {}
+    kwparams['rawparams'] = ""
+    return kwparams
+
+######################################################################
+# Comparison
+######################################################################
+
+def render(template, context):
+    try:
+        return str(template.render(context))
+    except Exception as e:
+        return "ERROR: %s" % (e,)
+
+def time_render(template, make_context, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        out = render(template, make_context())
+    return (time.perf_counter() - start) / repeat, out
+
+def main():
+    usage = "%prog [options] <config file> [<config file> ...]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-r", "--repeat", type="int", dest="repeat", default=100,
+                    help="number of renders per macro")
+    opts.add_option("-t", "--top", type="int", dest="top", default=20,
+                    help="number of macros to report")
+    options, args = opts.parse_args()
+    if not args:
+        opts.error("Incorrect number of arguments")
+    printer = BenchPrinter()
+    gm = gcode_macro.PrinterGCodeMacro(BenchConfig(printer))
+    printer.objects['gcode_macro'] = gm
+    macros = load_macros(args, printer)
+    # Template compilation
+    start = time.perf_counter()
+    legacy_templates = [gm.env.from_string(script)
+                        for name, script, variables in macros]
+    old_compile = time.perf_counter() - start
+    start = time.perf_counter()
+    templates = [gm.compile_template(gm.env, script)
+                 for name, script, variables in macros]
+    new_compile = time.perf_counter() - start
+    print("compile %d macros: legacy=%.3fs new=%.3fs (%d unique scripts)" % (
+        len(macros), old_compile, new_compile, len(gm.template_cache)))
+    # Rendering
+    results = []
+    mismatches = errors = 0
+    for (name, script, variables), old_tmpl, new_tmpl in zip(
+            macros, legacy_templates, templates):
+        old_t, old_out = time_render(
+            old_tmpl, lambda: legacy_context(gm, printer, variables),
+            options.repeat)
+        new_t, new_out = time_render(
+            new_tmpl, lambda: current_context(gm, printer, variables),
+            options.repeat)
+        if old_out.startswith("ERROR: "):
+            errors += 1
+        if old_out != new_out:
+            mismatches += 1
+            print("MISMATCH in %s:\n  legacy: %r\n  new:    %r" % (
+                name, old_out[:200], new_out[:200]))
+        results.append((name, old_t, new_t))
+    print("%-36s %12s %12s %8s" % ("macro", "legacy us", "new us",
+                                   "speedup"))
+    results.sort(key=lambda r: -r[1])
+    for name, old_t, new_t in results[:options.top]:
+        print("%-36s %12.1f %12.1f %7.1fx" % (
+            name[12:48], old_t * 1000000., new_t * 1000000., old_t / new_t))
+    old_total = sum([r[1] for r in results])
+    new_total = sum([r[2] for r in results])
+    print("%-36s %12.1f %12.1f %7.1fx" % (
+        "total", old_total * 1000000., new_total * 1000000.,
+        old_total / new_total))
+    print("%d macros, %d raised errors in both versions, %d mismatches" % (
+        len(results), errors, mismatches))
+    if mismatches:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -109,6 +109,8 @@ def main():
     opts.add_option("-g", "--graph", help="Graph to generate (python literal)")
     opts.add_option("-l", "--list-datasets", action="store_true",
                     help="List available datasets")
+    opts.add_option("-j", "--jobs", type="int", default=0,
+                    help="Number of processes decoding the log ahead")
     options, args = opts.parse_args()
     if options.list_datasets:
         list_datasets()
@@ -117,7 +119,7 @@ def main():
     log_prefix = args[0]
 
     # Open data files
-    lmanager = readlog.LogManager(log_prefix)
+    lmanager = readlog.LogManager(log_prefix, options.jobs)
     lmanager.setup_index()
     lmanager.seek_time(options.skip)
     amanager = analyzers.AnalyzerManager(lmanager, options.segment_time)
@@ -137,6 +139,7 @@ def main():
     # Draw graph
     setup_matplotlib(options.output is not None)
     fig = plot_motion(amanager, graphs, log_prefix)
+    lmanager.close()
 
     # Show graph
     if options.output is None:
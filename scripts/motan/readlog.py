@@ -3,7 +3,7 @@
 # Copyright (C) 2021  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import json, zlib
+import json, zlib, logging, bisect, collections, multiprocessing
 
 class error(Exception):
     pass
@@ -449,28 +449,91 @@ class JsonLogReader:
     def __init__(self, filename):
         self.file = open(filename, "rb")
         self.comp = zlib.decompressobj(31)
-        self.msgs = [b""]
+        self.msgs = collections.deque()
+        self.partial = b""
     def seek(self, pos):
         self.file.seek(pos)
-        self.comp = zlib.decompressobj(-15)
+        # Positions after the gzip header are raw deflate data
+        self.comp = zlib.decompressobj(-15 if pos else 31)
+        self.msgs.clear()
+        self.partial = b""
     def pull_msg(self):
         msgs = self.msgs
         while 1:
-            if len(msgs) > 1:
-                msg = msgs.pop(0)
+            if msgs:
+                msg = msgs.popleft()
                 try:
                     json_msg = json.loads(msg)
                 except:
                     logging.exception("Unable to parse line")
                     continue
                 return json_msg
-            raw_data = self.file.read(8192)
+            raw_data = self.file.read(65536)
             if not raw_data:
                 return None
             data = self.comp.decompress(raw_data)
             parts = data.split(b'\x03')
-            parts[0] = msgs[0] + parts[0]
-            self.msgs = msgs = parts
+            parts[0] = self.partial + parts[0]
+            self.partial = parts.pop()
+            msgs.extend(parts)
+    def close(self):
+        self.file.close()
+
+# Decompress and parse the messages between two index file positions
+# (data_logger.py does a zlib full flush at each index update, so each
+# block can be decoded on its own)
+def decode_block(args):
+    filename, start, end = args
+    with open(filename, "rb") as f:
+        f.seek(start)
+        if end is None:
+            raw_data = f.read()
+        else:
+            raw_data = f.read(end - start)
+    comp = zlib.decompressobj(-15 if start else 31)
+    msgs = []
+    for msg in comp.decompress(raw_data).split(b'\x03')[:-1]:
+        try:
+            msgs.append(json.loads(msg))
+        except:
+            logging.exception("Unable to parse line")
+    return msgs
+
+# Read a log using a pool of processes that decode blocks ahead of use
+class BlockLogReader:
+    def __init__(self, filename, positions, jobs):
+        self.filename = filename
+        self.positions = sorted(set([0] + positions))
+        self.pool = multiprocessing.Pool(jobs)
+        self.max_pending = 2 * jobs
+        self.pending = collections.deque()
+        self.msgs = collections.deque()
+        self.next_block = 0
+    def seek(self, pos):
+        self.next_block = bisect.bisect_left(self.positions, pos)
+        self.pending.clear()
+        self.msgs.clear()
+    def _queue_blocks(self):
+        positions = self.positions
+        while (len(self.pending) < self.max_pending
+               and self.next_block < len(positions)):
+            start = positions[self.next_block]
+            self.next_block += 1
+            end = None
+            if self.next_block < len(positions):
+                end = positions[self.next_block]
+            self.pending.append(self.pool.apply_async(
+                decode_block, ((self.filename, start, end),)))
+    def pull_msg(self):
+        while not self.msgs:
+            self._queue_blocks()
+            if not self.pending:
+                return None
+            self.msgs.extend(self.pending.popleft().get())
+        return self.msgs.popleft()
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
 
 # Store messages in per-subscription queues until handlers are ready for them
 class JsonDispatcher:
@@ -480,16 +543,27 @@ class JsonDispatcher:
         self.last_read_time = 0.
         self.log_reader = JsonLogReader(log_prefix + ".json.gz")
         self.is_eof = False
+    def set_log_reader(self, log_reader):
+        self.log_reader.close()
+        self.log_reader = log_reader
+    def close(self):
+        self.log_reader.close()
+    def seek(self, file_position):
+        self.log_reader.seek(file_position)
+        for q in self.names.values():
+            q.clear()
+        self.last_read_time = 0.
+        self.is_eof = False
     def check_end_of_data(self):
         return self.is_eof and not any(self.queues.values())
     def add_handler(self, name, subscription_id):
-        self.names[name] = q = []
+        self.names[name] = q = collections.deque()
         self.queues.setdefault(subscription_id, []).append(q)
     def pull_msg(self, req_time, name):
         q = self.names[name]
         while 1:
             if q:
-                return q.pop(0)
+                return q.popleft()
             if req_time + 1. < self.last_read_time:
                 return None
             json_msg = self.log_reader.pull_msg()
@@ -562,11 +636,40 @@ def list_datasets():
         datasets += LogHandlers[lh].DataSets
     return datasets
 
+# Time to file position index of a log (the .index.gz file)
+class LogIndex:
+    def __init__(self, filename):
+        reader = JsonLogReader(filename)
+        self.first_msg = reader.pull_msg()
+        # Each later entry holds the status changes since the previous one
+        self.times = []
+        self.positions = []
+        self.updates = []
+        last_time = 0.
+        while 1:
+            fmsg = reader.pull_msg()
+            if fmsg is None:
+                break
+            th = fmsg['status'].get('toolhead', {})
+            ptime = max(th.get('estimated_print_time', 0.),
+                        th.get('print_time', 0.))
+            # Keep the times sorted (for bisection)
+            last_time = max(last_time, ptime)
+            self.times.append(last_time)
+            self.positions.append(fmsg['file_position'])
+            self.updates.append(fmsg['status'])
+        reader.close()
+    def find(self, seek_time):
+        # Return the number of entries at or before seek_time
+        return bisect.bisect_right(self.times, seek_time)
+
 # Main log access management
 class LogManager:
     error = error
-    def __init__(self, log_prefix):
-        self.index_reader = JsonLogReader(log_prefix + ".index.gz")
+    def __init__(self, log_prefix, jobs=0):
+        self.log_prefix = log_prefix
+        self.jobs = jobs
+        self.index = None
         self.jdispatch = JsonDispatcher(log_prefix)
         self.initial_start_time = self.start_time = 0.
         self.datasets = {}
@@ -575,12 +678,19 @@ class LogManager:
         self.log_subscriptions = {}
         self.status_tracker = None
     def setup_index(self):
-        fmsg = self.index_reader.pull_msg()
+        self.index = LogIndex(self.log_prefix + ".index.gz")
+        if self.jobs:
+            self.jdispatch.set_log_reader(BlockLogReader(
+                self.log_prefix + ".json.gz", self.index.positions, self.jobs))
+        fmsg = self.index.first_msg
         self.initial_status = status = fmsg['status']
         self.start_status = dict(status)
         start_time = status['toolhead']['estimated_print_time']
         self.initial_start_time = self.start_time = start_time
         self.log_subscriptions = fmsg.get('subscriptions', {})
+    def close(self):
+        # Close the log (and stop any decoding processes)
+        self.jdispatch.close()
     def get_initial_status(self):
         return self.initial_status
     def available_dataset_types(self):
@@ -589,22 +699,17 @@ class LogManager:
         return self.jdispatch
     def seek_time(self, req_time):
         self.start_time = req_start_time = self.initial_start_time + req_time
-        start_status = self.start_status
         seek_time = max(self.initial_start_time, req_start_time - 1.)
-        file_position = 0
-        while 1:
-            fmsg = self.index_reader.pull_msg()
-            if fmsg is None:
-                break
-            th = fmsg['status']['toolhead']
-            ptime = max(th['estimated_print_time'], th.get('print_time', 0.))
-            if ptime > seek_time:
-                break
-            for k, v in fmsg["status"].items():
+        count = self.index.find(seek_time)
+        start_status = {k: dict(v) for k, v in self.initial_status.items()}
+        for update in self.index.updates[:count]:
+            for k, v in update.items():
                 start_status.setdefault(k, {}).update(v)
-            file_position = fmsg['file_position']
-        if file_position:
-            self.jdispatch.log_reader.seek(file_position)
+        self.start_status = start_status
+        file_position = 0
+        if count:
+            file_position = self.index.positions[count - 1]
+        self.jdispatch.seek(file_position)
     def get_initial_start_time(self):
         return self.initial_start_time
     def get_start_time(self):
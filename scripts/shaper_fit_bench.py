@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# Benchmark input shaper fitting on saved calibration data
+#
+# Copyright (C) 2025 K2 Unleashed Contributors
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+#
+# Replays calibration_data_*.csv files (as written by SHAPER_CALIBRATE)
+# through the previous per-frequency fit and the current one, checks that
+# both select the same shapers and reports the time taken:
+#   shaper_fit_bench.py calibration_data_x.csv calibration_data_y.csv
+import importlib, optparse, os, sys, time, math, multiprocessing
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy'))
+shaper_calibrate = importlib.import_module('.shaper_calibrate', 'extras')
+shaper_defs = importlib.import_module('.shaper_defs', 'extras')
+
+def parse_log(logname):
+    # Same handling of PSD files as calibrate_shaper.py
+    with open(logname) as f:
+        for header in f:
+            if not header.startswith('#'):
+                break
+    if not header.startswith('freq,psd_x,psd_y,psd_z,psd_xyz'):
+        raise ValueError("%s is not a calibration data file" % (logname,))
+    data = np.loadtxt(logname, skiprows=1, comments='#', delimiter=',')
+    calibration_data = shaper_calibrate.CalibrationData(
+            freq_bins=data[:,0], psd_sum=data[:,4],
+            psd_x=data[:,1], psd_y=data[:,2], psd_z=data[:,3])
+    calibration_data.set_numpy(np)
+    if 'mzv' not in header:
+        calibration_data.normalize_to_frequencies()
+    return calibration_data
+
+def make_helper():
+    # ShaperCalibrate() wants a printer to read the autotune shaper list
+    helper = shaper_calibrate.ShaperCalibrate.__new__(
+            shaper_calibrate.ShaperCalibrate)
+    helper.printer = None
+    helper.error = Exception
+    helper.numpy = np
+    helper.autotune_shapers = list(shaper_calibrate.AUTOTUNE_SHAPERS)
+    return helper
+
+######################################################################
+# Previous implementation (one frequency at a time)
+######################################################################
+
+def legacy_estimate_remaining_vibrations(shaper, dr, freq_bins, psd):
+    A, T = np.array(shaper[0]), np.array(shaper[1])
+    inv_D = 1. / A.sum()
+    omega = 2. * math.pi * freq_bins
+    damping = dr * omega
+    omega_d = omega * math.sqrt(1. - dr**2)
+    W = A * np.exp(np.outer(-damping, (T[-1] - T)))
+    S = W * np.sin(np.outer(omega_d, T))
+    C = W * np.cos(np.outer(omega_d, T))
+    vals = np.sqrt(S.sum(axis=1)**2 + C.sum(axis=1)**2) * inv_D
+    vibr_threshold = psd.max() / shaper_defs.SHAPER_VIBRATION_REDUCTION
+    remaining_vibrations = np.maximum(vals * psd - vibr_threshold, 0).sum()
+    all_vibrations = np.maximum(psd - vibr_threshold, 0).sum()
+    return (remaining_vibrations / all_vibrations, vals)
+
+def legacy_get_shaper_smoothing(shaper, accel=5000, scv=5.):
+    half_accel = accel * .5
+    A, T = shaper
+    inv_D = 1. / sum(A)
+    n = len(T)
+    ts = sum([A[i] * T[i] for i in range(n)]) * inv_D
+    offset_90 = offset_180 = 0.
+    for i in range(n):
+        if T[i] >= ts:
+            offset_90 += A[i] * (scv + half_accel * (T[i]-ts)) * (T[i]-ts)
+        offset_180 += A[i] * half_accel * (T[i]-ts)**2
+    offset_90 *= inv_D * math.sqrt(2.)
+    offset_180 *= inv_D
+    return max(offset_90, offset_180)
+
+def legacy_find_shaper_max_accel(shaper):
+    func = lambda accel: legacy_get_shaper_smoothing(shaper, accel) <= 0.12
+    left = right = 1.
+    while not func(left):
+        right = left
+        left *= .5
+    if right == left:
+        while func(right):
+            right *= 2.
+    while right - left > 1e-8:
+        middle = (left + right) * .5
+        if func(middle):
+            left = middle
+        else:
+            right = middle
+    return left
+
+def legacy_fit_shaper(shaper_cfg, calibration_data, max_smoothing):
+    test_freqs = np.arange(shaper_cfg.min_freq,
+                           shaper_calibrate.MAX_SHAPER_FREQ, .2)
+    freq_bins = calibration_data.freq_bins
+    psd = calibration_data.psd_sum[freq_bins <= shaper_calibrate.MAX_FREQ]
+    freq_bins = freq_bins[freq_bins <= shaper_calibrate.MAX_FREQ]
+    best_res = None
+    results = []
+    for test_freq in test_freqs[::-1]:
+        shaper_vibrations = 0.
+        shaper_vals = np.zeros(shape=freq_bins.shape)
+        shaper = shaper_cfg.init_func(
+                test_freq, shaper_defs.DEFAULT_DAMPING_RATIO)
+        shaper_smoothing = legacy_get_shaper_smoothing(shaper)
+        if max_smoothing and shaper_smoothing > max_smoothing and best_res:
+            return best_res
+        for dr in shaper_calibrate.TEST_DAMPING_RATIOS:
+            vibrations, vals = legacy_estimate_remaining_vibrations(
+                    shaper, dr, freq_bins, psd)
+            shaper_vals = np.maximum(shaper_vals, vals)
+            if vibrations > shaper_vibrations:
+                shaper_vibrations = vibrations
+        max_accel = legacy_find_shaper_max_accel(shaper)
+        shaper_score = shaper_smoothing * (shaper_vibrations**1.5 +
+                                           shaper_vibrations * .2 + .01)
+        results.append(
+                shaper_calibrate.CalibrationResult(
+                    name=shaper_cfg.name, freq=test_freq, vals=shaper_vals,
+                    vibrs=shaper_vibrations, smoothing=shaper_smoothing,
+                    score=shaper_score, max_accel=max_accel))
+        if best_res is None or best_res.vibrs > results[-1].vibrs:
+            best_res = results[-1]
+    selected = best_res
+    for res in results[::-1]:
+        if res.vibrs < best_res.vibrs * 1.1 and res.score < selected.score:
+            selected = res
+    return selected
+
+def legacy_fit_shapers(calibration_data, max_smoothing):
+    return [legacy_fit_shaper(shaper_cfg, calibration_data, max_smoothing)
+            for shaper_cfg in shaper_defs.INPUT_SHAPERS
+            if shaper_cfg.name in shaper_calibrate.AUTOTUNE_SHAPERS]
+
+######################################################################
+# Comparison
+######################################################################
+
+def compare(old, new):
+    errors = []
+    for o, n in zip(old, new):
+        for field in ('name', 'freq', 'vibrs', 'smoothing', 'score',
+                      'max_accel'):
+            if getattr(o, field) != getattr(n, field):
+                errors.append("%s %s: %r != %r" % (
+                    o.name, field, getattr(o, field), getattr(n, field)))
+        if not np.array_equal(o.vals, n.vals):
+            errors.append("%s vals: max diff %g" % (
+                o.name, np.abs(o.vals - n.vals).max()))
+    return errors
+
+def fit_parallel(datas, max_smoothing):
+    # Fork one process per data set, like background_process_exec_many()
+    # (CalibrationData holds the numpy module, so it can not be pickled)
+    procs = []
+    for data in datas:
+        parent_conn, child_conn = multiprocessing.Pipe()
+        def wrapper(conn=child_conn, data=data):
+            conn.send(make_helper().fit_shapers(data, max_smoothing))
+            conn.close()
+        proc = multiprocessing.Process(target=wrapper)
+        proc.start()
+        procs.append((proc, parent_conn))
+    results = [parent_conn.recv() for proc, parent_conn in procs]
+    for proc, parent_conn in procs:
+        proc.join()
+    return results
+
+def main():
+    usage = "%prog [options] <calibration csv> [<calibration csv> ...]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-s", "--max_smoothing", type="float",
+                    dest="max_smoothing", default=None,
+                    help="maximum shaper smoothing to allow")
+    opts.add_option("-r", "--repeat", type="int", dest="repeat", default=1,
+                    help="number of timed runs per file")
+    options, args = opts.parse_args()
+    if not args:
+        opts.error("Incorrect number of arguments")
+    datas = [parse_log(fname) for fname in args]
+    helper = make_helper()
+    failed = False
+    total_old = total_new = 0.
+    for fname, data in zip(args, datas):
+        start = time.perf_counter()
+        for i in range(options.repeat):
+            old = legacy_fit_shapers(data, options.max_smoothing)
+        old_t = (time.perf_counter() - start) / options.repeat
+        start = time.perf_counter()
+        for i in range(options.repeat):
+            new = helper.fit_shapers(data, options.max_smoothing)
+        new_t = (time.perf_counter() - start) / options.repeat
+        total_old += old_t
+        total_new += new_t
+        errors = compare(old, new)
+        failed |= bool(errors)
+        print("%s: legacy=%.3fs new=%.3fs speedup=%.1fx %s" % (
+            os.path.basename(fname), old_t, new_t, old_t / new_t,
+            "identical" if not errors else "MISMATCH"))
+        for error in errors:
+            print("  " + error)
+    print("all files: legacy=%.3fs new=%.3fs speedup=%.1fx" % (
+        total_old, total_new, total_old / total_new))
+    if len(datas) > 1:
+        # All files at once, one process per file (as SHAPER_CALIBRATE
+        # does for the X and Y axes)
+        start = time.perf_counter()
+        fit_parallel(datas, options.max_smoothing)
+        print("all files in parallel: new=%.3fs" % (
+            time.perf_counter() - start,))
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()